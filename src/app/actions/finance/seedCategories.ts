@@ -42,6 +42,9 @@ export async function seedDefaultFinanceCategories(lang: Lang = 'en') {
   if (existing && existing.length > 0) return; // already seeded
 
   const rows = DEFAULTS[lang].map((c) => ({ ...c, user_id: user.id }));
-  const { error } = await supabase.from('finance_categories').insert(rows);
+  // Two tabs seeding at once must not trip the (user_id, name, type) unique key
+  const { error } = await supabase
+    .from('finance_categories')
+    .upsert(rows, { onConflict: 'user_id,name,type', ignoreDuplicates: true });
   if (error) throw error;
 }
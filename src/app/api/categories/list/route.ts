@@ -64,9 +64,22 @@ export async function POST(request: NextRequest) {
 			type: String(body.type),
 			color: body.color ?? null,
 		};
-		const { data, error } = await sb.from('finance_categories').insert(insert).select('*').single();
+		// (user_id, name, type) is unique: an existing category is returned instead of a conflict
+		const { data: created, error } = await sb
+			.from('finance_categories')
+			.upsert(insert, { onConflict: 'user_id,name,type', ignoreDuplicates: true })
+			.select('*');
 		if (error) return NextResponse.json({ error: error.message }, { status: 400 });
-		return NextResponse.json(data, { status: 201 });
+		if (created && created.length > 0) return NextResponse.json(created[0], { status: 201 });
+		const { data, error: e2 } = await sb
+			.from('finance_categories')
+			.select('*')
+			.eq('user_id', user.id)
+			.eq('name', insert.name)
+			.eq('type', insert.type)
+			.single();
+		if (e2) return NextResponse.json({ error: e2.message }, { status: 400 });
+		return NextResponse.json(data, { status: 200 });
 		} catch (e: any) {
 			console.error('categories POST error:', e);
 			const msg = e?.message ? String(e.message) : String(e);
@@ -107,6 +120,9 @@ export async function PUT(request: NextRequest) {
 			.eq('user_id', user.id)
 			.select('*')
 			.single();
+		if (error?.code === '23505') {
+			return NextResponse.json({ error: 'A category with this name and type already exists' }, { status: 409 });
+		}
 		if (error) return NextResponse.json({ error: error.message }, { status: 400 });
 		return NextResponse.json(data, { status: 200 });
 		} catch (e: any) {
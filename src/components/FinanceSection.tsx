@@ -1263,29 +1263,33 @@ const FinanceSection = forwardRef<FinanceSectionRef, FinanceSectionProps>(
         const catNameRaw = (transactionData.category || '').trim();
         const txType = (transactionData.type as any) || 'expense';
         if (!catNameRaw || txType === 'transfer') return null;
-        // Try exact first (pick most recent if duplicates)
-        const { data: catExact } = await supabase
+        const catType = txType === 'income' ? 'income' : 'expense';
+        const findCategory = () => supabase
           .from('finance_categories')
           .select('id')
           .eq('user_id', userRes.user.id)
           .eq('name', catNameRaw)
-          .order('id', { ascending: false })
+          .eq('type', catType)
           .limit(1)
           .maybeSingle();
+        const { data: catExact } = await findCategory();
         if (catExact?.id) return String(catExact.id);
-        // Insert new category
+        // Insert if absent; (user_id, name, type) is unique, so a category created
+        // meanwhile (e.g. by the Telegram bot) is kept and read back
         const { data: inserted, error } = await supabase
           .from('finance_categories')
-          .insert({
+          .upsert({
             user_id: userRes.user.id,
             name: catNameRaw,
-            type: txType === 'income' ? 'income' : 'expense',
+            type: catType,
             color: '#06B6D4',
-          })
-          .select('id')
-          .single();
+          }, { onConflict: 'user_id,name,type', ignoreDuplicates: true })
+          .select('id');
         if (error) throw new Error(`Failed to create category: ${error.message}`);
-        return String(inserted.id);
+        if (inserted && inserted.length > 0) return String(inserted[0].id);
+        const { data: existing } = await findCategory();
+        if (!existing?.id) throw new Error('Failed to create category');
+        return String(existing.id);
       };
 
   // Resolve ids once
@@ -0,0 +1,92 @@
+-- Migration: Database-side aggregation for the bot's weekly summary
+-- Date: 2026-10-17
+-- Purpose: /week used to pull every transaction, category and task of the period into
+--          the bot and sum them in Python. activity_summary() returns the totals, top
+--          categories (names joined) and task counts in one call, for any range and
+--          day/week/month buckets, backed by covering (user_id, date) indexes.
+
+-- Covering indexes for per-user range scans (the summary reads only included columns)
+create index if not exists finance_transactions_user_occurred_idx
+  on public.finance_transactions (user_id, occurred_at)
+  include (type, amount, currency, category_id);
+create index if not exists planner_items_user_created_idx
+  on public.planner_items (user_id, created_at)
+  include (status, due_date);
+
+-- Finance/task summary for one user over [p_from, p_to], bucketed by p_granularity
+-- ('day' | 'week' | 'month') in time zone p_tz. Returns:
+--   { currency, totals: {type: amount}, top_categories: [{name, amount}],
+--     tasks: {created, done}, buckets: [{start, income, expense, tasks_created, tasks_done}] }
+-- Expense figures include every non-income type; tasks count items created in the range
+-- or created earlier and due in it.
+create or replace function public.activity_summary(
+  p_user_id uuid,
+  p_from timestamptz,
+  p_to timestamptz,
+  p_granularity text default 'week',
+  p_top int default 3,
+  p_tz text default 'UTC'
+)
+returns jsonb
+language sql
+stable
+as $$
+  with tx as (
+    select t.type, t.amount, t.currency, t.category_id, t.occurred_at,
+           date_trunc(p_granularity, t.occurred_at at time zone p_tz) as bucket
+    from public.finance_transactions t
+    where t.user_id = p_user_id and t.occurred_at >= p_from and t.occurred_at <= p_to
+  ),
+  tasks as (
+    select date_trunc(p_granularity, greatest(p.created_at, p_from) at time zone p_tz) as bucket,
+           lower(p.status) in ('done', 'completed') as done
+    from public.planner_items p
+    where p.user_id = p_user_id and p.created_at <= p_to
+      and (p.created_at >= p_from or p.due_date >= p_from)
+  ),
+  tx_buckets as (
+    select bucket,
+           coalesce(sum(amount) filter (where type = 'income'), 0) as income,
+           coalesce(sum(amount) filter (where type <> 'income'), 0) as expense
+    from tx group by bucket
+  ),
+  task_buckets as (
+    select bucket, count(*) as created, count(*) filter (where done) as done
+    from tasks group by bucket
+  )
+  select jsonb_build_object(
+    'from', p_from,
+    'to', p_to,
+    'granularity', p_granularity,
+    'currency', (select currency from tx order by occurred_at desc limit 1),
+    'totals', coalesce((
+      select jsonb_object_agg(type, total)
+      from (select type, sum(amount) as total from tx group by type) s
+    ), '{}'::jsonb),
+    'top_categories', coalesce((
+      select jsonb_agg(jsonb_build_object('name', name, 'amount', total) order by total desc, name)
+      from (
+        select coalesce(c.name, 'Other') as name, sum(tx.amount) as total
+        from tx left join public.finance_categories c on c.id = tx.category_id
+        where tx.type <> 'income'
+        group by 1
+        order by 2 desc, 1
+        limit greatest(p_top, 0)
+      ) s
+    ), '[]'::jsonb),
+    'tasks', jsonb_build_object(
+      'created', (select count(*) from tasks),
+      'done', (select count(*) from tasks where done)
+    ),
+    'buckets', coalesce((
+      select jsonb_agg(jsonb_build_object(
+               'start', coalesce(f.bucket, k.bucket),
+               'income', coalesce(f.income, 0),
+               'expense', coalesce(f.expense, 0),
+               'tasks_created', coalesce(k.created, 0),
+               'tasks_done', coalesce(k.done, 0)
+             ) order by coalesce(f.bucket, k.bucket))
+      from tx_buckets f full join task_buckets k on k.bucket = f.bucket
+    ), '[]'::jsonb)
+  );
+$$;
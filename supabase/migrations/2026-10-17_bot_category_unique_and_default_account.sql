@@ -0,0 +1,52 @@
+-- Migration: Atomic bot-side category/default-account creation
+-- Date: 2026-10-17
+-- Purpose: Let the Telegram bot create a missing category or default account with an
+--          atomic insert-if-absent instead of check-then-insert, so parallel messages
+--          cannot create duplicates.
+
+-- 1) Collapse existing duplicate categories (same user, name and type) onto the oldest-id
+--    row. An income and an expense category may share a name and are kept apart.
+with ranked as (
+  select id, first_value(id) over (partition by user_id, name, type order by id) as keep_id
+  from public.finance_categories
+)
+update public.finance_transactions t
+set category_id = r.keep_id
+from ranked r
+where t.category_id = r.id and r.id <> r.keep_id;
+
+delete from public.finance_categories c
+using public.finance_categories k
+where c.user_id = k.user_id and c.name = k.name and c.type = k.type and c.id > k.id;
+
+alter table public.finance_categories
+  drop constraint if exists finance_categories_user_name_key;
+alter table public.finance_categories
+  drop constraint if exists finance_categories_user_name_type_key;
+alter table public.finance_categories
+  add constraint finance_categories_user_name_type_key unique (user_id, name, type);
+
+-- 2) Return the user's default account id, creating a 'Cash' account if none exists.
+--    The app may flag several accounts as default, so instead of a unique index the
+--    check and insert are serialized per user with a transaction-scoped advisory lock.
+create or replace function public.ensure_default_finance_account(p_user_id uuid)
+returns uuid
+language plpgsql
+as $$
+declare
+  v_id uuid;
+begin
+  perform pg_advisory_xact_lock(hashtext('finance_default_account:' || p_user_id::text));
+
+  select id into v_id from public.finance_accounts
+  where user_id = p_user_id and is_default
+  order by created_at
+  limit 1;
+  if v_id is null then
+    insert into public.finance_accounts (user_id, name, type, is_default)
+    values (p_user_id, 'Cash', 'cash', true)
+    returning id into v_id;
+  end if;
+  return v_id;
+end;
+$$;
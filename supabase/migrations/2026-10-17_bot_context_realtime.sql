@@ -0,0 +1,21 @@
+-- Migration: Realtime feed for the bot's per-user context snapshots
+-- Date: 2026-10-17
+-- Purpose: the bot keeps a small snapshot per user (profile, categories, recent
+--          transactions, open planner items) and patches it from postgres_changes
+--          instead of re-reading the tables on every message. This adds the four
+--          tables to the supabase_realtime publication (same as enabling them under
+--          Database -> Replication in the dashboard). Safe to re-run.
+
+do $$
+declare
+  t text;
+begin
+  foreach t in array array['user_profiles', 'finance_categories', 'finance_transactions', 'planner_items'] loop
+    if not exists (
+      select 1 from pg_publication_tables
+      where pubname = 'supabase_realtime' and schemaname = 'public' and tablename = t
+    ) then
+      execute format('alter publication supabase_realtime add table public.%I', t);
+    end if;
+  end loop;
+end $$;
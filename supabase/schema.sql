@@ -175,6 +175,138 @@ create index if not exists planner_items_user_idx on public.planner_items(user_i
 create index if not exists planner_items_type_idx on public.planner_items(type);
 create index if not exists planner_items_created_idx on public.planner_items(created_at desc);
 
+-- One category per (user, name, type); lets the bot and the app insert-if-absent atomically.
+-- Existing duplicates are merged by migrations/2026-10-17_bot_category_unique_and_default_account.sql;
+-- until that has run, the constraint is skipped rather than failing the whole script.
+do $$
+begin
+  if not exists (select 1 from pg_constraint where conname = 'finance_categories_user_name_type_key') then
+    if exists (
+      select 1 from public.finance_categories
+      group by user_id, name, type having count(*) > 1
+    ) then
+      raise notice 'finance_categories has duplicate (user_id, name, type) rows; run the 2026-10-17 category migration';
+    else
+      alter table public.finance_categories
+        drop constraint if exists finance_categories_user_name_key;
+      alter table public.finance_categories
+        add constraint finance_categories_user_name_type_key unique (user_id, name, type);
+    end if;
+  end if;
+end $$;
+
+-- Return the user's default account id, creating a 'Cash' account if none exists
+-- (serialized per user with an advisory lock; the app may flag several defaults)
+create or replace function public.ensure_default_finance_account(p_user_id uuid)
+returns uuid
+language plpgsql
+as $$
+declare
+  v_id uuid;
+begin
+  perform pg_advisory_xact_lock(hashtext('finance_default_account:' || p_user_id::text));
+
+  select id into v_id from public.finance_accounts
+  where user_id = p_user_id and is_default
+  order by created_at
+  limit 1;
+  if v_id is null then
+    insert into public.finance_accounts (user_id, name, type, is_default)
+    values (p_user_id, 'Cash', 'cash', true)
+    returning id into v_id;
+  end if;
+  return v_id;
+end;
+$$;
+
+-- Per-user summary used by the bot's /week and digests
+-- (see migrations/2026-10-17_activity_summary.sql)
+-- Covering indexes for per-user range scans (the summary reads only included columns)
+create index if not exists finance_transactions_user_occurred_idx
+  on public.finance_transactions (user_id, occurred_at)
+  include (type, amount, currency, category_id);
+create index if not exists planner_items_user_created_idx
+  on public.planner_items (user_id, created_at)
+  include (status, due_date);
+
+-- Finance/task summary for one user over [p_from, p_to], bucketed by p_granularity
+-- ('day' | 'week' | 'month') in time zone p_tz. Returns:
+--   { currency, totals: {type: amount}, top_categories: [{name, amount}],
+--     tasks: {created, done}, buckets: [{start, income, expense, tasks_created, tasks_done}] }
+-- Expense figures include every non-income type; tasks count items created in the range
+-- or created earlier and due in it.
+create or replace function public.activity_summary(
+  p_user_id uuid,
+  p_from timestamptz,
+  p_to timestamptz,
+  p_granularity text default 'week',
+  p_top int default 3,
+  p_tz text default 'UTC'
+)
+returns jsonb
+language sql
+stable
+as $$
+  with tx as (
+    select t.type, t.amount, t.currency, t.category_id, t.occurred_at,
+           date_trunc(p_granularity, t.occurred_at at time zone p_tz) as bucket
+    from public.finance_transactions t
+    where t.user_id = p_user_id and t.occurred_at >= p_from and t.occurred_at <= p_to
+  ),
+  tasks as (
+    select date_trunc(p_granularity, greatest(p.created_at, p_from) at time zone p_tz) as bucket,
+           lower(p.status) in ('done', 'completed') as done
+    from public.planner_items p
+    where p.user_id = p_user_id and p.created_at <= p_to
+      and (p.created_at >= p_from or p.due_date >= p_from)
+  ),
+  tx_buckets as (
+    select bucket,
+           coalesce(sum(amount) filter (where type = 'income'), 0) as income,
+           coalesce(sum(amount) filter (where type <> 'income'), 0) as expense
+    from tx group by bucket
+  ),
+  task_buckets as (
+    select bucket, count(*) as created, count(*) filter (where done) as done
+    from tasks group by bucket
+  )
+  select jsonb_build_object(
+    'from', p_from,
+    'to', p_to,
+    'granularity', p_granularity,
+    'currency', (select currency from tx order by occurred_at desc limit 1),
+    'totals', coalesce((
+      select jsonb_object_agg(type, total)
+      from (select type, sum(amount) as total from tx group by type) s
+    ), '{}'::jsonb),
+    'top_categories', coalesce((
+      select jsonb_agg(jsonb_build_object('name', name, 'amount', total) order by total desc, name)
+      from (
+        select coalesce(c.name, 'Other') as name, sum(tx.amount) as total
+        from tx left join public.finance_categories c on c.id = tx.category_id
+        where tx.type <> 'income'
+        group by 1
+        order by 2 desc, 1
+        limit greatest(p_top, 0)
+      ) s
+    ), '[]'::jsonb),
+    'tasks', jsonb_build_object(
+      'created', (select count(*) from tasks),
+      'done', (select count(*) from tasks where done)
+    ),
+    'buckets', coalesce((
+      select jsonb_agg(jsonb_build_object(
+               'start', coalesce(f.bucket, k.bucket),
+               'income', coalesce(f.income, 0),
+               'expense', coalesce(f.expense, 0),
+               'tasks_created', coalesce(k.created, 0),
+               'tasks_done', coalesce(k.done, 0)
+             ) order by coalesce(f.bucket, k.bucket))
+      from tx_buckets f full join task_buckets k on k.bucket = f.bucket
+    ), '[]'::jsonb)
+  );
+$$;
+
 -- Ensure new columns exist when re-running on an existing database
 alter table if exists public.planner_items
   add column if not exists checklist jsonb not null default '[]'::jsonb;
@@ -257,3 +389,5 @@ create policy subs_delete on public.subscriptions for delete using (auth.uid() =
 
 -- Realtime
 -- In Supabase Dashboard -> Database -> Replication, enable "postgres_changes" for these tables under the public schema.
+-- The Telegram bot's context snapshots listen to user_profiles, finance_categories, finance_transactions
+-- and planner_items (see migrations/2026-10-17_bot_context_realtime.sql).
@@ -0,0 +1,362 @@
+"""Generator for the labeled NLU corpus (bench/nlu_corpus.jsonl).
+
+Run from telegram-bot/:
+
+    python -m bench.corpus_gen [--seed 17] [--per-template 160] [--out PATH]
+
+Utterances are built from EN/RU/UZ templates whose slots (amounts in many
+spellings, currencies, categories, days, clock times, relative offsets) carry
+their own expected values, so every line is labeled by construction. Labels
+use the parser_bench fields and the same fixed "now" (Wednesday 2025-01-15
+12:00). A field is only labeled where the template pins it down; the output
+is deterministic for a given seed, so regenerate rather than hand-edit.
+
+The templates follow the shapes the parser was written for, so this corpus
+guards against regressions but says little about messy real input; that is
+what the hand-labelled bench/nlu_hard.jsonl is for.
+"""
+import argparse, json, os, random, sys
+from datetime import datetime, timedelta
+
+OUT = os.path.join(os.path.dirname(__file__), "nlu_corpus.jsonl")
+NOW = datetime(2025, 1, 15, 12, 0)
+
+# --- amount spellings: (text, value) ---
+
+def _group(n: int, sep: str) -> str:
+    return f"{n:,}".replace(",", sep)
+
+def amt_plain(r):
+    n = r.choice([r.randint(1, 99), r.randint(100, 999), r.randint(1000, 99999), r.randint(100000, 9999999)])
+    return str(n), n
+
+def amt_space(r):
+    n = r.randint(1, 999) * 1000 + r.choice([0, 0, r.randint(1, 999)])
+    return _group(n, " "), n
+
+def amt_nbsp(r):
+    n = r.randint(1, 99) * 1000
+    return _group(n, " "), n
+
+def amt_million_space(r):
+    n = r.randint(1, 9) * 1_000_000 + r.randint(0, 9) * 100_000
+    return _group(n, " "), n
+
+def amt_comma(r):
+    n = r.randint(1, 999) * 1000 + r.randint(0, 999)
+    return _group(n, ","), n
+
+def amt_dot_groups(r):
+    n = r.randint(1, 9) * 1_000_000 + r.randint(0, 999) * 1000
+    return _group(n, "."), n
+
+def amt_odd_sep(r):
+    n = r.randint(1, 99) * 1000
+    return _group(n, r.choice(["_", "'"])), n
+
+def amt_cents(r):
+    whole, cents = r.randint(1, 9999), r.randint(1, 99)
+    s = f"{_group(whole, ',')}.{cents:02d}"
+    return s, round(whole + cents / 100, 2)
+
+def amt_decimal(r):
+    whole, cents = r.randint(1, 999), r.choice([5, 25, 50, 75, 99])
+    return f"{whole}{r.choice(['.', ','])}{cents:02d}", round(whole + cents / 100, 2)
+
+def amt_k(r):
+    n = r.randint(1, 999)
+    if r.random() < 0.3:
+        half = r.randint(1, 9)
+        return f"{n}{r.choice(['.', ','])}{half}{r.choice(['k', 'K', ' k'])}", n * 1000 + half * 100
+    return f"{n}{r.choice(['k', 'K', ' k'])}", n * 1000
+
+def amt_m(r):
+    n = r.randint(1, 20)
+    if r.random() < 0.4:
+        half = r.randint(1, 9)
+        return f"{n}.{half}{r.choice(['m', ' mln', ' million'])}", n * 1_000_000 + half * 100_000
+    return f"{n}{r.choice(['m', ' mln', ' million'])}", n * 1_000_000
+
+def amt_thousand_en(r):
+    n = r.randint(2, 900)
+    return f"{n} thousand", n * 1000
+
+def amt_ru(r):
+    n = r.randint(1, 999)
+    kind = r.random()
+    if kind < 0.35:
+        return f"{n}{r.choice(['к', ' к'])}", n * 1000
+    if kind < 0.7:
+        return f"{n} тыс", n * 1000
+    m = r.randint(1, 9)
+    if r.random() < 0.5:
+        return f"{m},{n % 9 + 1} млн", m * 1_000_000 + (n % 9 + 1) * 100_000
+    return f"{m} млн", m * 1_000_000
+
+def amt_uz(r):
+    n = r.randint(1, 999)
+    if r.random() < 0.7:
+        return f"{n} ming", n * 1000
+    m = r.randint(1, 20)
+    return f"{m} mln", m * 1_000_000
+
+AMOUNTS = {
+    "en": [amt_plain, amt_space, amt_comma, amt_cents, amt_decimal, amt_k, amt_m, amt_thousand_en,
+           amt_dot_groups, amt_odd_sep, amt_million_space],
+    "ru": [amt_plain, amt_space, amt_nbsp, amt_decimal, amt_ru, amt_million_space],
+    "uz": [amt_plain, amt_space, amt_uz, amt_million_space],
+}
+
+# --- currencies: (prefix, suffix, code) ---
+
+CURRENCIES = {
+    "en": [("", "", None), ("", "", None), ("$", "", "USD"), ("", "$", "USD"), ("", " usd", "USD"),
+           ("", " dollars", "USD"), ("€", "", "EUR"), ("", " eur", "EUR"), ("", " euro", "EUR"),
+           ("", " sum", "UZS"), ("", " uzs", "UZS"), ("", " rub", "RUB")],
+    "ru": [("", "", None), ("", "", None), ("", " сум", "UZS"), ("", " сумов", "UZS"), ("", " руб", "RUB"),
+           ("", " рублей", "RUB"), ("", " долларов", "USD"), ("", " евро", "EUR"), ("", "₽", "RUB")],
+    "uz": [("", "", None), ("", " so'm", "UZS"), ("", " som", "UZS"), ("", " sum", "UZS"), ("", " dollar", "USD")],
+}
+
+CATEGORIES = {
+    "en": ["food", "taxi", "groceries", "coffee", "rent", "books", "lunch", "dinner", "gym", "internet",
+           "phone bill", "medicine", "clothes", "gifts", "fuel", "parking", "cinema", "flowers", "haircut", "bus"],
+    "ru": ["продукты", "такси", "кафе", "аренду", "книги", "обед", "бензин", "лекарства", "одежду", "подарки",
+           "интернет", "метро", "ремонт", "парковку", "кино"],
+}
+INCOME_SOURCES = ["freelance", "consulting", "tutoring", "rent", "design work", "a side project"]
+NAMES = ["mom", "dad", "Amir", "Sara", "Dilnoza", "Timur", "the bank", "John", "Aziz", "Olga"]
+TASKS_EN = ["dentist", "standup", "gym", "review", "yoga", "flight", "doctor", "haircut", "team sync"]
+TASKS_RU = ["созвон", "тренировка", "врач", "встреча", "стрижка", "планёрка"]
+TASKS_UZ = ["uchrashuv", "vazifa", "majlis", "sport zal"]
+WEEKDAYS = {
+    "en": ["monday", "tuesday", "wednesday", "thursday", "friday", "saturday", "sunday"],
+    "ru": ["понедельник", "вторник", "среду", "четверг", "пятницу", "субботу", "воскресенье"],
+    "uz": ["dushanba", "seshanba", "chorshanba", "payshanba", "juma", "shanba", "yakshanba"],
+}
+
+def _fmt(dt: datetime) -> str:
+    return dt.strftime("%Y-%m-%d %H:%M")
+
+def _on(day_offset: int, hh: int, mm: int = 0) -> str:
+    return _fmt((NOW + timedelta(days=day_offset)).replace(hour=hh, minute=mm))
+
+def _weekday(wd: int, clock: tuple[int, int] | None) -> str:
+    ahead = (wd - NOW.weekday()) % 7
+    if ahead == 0 and clock is not None and clock <= (NOW.hour, NOW.minute):
+        ahead = 7
+    hh, mm = clock if clock is not None else (9, 0)
+    return _on(ahead, hh, mm)
+
+def _money(r, lang: str) -> tuple[str, float, str | None]:
+    text, value = r.choice(AMOUNTS[lang])(r)
+    pre, suf, code = r.choice(CURRENCIES[lang])
+    return f"{pre}{text}{suf}", value, code
+
+# --- templates: each returns one labeled case ---
+
+def expense_en(r):
+    money, value, cur = _money(r, "en")
+    cat = r.choice(CATEGORIES["en"])
+    verb = r.choice(["spent", "paid", "I spent", "Spent", "just paid", "bought"])
+    prep = "for" if verb.endswith(("paid", "bought")) else r.choice(["on", "on", "for"])
+    return {"text": f"{verb} {money} {prep} {cat}", "intent": "add_expense", "amount": value,
+            "currency": cur, "category": cat.title()}
+
+def expense_en_front(r):
+    money, value, cur = _money(r, "en")
+    cat = r.choice(CATEGORIES["en"])
+    return {"text": f"{cat} {money} {r.choice(['spent', 'paid'])}", "intent": "add_expense", "amount": value, "currency": cur}
+
+def expense_ru(r):
+    money, value, cur = _money(r, "ru")
+    cat = r.choice(CATEGORIES["ru"])
+    verb = r.choice(["потратил", "потратила", "оплатил", "заплатила", "расход"])
+    return {"text": f"{verb} {money} на {cat}", "intent": "add_expense", "amount": value,
+            "currency": cur, "category": cat.title()}
+
+def expense_ru_item(r):
+    money, value, cur = _money(r, "ru")
+    item = r.choice(["кофе", "хлеб", "билеты", "цветы", "корм коту"])
+    return {"text": f"{r.choice(['купил', 'купила'])} {item} {money}", "intent": "add_expense", "amount": value, "currency": cur}
+
+def expense_uz(r):
+    money, value, cur = _money(r, "uz")
+    item = r.choice(["taksi", "ovqat", "non", "kiyim", "benzin", "internet"])
+    form = r.randrange(3)
+    if form == 0:
+        text = f"{item} uchun {money} to'ladim"
+    elif form == 1:
+        text = f"{money} {item}ga sarfladim"
+    else:
+        text = f"xarajat {money} {item}"
+    return {"text": text, "intent": "add_expense", "amount": value, "currency": cur}
+
+def income_en(r):
+    money, value, cur = _money(r, "en")
+    form = r.randrange(4)
+    if form == 0:
+        return {"text": f"salary {money}", "intent": "add_income", "amount": value, "currency": cur, "category": "Salary"}
+    if form == 1:
+        src = r.choice(INCOME_SOURCES)
+        return {"text": f"earned {money} for {src}", "intent": "add_income", "amount": value, "currency": cur,
+                "category": src.title()}
+    if form == 2:
+        return {"text": f"add income {money}", "intent": "add_income", "amount": value, "currency": cur}
+    return {"text": f"bonus {money}", "intent": "add_income", "amount": value, "currency": cur, "category": "Bonus"}
+
+def income_ru(r):
+    money, value, cur = _money(r, "ru")
+    verb = r.choice(["заработал", "заработала", "доход", "получил", "зарплата"])
+    return {"text": f"{verb} {money}", "intent": "add_income", "amount": value, "currency": cur}
+
+def income_uz(r):
+    money, value, cur = _money(r, "uz")
+    return {"text": f"{r.choice(['oylik', 'maosh', 'daromad'])} {money}", "intent": "add_income", "amount": value, "currency": cur}
+
+def task_en_day(r):
+    task = r.choice(TASKS_EN)
+    day, offset = r.choice([("today", 0), ("tomorrow", 1), ("day after tomorrow", 2)])
+    form = r.randrange(4)
+    if form == 0:
+        hh = r.randint(1, 11)
+        return {"text": f"{day} at {hh}pm {task}", "intent": "add_task" if offset else "unknown",
+                "amount": None, "when": _on(offset, hh + 12)}
+    if form == 1:
+        hh, mm = r.randint(6, 22), r.choice([0, 15, 30, 45])
+        return {"text": f"{day} {hh}:{mm:02d} meeting", "intent": "add_task", "amount": None, "when": _on(offset, hh, mm)}
+    if form == 2:
+        hh = r.randint(7, 11)
+        return {"text": f"{day} at {hh}am {task}", "intent": "add_task" if offset else "unknown",
+                "amount": None, "when": _on(offset, hh)}
+    if offset == 0:
+        return {"text": f"remind me to {task} today", "intent": "add_task", "when": _on(0, 9)}
+    return {"text": f"{day} {task}", "intent": "add_task", "amount": None, "when": _on(offset, 9)}
+
+def task_en_call(r):
+    who = r.choice(NAMES)
+    form = r.randrange(3)
+    if form == 0:
+        hh = r.randint(1, 11)
+        return {"text": f"call {who} at {hh}pm", "intent": "add_task", "amount": None,
+                "when": _on(0, hh + 12), "title": f"Call {who.title()}"}
+    if form == 1:
+        n = r.randint(1, 6)
+        return {"text": f"in {n} hours call {who}", "intent": "add_task", "amount": None,
+                "when": _fmt(NOW + timedelta(hours=n)), "title": f"Call {who.title()}"}
+    hh, mm = r.randint(8, 20), r.choice([0, 30])
+    return {"text": f"meeting with {who} at {hh}:{mm:02d}", "intent": "add_task", "amount": None,
+            "when": _on(0, hh, mm), "title": f"Meeting with {who.title()}"}
+
+def task_en_relative(r):
+    task = r.choice(TASKS_EN)
+    unit, delta = r.choice([("minutes", lambda n: timedelta(minutes=n)), ("hours", lambda n: timedelta(hours=n)),
+                            ("days", lambda n: timedelta(days=n)), ("weeks", lambda n: timedelta(weeks=n))])
+    n = r.randint(2, 45) if unit == "minutes" else r.randint(2, 5)
+    return {"text": f"in {n} {unit} {task}", "intent": "add_task", "amount": None, "when": _fmt(NOW + delta(n))}
+
+def task_en_weekday(r):
+    wd = r.randrange(7)
+    task = r.choice(TASKS_EN)
+    if r.random() < 0.3:
+        return {"text": f"{WEEKDAYS['en'][wd]} {task}", "intent": "add_task", "when": _weekday(wd, None)}
+    hh, mm = r.randint(8, 20), r.choice([0, 0, 30])
+    clock = f"{hh}:{mm:02d}" if mm else str(hh) if hh < 12 else f"{hh - 12}pm" if hh > 12 else "12:00"
+    return {"text": f"{WEEKDAYS['en'][wd]} at {clock} {task}", "intent": "add_task", "amount": None,
+            "when": _weekday(wd, (hh, mm))}
+
+def task_ru(r):
+    task = r.choice(TASKS_RU)
+    form = r.randrange(4)
+    if form == 0:
+        day, offset = r.choice([("сегодня", 0), ("завтра", 1), ("послезавтра", 2)])
+        hh = r.randint(7, 21)
+        return {"text": f"{day} в {hh} {task}", "intent": "add_task" if offset or task == "встреча" else "unknown",
+                "amount": None, "when": _on(offset, hh)}
+    if form == 1:
+        n = r.randint(5, 50)
+        return {"text": f"через {n} минут {task}", "intent": "add_task", "amount": None, "when": _fmt(NOW + timedelta(minutes=n))}
+    if form == 2:
+        wd = r.randrange(7)
+        hh, mm = r.randint(8, 21), r.choice([0, 15, 30])
+        return {"text": f"в {WEEKDAYS['ru'][wd]} в {hh}:{mm:02d} {task}", "intent": "add_task", "amount": None,
+                "when": _weekday(wd, (hh, mm))}
+    hh = r.randint(7, 22)
+    return {"text": f"напомни в {hh} {task}", "intent": "add_task", "when": _on(0, hh)}
+
+def task_uz(r):
+    task = r.choice(TASKS_UZ)
+    form = r.randrange(4)
+    if form == 0:
+        hh = r.randint(7, 21)
+        return {"text": f"ertaga soat {hh} da {task}", "intent": "add_task", "amount": None, "when": _on(1, hh)}
+    if form == 1:
+        n = r.randint(1, 5)
+        return {"text": f"{n} soatdan keyin {task}", "intent": "add_task", "amount": None, "when": _fmt(NOW + timedelta(hours=n))}
+    if form == 2:
+        hh, mm = r.randint(8, 21), r.choice([0, 30])
+        return {"text": f"bugun soat {hh}:{mm:02d} {task}", "intent": "add_task" if task in ("uchrashuv", "vazifa") else "unknown",
+                "amount": None, "when": _on(0, hh, mm)}
+    wd = r.randrange(7)
+    return {"text": f"{WEEKDAYS['uz'][wd]} {task}", "intent": "add_task", "when": _weekday(wd, None)}
+
+def bare_amount(r):
+    lang = r.choice(["en", "ru", "uz"])
+    money, value, cur = _money(r, lang)
+    return {"text": money, "intent": "unknown", "amount": value, "currency": cur}
+
+def noun_amount(r):
+    # 'taxi 20k': amount without an intent word; the LLM decides
+    lang = r.choice(["en", "ru"])
+    money, value, cur = _money(r, lang)
+    noun = r.choice(["lemon juice", "snacks", "cinema", "flowers"] if lang == "en" else ["хлеб", "кофе", "цветы"])
+    return {"text": f"{noun} {money}", "intent": "unknown", "amount": value, "currency": cur}
+
+def chatter(r):
+    text = r.choice([
+        "hello", "hi there", "thanks!", "what can you do?", "how much did I spend this week?", "show my tasks",
+        "привет", "спасибо", "что ты умеешь?", "сколько я потратил?", "salom", "rahmat", "qalaysan?",
+        "ok", "👍", "undo that", "удали последнюю запись", "help",
+    ])
+    return {"text": text, "intent": "unknown", "amount": None, "when": None}
+
+TEMPLATES = {
+    "en": [expense_en, expense_en, expense_en_front, income_en, task_en_day, task_en_call, task_en_relative, task_en_weekday],
+    "ru": [expense_ru, expense_ru, expense_ru_item, income_ru, task_ru, task_ru],
+    "uz": [expense_uz, expense_uz, income_uz, task_uz, task_uz],
+    "mixed": [bare_amount, bare_amount, noun_amount, chatter],
+}
+
+def generate(seed: int, per_template: int) -> list[dict]:
+    r = random.Random(seed)
+    seen, cases = set(), []
+    for lang, templates in TEMPLATES.items():
+        for tpl in dict.fromkeys(templates):
+            # Templates listed twice get twice the cases
+            want, made = per_template * templates.count(tpl), 0
+            for _ in range(want * 3):
+                if made >= want:
+                    break
+                case = tpl(r)
+                if case["text"] in seen:
+                    continue
+                seen.add(case["text"])
+                cases.append({"text": case.pop("text"), "lang": lang, "template": tpl.__name__, **case})
+                made += 1
+    return cases
+
+def main(argv=None) -> int:
+    ap = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    ap.add_argument("--seed", type=int, default=17)
+    ap.add_argument("--per-template", type=int, default=160)
+    ap.add_argument("--out", default=OUT)
+    args = ap.parse_args(argv)
+    cases = generate(args.seed, args.per_template)
+    with open(args.out, "w", encoding="utf-8") as f:
+        for c in cases:
+            f.write(json.dumps(c, ensure_ascii=False) + "\n")
+    print(f"{len(cases)} cases -> {args.out}")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,363 @@
+"""Closed-loop load test of the webhook service against local stand-ins.
+
+Run from telegram-bot/:
+
+    python -m bench.loadtest [--workers 16] [--processes 1] [--concurrency 10,50,100] [--users 500]
+        [--updates 1000 | --duration 30] [--warmup 50]
+        [--mix text=55,voice=10,photo=10,command=20,web_app_data=5]
+        [--openai-latency lognormal:0.8:0.4] [--transcribe-latency lognormal:1.5:0.3]
+        [--openai-error-rate 0] [--env KEY=VALUE ...] [--json PATH]
+
+For every --workers value the bot (bot.server:app) is started as a uvicorn
+subprocess with WEBHOOK_WORKERS set to it and Telegram, Supabase and OpenAI
+pointed at the stand-ins in bench.stubs, which run in this process
+(--processes N runs N uvicorn workers in multi-process mode). For every
+--concurrency value that many virtual users each post an Update to the
+webhook, wait for the bot's first message to their chat and post the next
+one. Each step reports throughput (replies/s) and time-to-reply percentiles;
+throughput that stops growing with concurrency marks the saturation point.
+
+Telegram's outbound limits (SEND_*) are lifted so the bot itself is measured;
+pass --env SEND_GLOBAL_RATE=30 to include them. Latency specs are
+"fixed:S", "uniform:LO:HI" or "lognormal:MEDIAN:SIGMA" in seconds.
+"""
+import argparse, asyncio, base64, io, itertools, json, os, random, socket, subprocess, sys, tempfile, time, uuid
+
+import httpx
+import uvicorn
+
+from bench.stubs import OpenAIStub, PostgrestStub, TelegramStub, latency, openai_app, postgrest_app, telegram_app
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+TOKEN = "123456:LOADTEST"
+SECRET = "loadtest"
+WEBHOOK_PATH = "/tg/webhook/loadtest"
+KINDS = ("text", "voice", "photo", "command", "web_app_data")
+BASE_TG_ID = 700_000_000
+
+# 64x48 gray JPEG, used when Pillow is not installed
+_TINY_JPEG = base64.b64decode(
+    "/9j/4AAQSkZJRgABAQAAAQABAAD/2wBDAA0JCgsKCA0LCgsODg0PEyAVExISEyccHhcgLikxMC4pLSwzOko+MzZGNywtQFdBRkxOUlNSMj5a"
+    "YVpQYEpRUk//2wBDAQ4ODhMREyYVFSZPNS01T09PT09PT09PT09PT09PT09PT09PT09PT09PT09PT09PT09PT09PT09PT09PT09PT0//wAARCAAw"
+    "AEADASIAAhEBAxEB/8QAHwAAAQUBAQEBAQEAAAAAAAAAAAECAwQFBgcICQoL/8QAtRAAAgEDAwIEAwUFBAQAAAF9AQIDAAQRBRIhMUEGE1FhByJx"
+    "FDKBkaEII0KxwRVS0fAkM2JyggkKFhcYGRolJicoKSo0NTY3ODk6Q0RFRkdISUpTVFVWV1hZWmNkZWZnaGlqc3R1dnd4eXqDhIWGh4iJipKTlJWW"
+    "l5iZmqKjpKWmp6ipqrKztLW2t7i5usLDxMXGx8jJytLT1NXW19jZ2uHi4+Tl5ufo6erx8vP09fb3+Pn6/8QAHwEAAwEBAQEBAQEBAQAAAAAAAAEC"
+    "AwQFBgcICQoL/8QAtREAAgECBAQDBAcFBAQAAQJ3AAECAxEEBSExBhJBUQdhcRMiMoEIFEKRobHBCSMzUvAVYnLRChYkNOEl8RcYGRomJygpKjU2"
+    "Nzg5OkNERUZHSElKU1RVVldYWVpjZGVmZ2hpanN0dXZ3eHl6goOEhYaHiImKkpOUlZaXmJmaoqOkpaanqKmqsrO0tba3uLm6wsPExcbHyMnK0tPU"
+    "1dbX2Nna4uPk5ebn6Onq8vP09fb3+Pn6/9oADAMBAAIRAxEAPwDvqKKKkAooooAKKKKACiiigAooooAKKKKACiiigAooooAKKKKACiiigAooooAK"
+    "KKKAP//Z"
+)
+
+TEXTS = [
+    # Confident local parses (no OpenAI call with LOCAL_PARSER_MODE=on)
+    "spent {n}000 on food", "paid {n}k for taxi", "bought groceries {n}000 sum", "salary {n}00000",
+    "потратил {n}000 на еду", "такси {n}000 сум", "{n}000 so'm ovqatga sarfladim",
+    "remind me to call mom tomorrow at 9", "meeting with the team tomorrow at 10:30",
+    # Need the LLM
+    "had dinner with Anna, she paid {n}0 and I owe her half, also need to book the dentist",
+    "what should I focus on this week given my budget",
+    "в пятницу нужно оплатить интернет и купить подарок, потратил сегодня {n}000 на кафе",
+    "ertaga soat 15 da uchrashuv bor, kecha {n}000 so'm taksi uchun ketdi",
+]
+COMMANDS = ["/start", "/week", "/latest", "/whoami"]
+
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def _photos(n: int) -> list[bytes]:
+    try:
+        from PIL import Image, ImageDraw
+    except ImportError:
+        # Distinct bytes so the plan cache does not answer every photo after the first
+        return [_TINY_JPEG + os.urandom(16) for _ in range(n)]
+    out = []
+    for _ in range(n):
+        img = Image.new("RGB", (1280, 960), (70, 55, 40))
+        d = ImageDraw.Draw(img)
+        d.rectangle((480, 60, 820, 920), fill=(236, 233, 226))
+        for y in range(100, 880, 24):
+            d.text((500, y), f"ITEM {random.randint(1, 99)}  {random.randint(1, 999)}.00", fill=(30, 30, 30))
+        buf = io.BytesIO()
+        img.save(buf, "JPEG", quality=90)
+        out.append(buf.getvalue())
+    return out
+
+
+class Updates:
+    """Synthetic Telegram Update payloads."""
+
+    def __init__(self, mix: dict[str, float], photos: int):
+        self.kinds = list(mix)
+        self.weights = [mix[k] for k in self.kinds]
+        self.photo_ids = [f"photo-{i}.jpg" for i in range(photos)]
+        self._ids = itertools.count(1)
+
+    def next(self, tg_id: int) -> tuple[str, bytes]:
+        kind = random.choices(self.kinds, self.weights)[0]
+        uid = next(self._ids)
+        msg = {"message_id": uid, "date": int(time.time()),
+               "chat": {"id": tg_id, "type": "private"},
+               "from": {"id": tg_id, "is_bot": False, "first_name": "Load", "language_code": "en"}}
+        if kind == "text":
+            msg["text"] = random.choice(TEXTS).format(n=random.randint(2, 99))
+        elif kind == "command":
+            cmd = random.choice(COMMANDS)
+            msg["text"] = cmd
+            msg["entities"] = [{"type": "bot_command", "offset": 0, "length": len(cmd)}]
+        elif kind == "voice":
+            msg["voice"] = {"file_id": "voice.ogg", "file_unique_id": "voice", "duration": 6, "mime_type": "audio/ogg"}
+        elif kind == "photo":
+            fid = random.choice(self.photo_ids)
+            msg["photo"] = [{"file_id": fid, "file_unique_id": fid + "s", "width": 320, "height": 240},
+                            {"file_id": fid, "file_unique_id": fid, "width": 1280, "height": 960}]
+            if random.random() < 0.3:
+                msg["caption"] = "lunch receipt"
+        else:
+            msg["web_app_data"] = {"data": json.dumps({"action": "ping", "n": uid}), "button_text": "Open"}
+        return kind, json.dumps({"update_id": uid, "message": msg}).encode()
+
+
+class Replies:
+    """Resolves the pending update of a chat when the bot sends it a message."""
+
+    def __init__(self):
+        self.waiting: dict[int, asyncio.Future] = {}
+
+    def expect(self, chat_id: int) -> asyncio.Future:
+        fut = asyncio.get_running_loop().create_future()
+        self.waiting[chat_id] = fut
+        return fut
+
+    def on_send(self, chat_id: int, method: str) -> None:
+        fut = self.waiting.pop(chat_id, None)
+        if fut is not None and not fut.done():
+            fut.set_result(time.perf_counter())
+
+
+def pct(values: list[float], p: float) -> float:
+    if not values:
+        return float("nan")
+    s = sorted(values)
+    return s[min(len(s) - 1, max(0, int(round(p / 100 * len(s) + 0.5)) - 1))]
+
+
+async def run_step(client: httpx.AsyncClient, replies: Replies, updates: Updates, users: list[int],
+                   concurrency: int, total: int, duration: float, timeout: float) -> dict:
+    sent = itertools.count()
+    ttr: list[float] = []
+    by_kind: dict[str, list[float]] = {}
+    counts = {"sent": 0, "replied": 0, "timeouts": 0, "busy": 0, "errors": 0}
+    deadline = time.perf_counter() + duration if duration else None
+    # Each virtual user owns a slice of chats, so a chat never has two updates in flight
+    slices = [users[i::concurrency] for i in range(concurrency)]
+
+    async def vu(chats: list[int]) -> None:
+        for chat in itertools.cycle(chats):
+            if (deadline and time.perf_counter() >= deadline) or (not deadline and next(sent) >= total):
+                return
+            kind, body = updates.next(chat)
+            fut = replies.expect(chat)
+            t0 = time.perf_counter()
+            counts["sent"] += 1
+            try:
+                r = await client.post(WEBHOOK_PATH, content=body, headers={
+                    "content-type": "application/json", "x-telegram-bot-api-secret-token": SECRET})
+            except httpx.HTTPError:
+                r = None
+            if r is None or r.status_code != 200:
+                replies.waiting.pop(chat, None)
+                counts["busy" if r is not None and r.status_code == 503 else "errors"] += 1
+                await asyncio.sleep(0.05)
+                continue
+            try:
+                t1 = await asyncio.wait_for(fut, timeout)
+            except asyncio.TimeoutError:
+                replies.waiting.pop(chat, None)
+                counts["timeouts"] += 1
+                continue
+            counts["replied"] += 1
+            ttr.append(t1 - t0)
+            by_kind.setdefault(kind, []).append(t1 - t0)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(vu(s) for s in slices if s))
+    elapsed = time.perf_counter() - started
+    return {
+        "concurrency": concurrency, **counts, "seconds": round(elapsed, 2),
+        "throughput": round(counts["replied"] / elapsed, 2) if elapsed else 0.0,
+        "p50": pct(ttr, 50), "p95": pct(ttr, 95), "p99": pct(ttr, 99), "max": max(ttr, default=float("nan")),
+        "by_kind": {k: {"n": len(v), "p50": pct(v, 50), "p95": pct(v, 95)} for k, v in sorted(by_kind.items())},
+    }
+
+
+async def _serve(app, port: int) -> uvicorn.Server:
+    server = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=port, log_level="warning", lifespan="off"))
+    server.install_signal_handlers = lambda: None  # older uvicorn
+    asyncio.create_task(server.serve())
+    while not server.started:
+        await asyncio.sleep(0.01)
+    return server
+
+
+def _seed(pg: PostgrestStub, n: int) -> list[int]:
+    ids = []
+    for i in range(n):
+        tg_id = BASE_TG_ID + i
+        user_id = str(uuid.uuid5(uuid.NAMESPACE_OID, f"loadtest-{i}"))
+        pg.insert("telegram_links", {"user_id": user_id, "telegram_user_id": tg_id})
+        pg.insert("user_profiles", {"user_id": user_id, "name": f"Load {i}", "app_timezone": "Asia/Tashkent", "currency": "UZS"})
+        for name, kind in (("Food", "expense"), ("Transport", "expense"), ("Salary", "income")):
+            pg.insert("finance_categories", {"user_id": user_id, "name": name, "type": kind})
+        ids.append(tg_id)
+    return ids
+
+
+async def _start_bot(workers: int, processes: int, ports: dict, env_extra: dict, workdir: str) -> tuple[subprocess.Popen, str, str]:
+    port = _free_port()
+    env = {
+        **os.environ,
+        "BOT_TOKEN": TOKEN,
+        "TELEGRAM_API_URL": f"http://127.0.0.1:{ports['telegram']}",
+        "NEXT_PUBLIC_SUPABASE_URL": f"http://127.0.0.1:{ports['postgrest']}",
+        "SUPABASE_SERVICE_ROLE_KEY": "loadtest",
+        "OPENAI_API_KEY": "sk-loadtest",
+        "OPENAI_BASE_URL": f"http://127.0.0.1:{ports['openai']}/v1",
+        "WEBHOOK_URL": f"http://127.0.0.1:{port}{WEBHOOK_PATH}",
+        "WEBHOOK_SECRET": SECRET,
+        "WEBHOOK_WORKERS": str(workers),
+        "BOT_PROCESSES": str(processes),
+        "BOT_IPC_DIR": os.path.join(workdir, f"ipc-{port}"),
+        "UPDATE_JOURNAL_PATH": os.path.join(workdir, f"journal-{workers}-{port}.sqlite3"),
+        "CONTEXT_REALTIME": "0",
+        "WEEKLY_DIGESTS": "off",
+        # Virtual users send far faster than people do
+        "THROTTLE": "off",
+        "SEND_GLOBAL_RATE": "1000000", "SEND_GLOBAL_BURST": "1000000",
+        "SEND_CHAT_RATE": "1000000", "SEND_CHAT_BURST": "1000000",
+        **env_extra,
+    }
+    log_path = os.path.join(workdir, f"bot-{workers}-{port}.log")
+    proc = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "bot.server:app", "--host", "127.0.0.1", "--port", str(port), "--log-level", "warning",
+         "--workers", str(processes)],
+        cwd=ROOT, env=env, stdout=open(log_path, "wb"), stderr=subprocess.STDOUT,
+    )
+    base = f"http://127.0.0.1:{port}"
+    async with httpx.AsyncClient() as c:
+        for _ in range(300):
+            if proc.poll() is not None:
+                raise RuntimeError(f"bot exited during startup, see {log_path}")
+            try:
+                if (await c.get(base + "/healthz")).status_code == 200:
+                    return proc, base, log_path
+            except httpx.HTTPError:
+                pass
+            await asyncio.sleep(0.1)
+    proc.terminate()
+    raise RuntimeError(f"bot did not become healthy, see {log_path}")
+
+
+def _stop_bot(proc: subprocess.Popen) -> None:
+    proc.terminate()
+    try:
+        proc.wait(30)
+    except subprocess.TimeoutExpired:
+        proc.kill()
+
+
+def _ms(v: float) -> str:
+    return "-" if v != v else f"{v * 1000:.0f}"
+
+
+def _print_row(workers: int, r: dict) -> None:
+    print(f"{workers:>7} {r['concurrency']:>11} {r['sent']:>6} {r['replied']:>7} {r['throughput']:>9.1f} "
+          f"{_ms(r['p50']):>7} {_ms(r['p95']):>7} {_ms(r['p99']):>7} {_ms(r['max']):>7} "
+          f"{r['timeouts']:>8} {r['busy']:>5} {r['errors']:>6}", flush=True)
+
+
+def _csv_ints(s: str) -> list[int]:
+    return [int(x) for x in s.split(",") if x]
+
+
+def _mix(s: str) -> dict[str, float]:
+    mix = {}
+    for part in s.split(","):
+        k, _, v = part.partition("=")
+        if k not in KINDS:
+            raise argparse.ArgumentTypeError(f"unknown update kind {k!r} (expected one of {', '.join(KINDS)})")
+        mix[k] = float(v)
+    return mix
+
+
+async def main_async(args) -> list[dict]:
+    pg = PostgrestStub()
+    photos = _photos(args.photos)
+    files = {"voice.ogg": b"OggS" + os.urandom(4000), **{f"photo-{i}.jpg": p for i, p in enumerate(photos)}}
+    tg = TelegramStub(files)
+    oai = OpenAIStub(latency(args.openai_latency), latency(args.transcribe_latency), args.openai_error_rate)
+    replies = Replies()
+    tg.on_send = replies.on_send
+    ports = {"telegram": _free_port(), "postgrest": _free_port(), "openai": _free_port()}
+    await _serve(telegram_app(tg), ports["telegram"])
+    await _serve(postgrest_app(pg), ports["postgrest"])
+    await _serve(openai_app(oai), ports["openai"])
+
+    steps = sorted(args.concurrency)
+    users = _seed(pg, max(args.users, max(steps)))
+    updates = Updates(args.mix, args.photos)
+    env_extra = dict(kv.split("=", 1) for kv in args.env)
+    results = []
+    workdir = tempfile.mkdtemp(prefix="loadtest-")
+    print(f"users={len(users)} mix={args.mix} openai={args.openai_latency} transcribe={args.transcribe_latency} logs={workdir}")
+    print(f"{'workers':>7} {'concurrency':>11} {'sent':>6} {'replied':>7} {'replies/s':>9} "
+          f"{'p50ms':>7} {'p95ms':>7} {'p99ms':>7} {'maxms':>7} {'timeouts':>8} {'503':>5} {'errors':>6}")
+    for workers in args.workers:
+        proc, base, log_path = await _start_bot(workers, args.processes, ports, env_extra, workdir)
+        try:
+            limits = httpx.Limits(max_connections=max(steps) + 10, max_keepalive_connections=max(steps) + 10)
+            async with httpx.AsyncClient(base_url=base, limits=limits, timeout=args.timeout) as client:
+                if args.warmup:
+                    await run_step(client, replies, updates, users, min(steps), args.warmup, 0, args.timeout)
+                for c in steps:
+                    r = await run_step(client, replies, updates, users, c, args.updates, args.duration, args.timeout)
+                    r["workers"] = workers
+                    r["bot"] = (await client.get("/healthz")).json()
+                    results.append(r)
+                    _print_row(workers, r)
+        finally:
+            _stop_bot(proc)
+    print(f"stand-ins: telegram={dict(tg.calls)} openai={dict(oai.calls)} postgrest_requests={pg.requests}")
+    return results
+
+
+def main(argv: list[str] | None = None) -> int:
+    ap = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    ap.add_argument("--workers", type=_csv_ints, default=[16], help="WEBHOOK_WORKERS values, e.g. 8,16,32")
+    ap.add_argument("--processes", type=int, default=1, help="uvicorn worker processes (BOT_PROCESSES)")
+    ap.add_argument("--concurrency", type=_csv_ints, default=[10, 50, 100], help="virtual users per step")
+    ap.add_argument("--users", type=int, default=500, help="distinct linked Telegram users")
+    ap.add_argument("--updates", type=int, default=500, help="updates per step (ignored with --duration)")
+    ap.add_argument("--duration", type=float, default=0, help="seconds per step instead of a fixed count")
+    ap.add_argument("--warmup", type=int, default=50, help="unrecorded updates before the first step")
+    ap.add_argument("--mix", type=_mix, default=_mix("text=55,voice=10,photo=10,command=20,web_app_data=5"))
+    ap.add_argument("--photos", type=int, default=16, help="distinct receipt images")
+    ap.add_argument("--openai-latency", default="lognormal:0.8:0.4")
+    ap.add_argument("--transcribe-latency", default="lognormal:1.5:0.3")
+    ap.add_argument("--openai-error-rate", type=float, default=0.0)
+    ap.add_argument("--timeout", type=float, default=60, help="seconds to wait for a reply")
+    ap.add_argument("--env", action="append", default=[], metavar="KEY=VALUE", help="extra bot environment")
+    ap.add_argument("--json", help="also write the results to this file")
+    args = ap.parse_args(argv)
+    results = asyncio.run(main_async(args))
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2, ensure_ascii=False)
+    return 0 if all(r["replied"] for r in results) else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,358 @@
+"""Accuracy and speed suite for the local message parser and its helpers.
+
+Run from telegram-bot/:
+
+    python -m bench.parser_bench [--corpus PATH ...] [--threshold 0.8] [--sample 1000] [--rounds 3] [--repeat 7]
+        [--min-accuracy 1.0] [--save-baseline PATH] [--baseline PATH]
+        [--max-slowdown 0.2] [--max-accuracy-drop 0]
+
+Every corpus line is a JSON object with ``text`` plus the fields it expects
+(intent, amount, currency, when as "YYYY-MM-DD HH:MM", category, title) and
+optionally ``lang``. Fields that are absent are not checked. Times are
+resolved against a fixed "now" (Wednesday 2025-01-15 12:00 in the bot
+timezone) so the corpus is stable. By default the hand-written regression
+cases (parser_corpus.jsonl), the generated multilingual corpus
+(nlu_corpus.jsonl, see bench.corpus_gen) and a hand-labelled set of
+realistic and adversarial messages (nlu_hard.jsonl: dates and times, units,
+several numbers, multi-word categories, questions) are used. The generated
+corpus comes from templates close to the parser's own patterns, so it
+catches regressions but overstates accuracy; nlu_hard.jsonl is the honest
+number.
+
+Cases with ``fast_path`` (true when applying the message without the LLM
+would be right) also score nlu.parse_local at --threshold: precision is the
+share of auto-applied messages whose action is correct (intent, amount,
+category and task time as labelled), recall the share of fast_path messages
+auto-applied correctly.
+
+Reports accuracy, precision and recall per field, precision and recall per
+intent, and ns/op plus peak traced bytes/op for parse() and each helper the
+fallback paths call. --save-baseline writes these numbers to a JSON file;
+--baseline compares against one and exits non-zero when a helper got slower
+than --max-slowdown (a fraction) or any accuracy, precision or recall figure
+dropped by more than --max-accuracy-drop. Timings are only comparable on
+the same machine and Python version.
+"""
+import argparse, json, os, platform, sys, time, tracemalloc
+from datetime import datetime
+
+from bot.nlu import classify_intent, parse_local
+from bot.utils import normalize_category_hint, parse, parse_money, parse_time_today_or_tomorrow, summarize_task_title, tz
+
+HERE = os.path.dirname(__file__)
+CORPORA = [os.path.join(HERE, n) for n in ("parser_corpus.jsonl", "nlu_corpus.jsonl", "nlu_hard.jsonl")]
+NOW = tz.localize(datetime(2025, 1, 15, 12, 0))
+FIELDS = ("intent", "amount", "currency", "when", "category", "title")
+INTENTS = ("add_expense", "add_income", "add_task", "unknown")
+# Same default as bot.handlers
+THRESHOLD = float(os.getenv("LOCAL_PARSER_THRESHOLD", "0.8"))
+_ACTION_INTENTS = {"add_transaction": "add_expense", "add_income": "add_income", "add_task": "add_task"}
+# What each public helper returns, in corpus terms
+FUNCTIONS = {
+    "parse": lambda t: parse(t, now=NOW),
+    "classify_intent": classify_intent,
+    "parse_money": parse_money,
+    "parse_time_today_or_tomorrow": parse_time_today_or_tomorrow,
+    "normalize_category_hint": normalize_category_hint,
+    "summarize_task_title": summarize_task_title,
+}
+
+
+def load(paths: list[str]) -> list[dict]:
+    cases = []
+    for path in paths:
+        with open(path, encoding="utf-8") as f:
+            cases += [json.loads(line) for line in f if line.strip()]
+    return cases
+
+
+def actual(text: str) -> dict:
+    r = parse(text, now=NOW)
+    return {
+        "intent": r.intent,
+        "amount": r.amount,
+        "currency": r.currency,
+        "when": r.when.strftime("%Y-%m-%d %H:%M") if r.when else None,
+        "category": r.category_hint,
+        "title": r.title,
+    }
+
+
+def _same(field: str, want, got) -> bool:
+    if field == "amount" and want is not None and got is not None:
+        return abs(float(want) - float(got)) < 1e-6
+    return want == got
+
+
+def _ratio(a: int, b: int) -> float | None:
+    return a / b if b else None
+
+
+def check(cases: list[dict]) -> tuple[dict, list]:
+    """Score the corpus; returns per-field, per-intent and per-language results and the mismatches.
+
+    A field value counts as a true positive when expected and found, a false
+    positive when something other than the expected value was found, and a
+    false negative when the expected value was missed (a wrong value is both).
+    """
+    fields = {f: {"matched": 0, "checked": 0, "tp": 0, "fp": 0, "fn": 0} for f in FIELDS}
+    intents = {i: {"tp": 0, "fp": 0, "fn": 0} for i in INTENTS}
+    langs: dict[str, list[int]] = {}
+    failures = []
+    for case in cases:
+        got = actual(case["text"])
+        lang = langs.setdefault(case.get("lang", "-"), [0, 0])
+        for f in FIELDS:
+            if f not in case:
+                continue
+            want, have = case[f], got[f]
+            ok = _same(f, want, have)
+            s = fields[f]
+            s["checked"] += 1
+            s["matched"] += ok
+            lang[1] += 1
+            lang[0] += ok
+            if ok and want is not None:
+                s["tp"] += 1
+            if not ok and have is not None:
+                s["fp"] += 1
+            if not ok and want is not None:
+                s["fn"] += 1
+            if f == "intent":
+                for i in {want, have}:
+                    c = intents.setdefault(i, {"tp": 0, "fp": 0, "fn": 0})
+                    if want == have:
+                        c["tp"] += 1
+                    elif i == have:
+                        c["fp"] += 1
+                    else:
+                        c["fn"] += 1
+            if not ok:
+                failures.append((case["text"], f, want, have))
+    result = {"fields": {}, "intents": {}, "langs": {}}
+    for f, s in fields.items():
+        if s["checked"]:
+            result["fields"][f] = {
+                "checked": s["checked"],
+                "accuracy": _ratio(s["matched"], s["checked"]),
+                "precision": _ratio(s["tp"], s["tp"] + s["fp"]),
+                "recall": _ratio(s["tp"], s["tp"] + s["fn"]),
+            }
+    for i, c in intents.items():
+        if c["tp"] + c["fp"] + c["fn"]:
+            result["intents"][i] = {
+                "support": c["tp"] + c["fn"],
+                "precision": _ratio(c["tp"], c["tp"] + c["fp"]),
+                "recall": _ratio(c["tp"], c["tp"] + c["fn"]),
+            }
+    result["langs"] = {k: _ratio(m, n) for k, (m, n) in sorted(langs.items())}
+    matched = sum(f["matched"] for f in fields.values())
+    checked = sum(f["checked"] for f in fields.values())
+    result["overall"] = _ratio(matched, checked) if checked else 1.0
+    result["cases"] = len(cases)
+    return result, failures
+
+
+def _local_correct(case: dict, action: dict) -> bool:
+    if _ACTION_INTENTS.get(action.get("type")) != case["intent"]:
+        return False
+    if "amount" in case and not _same("amount", case["amount"], action.get("amount")):
+        return False
+    if "category" in case and action.get("category") != case["category"]:
+        return False
+    return "when" not in case or actual(case["text"])["when"] == case["when"]
+
+
+def fast_path(cases: list[dict], threshold: float) -> tuple[dict | None, list]:
+    """Precision and recall of parse_local at ``threshold`` on the cases labelled with fast_path."""
+    labelled = [c for c in cases if "fast_path" in c]
+    if not labelled:
+        return None, []
+    accepted = correct = 0
+    failures = []
+    for case in labelled:
+        local = parse_local(case["text"])
+        if local is None or local["confidence"] < threshold:
+            if case["fast_path"]:
+                failures.append((case["text"], "fast", "applied locally", "sent to the LLM"))
+            continue
+        accepted += 1
+        if case["fast_path"] and _local_correct(case, local["action"]):
+            correct += 1
+        else:
+            failures.append((case["text"], "fast", "sent to the LLM" if not case["fast_path"] else "correct action",
+                             f"{local['action']} @ {local['confidence']:.2f}"))
+    return {
+        "threshold": threshold,
+        "checked": len(labelled),
+        "accepted": accepted,
+        "precision": _ratio(correct, accepted),
+        "recall": _ratio(correct, sum(c["fast_path"] for c in labelled)),
+    }, failures
+
+
+def _sample(texts: list[str], n: int) -> list[str]:
+    if n <= 0 or n >= len(texts):
+        return texts
+    step = len(texts) / n
+    return [texts[int(i * step)] for i in range(n)]
+
+
+def timing(fn, texts: list[str], rounds: int, repeat: int) -> float:
+    """Best-of-``repeat`` mean nanoseconds per call, each run making ``rounds`` passes over ``texts``."""
+    for t in texts:  # warm the regex and tz caches
+        fn(t)
+    best = float("inf")
+    for _ in range(repeat):
+        t0 = time.process_time_ns()
+        for _ in range(rounds):
+            for t in texts:
+                fn(t)
+        best = min(best, (time.process_time_ns() - t0) / max(1, rounds * len(texts)))
+    return best
+
+
+def allocations(fn, texts: list[str]) -> float:
+    """Mean peak bytes allocated (traced by tracemalloc) during one call.
+
+    CPython has no per-call allocation counter; the traced peak above the
+    starting point is the closest equivalent and moves with every extra
+    temporary a change introduces.
+    """
+    tracemalloc.start()
+    try:
+        total = 0
+        for t in texts:
+            tracemalloc.reset_peak()
+            before = tracemalloc.get_traced_memory()[0]
+            fn(t)
+            total += tracemalloc.get_traced_memory()[1] - before
+    finally:
+        tracemalloc.stop()
+    return total / max(1, len(texts))
+
+
+def _pct(v: float | None) -> str:
+    return "     -" if v is None else f"{v:6.1%}"
+
+
+def report(acc: dict, perf: dict) -> None:
+    print(f"{acc['cases']} cases")
+    print(f"  {'field':<10} {'checked':>7} {'acc':>6} {'prec':>6} {'recall':>6}")
+    for f, s in acc["fields"].items():
+        print(f"  {f:<10} {s['checked']:>7} {_pct(s['accuracy'])} {_pct(s['precision'])} {_pct(s['recall'])}")
+    print(f"  overall    {_pct(acc['overall'])}")
+    print(f"  {'intent':<12} {'support':>7} {'prec':>6} {'recall':>6}")
+    for i, s in acc["intents"].items():
+        print(f"  {i:<12} {s['support']:>7} {_pct(s['precision'])} {_pct(s['recall'])}")
+    print("  by language: " + "  ".join(f"{k} {_pct(v).strip()}" for k, v in acc["langs"].items()))
+    fp = acc.get("fast_path")
+    if fp:
+        print(f"  fast path @{fp['threshold']:.2f}: {fp['accepted']}/{fp['checked']} applied locally,"
+              f" precision {_pct(fp['precision']).strip()}, recall {_pct(fp['recall']).strip()}")
+    if perf:
+        print(f"  {'function':<30} {'ns/op':>9} {'B/op':>7}")
+        for name, p in perf.items():
+            print(f"  {name:<30} {p['ns']:>9,.0f} {p['bytes']:>7,.0f}")
+
+
+def _flat(acc: dict) -> dict[str, float]:
+    """Every accuracy-like figure of a run, keyed for baseline comparison."""
+    out = {"overall": acc["overall"]}
+    for f, s in acc["fields"].items():
+        for k in ("accuracy", "precision", "recall"):
+            if s[k] is not None:
+                out[f"{f}.{k}"] = s[k]
+    for i, s in acc["intents"].items():
+        for k in ("precision", "recall"):
+            if s[k] is not None:
+                out[f"intent:{i}.{k}"] = s[k]
+    for k in ("precision", "recall"):
+        if (acc.get("fast_path") or {}).get(k) is not None:
+            out[f"fast_path.{k}"] = acc["fast_path"][k]
+    return out
+
+
+def compare(base: dict, acc: dict, perf: dict, max_slowdown: float, max_drop: float) -> list[str]:
+    """Print the differences from a saved baseline and return the regressions."""
+    regressions = []
+    print(f"vs baseline ({base.get('python', '?')}, {base.get('cases', '?')} cases)")
+    for name, p in perf.items():
+        b = base.get("timing", {}).get(name)
+        if not b:
+            continue
+        change = p["ns"] / b["ns"] - 1
+        flag = change > max_slowdown
+        print(f"  {name:<30} {b['ns']:>9,.0f} -> {p['ns']:>9,.0f} ns/op {change:+7.1%}"
+              f"  {b['bytes']:>7,.0f} -> {p['bytes']:>7,.0f} B/op{'  REGRESSION' if flag else ''}")
+        if flag:
+            regressions.append(f"{name} {change:+.1%} ns/op")
+    old, new = _flat(base.get("accuracy", {"overall": None, "fields": {}, "intents": {}})), _flat(acc)
+    for key, was in old.items():
+        now = new.get(key)
+        if was is None or now is None or abs(now - was) < 1e-9:
+            continue
+        flag = was - now > max_drop
+        print(f"  {key:<30} {was:7.2%} -> {now:7.2%}{'  REGRESSION' if flag else ''}")
+        if flag:
+            regressions.append(f"{key} {was:.2%} -> {now:.2%}")
+    if not regressions:
+        print("  no regressions")
+    return regressions
+
+
+def main(argv=None) -> int:
+    ap = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    ap.add_argument("--corpus", action="append", help="corpus file (repeatable; default: both bundled corpora)")
+    ap.add_argument("--sample", type=int, default=1000, help="texts used for timing (0 = all)")
+    ap.add_argument("--rounds", type=int, default=3, help="passes over the sample per timing run")
+    ap.add_argument("--repeat", type=int, default=7, help="timing runs; the fastest is reported")
+    ap.add_argument("--threshold", type=float, default=THRESHOLD,
+                    help="LOCAL_PARSER_THRESHOLD for the fast-path figures (default: $LOCAL_PARSER_THRESHOLD or 0.8)")
+    ap.add_argument("--skip-timing", action="store_true", help="accuracy only")
+    ap.add_argument("--show-failures", type=int, default=50, help="mismatches to print (-1 = all)")
+    ap.add_argument("--min-accuracy", type=float, default=None,
+                    help="exit non-zero when overall accuracy falls below this (0..1)")
+    ap.add_argument("--save-baseline", metavar="PATH", help="write this run's numbers to PATH")
+    ap.add_argument("--baseline", metavar="PATH", help="compare against a saved baseline")
+    ap.add_argument("--max-slowdown", type=float, default=0.2, help="allowed ns/op increase vs baseline (fraction)")
+    ap.add_argument("--max-accuracy-drop", type=float, default=0.0, help="allowed drop of any accuracy figure vs baseline")
+    args = ap.parse_args(argv)
+
+    cases = load(args.corpus or CORPORA)
+    acc, failures = check(cases)
+    acc["fast_path"], fast_failures = fast_path(cases, args.threshold)
+    failures += fast_failures
+    shown = failures if args.show_failures < 0 else failures[:args.show_failures]
+    for text, field, want, got in shown:
+        print(f"FAIL {field:<8} {text!r}: want {want!r}, got {got!r}")
+    if len(shown) < len(failures):
+        print(f"... {len(failures) - len(shown)} more mismatches")
+
+    perf = {}
+    if not args.skip_timing:
+        texts = _sample([c["text"] for c in cases], args.sample)
+        alloc_texts = _sample(texts, 200)
+        for name, fn in FUNCTIONS.items():
+            perf[name] = {"ns": timing(fn, texts, args.rounds, args.repeat), "bytes": allocations(fn, alloc_texts)}
+    report(acc, perf)
+
+    if args.save_baseline:
+        with open(args.save_baseline, "w", encoding="utf-8") as f:
+            json.dump({"python": platform.python_version(), "machine": platform.machine(), "cases": len(cases),
+                       "accuracy": acc, "timing": perf}, f, indent=2, ensure_ascii=False)
+        print(f"baseline saved to {args.save_baseline}")
+
+    status = 0
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            base = json.load(f)
+        if compare(base, acc, perf, args.max_slowdown, args.max_accuracy_drop):
+            status = 1
+    if args.min_accuracy is not None and acc["overall"] < args.min_accuracy:
+        status = 1
+    return status
+
+
+if __name__ == "__main__":
+    sys.exit(main())
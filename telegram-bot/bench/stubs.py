@@ -0,0 +1,295 @@
+"""Local stand-ins for the services the bot talks to, used by bench.loadtest.
+
+- ``telegram_app``: Bot API methods the bot calls (getFile, sendMessage, ...)
+  plus file downloads; every call is recorded and ``on_send`` is invoked for
+  each message sent to a chat.
+- ``postgrest_app``: an in-memory PostgREST subset (eq/neq/gt/gte/lt/lte/in/
+  not.in/is filters, order, limit/offset, upserts, count=exact) with the two
+  RPCs the bot uses.
+- ``openai_app``: chat completions and transcriptions that answer after a
+  delay drawn from a configurable latency distribution.
+"""
+import asyncio, json, math, random, time, uuid
+from collections import defaultdict
+from typing import Callable, Optional
+from fastapi import FastAPI, Request, Response
+
+# --- latency distributions ---
+
+def latency(spec: str) -> Callable[[], float]:
+    """Parse "fixed:S", "uniform:LO:HI" or "lognormal:MEDIAN:SIGMA" (seconds) into a sampler."""
+    kind, *args = spec.split(":")
+    vals = [float(a) for a in args]
+    if kind == "fixed":
+        return lambda: vals[0]
+    if kind == "uniform":
+        return lambda: random.uniform(vals[0], vals[1])
+    if kind == "lognormal":
+        mu = math.log(vals[0])
+        return lambda: random.lognormvariate(mu, vals[1])
+    raise ValueError(f"unknown latency distribution: {spec}")
+
+# --- fake Telegram Bot API ---
+
+class TelegramStub:
+    def __init__(self, files: dict[str, bytes]):
+        self.files = files
+        self.calls: dict[str, int] = defaultdict(int)
+        self.on_send: Optional[Callable[[int, str], None]] = None
+        self._next_id = 0
+
+    def _message(self, chat_id: int, text: str) -> dict:
+        self._next_id += 1
+        return {"message_id": self._next_id, "date": int(time.time()),
+                "chat": {"id": chat_id, "type": "private"}, "text": text}
+
+    async def call(self, method: str, params: dict):
+        self.calls[method] += 1
+        if method == "getMe":
+            return {"id": 1, "is_bot": True, "first_name": "loadtest", "username": "loadtest_bot"}
+        if method == "getWebhookInfo":
+            return {"url": "", "has_custom_certificate": False, "pending_update_count": 0}
+        if method == "getFile":
+            file_id = params.get("file_id", "")
+            return {"file_id": file_id, "file_unique_id": file_id, "file_size": len(self.files.get(file_id, b"")),
+                    "file_path": file_id}
+        if method.startswith(("send", "copy", "forward")):
+            chat_id = int(params.get("chat_id", 0))
+            if self.on_send is not None:
+                self.on_send(chat_id, method)
+            return self._message(chat_id, str(params.get("text", "")))
+        return True
+
+def telegram_app(stub: TelegramStub) -> FastAPI:
+    app = FastAPI()
+
+    @app.post("/bot{token}/{method}")
+    async def method(token: str, method: str, request: Request):
+        ctype = request.headers.get("content-type", "")
+        if "form" in ctype:
+            params = {k: v for k, v in (await request.form()).items() if isinstance(v, str)}
+        else:
+            body = await request.body()
+            params = json.loads(body) if body else {}
+        return {"ok": True, "result": await stub.call(method, params)}
+
+    @app.get("/file/bot{token}/{path:path}")
+    async def file(token: str, path: str):
+        return Response(stub.files.get(path, b""), media_type="application/octet-stream")
+
+    return app
+
+# --- fake PostgREST ---
+
+_OPS = {
+    "eq": lambda a, b: a == b, "neq": lambda a, b: a != b,
+    "gt": lambda a, b: a is not None and a > b, "gte": lambda a, b: a is not None and a >= b,
+    "lt": lambda a, b: a is not None and a < b, "lte": lambda a, b: a is not None and a <= b,
+}
+_RESERVED = {"select", "order", "limit", "offset", "on_conflict", "columns"}
+
+def _text(v) -> Optional[str]:
+    if v is None:
+        return None
+    if isinstance(v, bool):
+        return str(v).lower()
+    return str(v)
+
+def _in_values(val: str) -> list[str]:
+    return [x.strip().strip('"') for x in val.strip("()").split(",")]
+
+def _filters(params) -> list[tuple[str, bool, str, str]]:
+    out = []
+    for key, v in params.multi_items():
+        if key in _RESERVED:
+            continue
+        neg = v.startswith("not.")
+        op, _, val = (v[4:] if neg else v).partition(".")
+        out.append((key, neg, op, val))
+    return out
+
+def _matches(row: dict, filters) -> bool:
+    for key, neg, op, val in filters:
+        rv = _text(row.get(key))
+        if op == "in":
+            ok = rv in _in_values(val)
+        elif op == "is":
+            ok = rv is None if val == "null" else rv == val
+        elif op in _OPS:
+            ok = _OPS[op](rv, val)
+        else:
+            ok = True
+        if ok == neg:
+            return False
+    return True
+
+class PostgrestStub:
+    def __init__(self):
+        # table -> user_id -> rows (most queries filter on user_id)
+        self.tables: dict[str, dict[str, list[dict]]] = defaultdict(lambda: defaultdict(list))
+        self.requests = 0
+
+    def rows(self, table: str, user_id: Optional[str] = None) -> list[dict]:
+        t = self.tables[table]
+        if user_id is not None:
+            return t.get(user_id, [])
+        return [r for rows in t.values() for r in rows]
+
+    def insert(self, table: str, row: dict) -> dict:
+        row = dict(row)
+        row.setdefault("id", str(uuid.uuid4()))
+        row.setdefault("created_at", time.strftime("%Y-%m-%dT%H:%M:%S+00:00", time.gmtime()))
+        self.tables[table][str(row.get("user_id"))].append(row)
+        return row
+
+def _user_scope(filters) -> Optional[str]:
+    for key, neg, op, val in filters:
+        if key == "user_id" and op == "eq" and not neg:
+            return val
+    return None
+
+def _order(rows: list[dict], spec: str) -> list[dict]:
+    for part in reversed(spec.split(",")):
+        col, *mods = part.split(".")
+        desc = "desc" in mods
+        rows = sorted(rows, key=lambda r: (r.get(col) is None, _text(r.get(col)) or ""), reverse=desc)
+    return rows
+
+def _summary(pg: PostgrestStub, args: dict) -> dict:
+    user_id = args.get("p_user_id")
+    lo, hi = args.get("p_from", ""), args.get("p_to", "~")
+    totals: dict[str, float] = defaultdict(float)
+    for r in pg.rows("finance_transactions", user_id):
+        if lo <= (r.get("occurred_at") or "") <= hi:
+            totals[r.get("type") or "expense"] += float(r.get("amount") or 0)
+    tasks = [r for r in pg.rows("planner_items", user_id) if lo <= (r.get("created_at") or "") <= hi]
+    return {"from": lo, "to": hi, "granularity": args.get("p_granularity"), "currency": "UZS", "totals": totals,
+            "top_categories": [], "tasks": {"created": len(tasks), "done": sum(r.get("status") == "done" for r in tasks)},
+            "buckets": []}
+
+def _default_account(pg: PostgrestStub, args: dict) -> str:
+    user_id = args["p_user_id"]
+    for r in pg.rows("finance_accounts", user_id):
+        if r.get("is_default"):
+            return r["id"]
+    return pg.insert("finance_accounts", {"user_id": user_id, "name": "Cash", "type": "cash", "is_default": True})["id"]
+
+def postgrest_app(pg: PostgrestStub) -> FastAPI:
+    app = FastAPI()
+    rpcs = {"activity_summary": _summary, "ensure_default_finance_account": _default_account}
+
+    @app.post("/rest/v1/rpc/{fn}")
+    async def rpc(fn: str, request: Request):
+        pg.requests += 1
+        args = json.loads(await request.body() or b"{}")
+        if fn not in rpcs:
+            return Response(json.dumps({"message": f"function {fn} not found"}), status_code=404, media_type="application/json")
+        return Response(json.dumps(rpcs[fn](pg, args)), media_type="application/json")
+
+    @app.api_route("/rest/v1/{table}", methods=["GET", "HEAD", "POST", "PATCH", "DELETE"])
+    async def rest(table: str, request: Request):
+        pg.requests += 1
+        params = request.query_params
+        filters = _filters(params)
+        prefer = request.headers.get("prefer", "")
+        scope = _user_scope(filters)
+        if request.method in ("GET", "HEAD"):
+            rows = [r for r in pg.rows(table, scope) if _matches(r, filters)]
+            total = len(rows)
+            if "order" in params:
+                rows = _order(rows, params["order"])
+            offset = int(params.get("offset", 0))
+            rows = rows[offset:offset + int(params["limit"])] if "limit" in params else rows[offset:]
+            headers = {"content-range": f"{offset}-{offset + max(len(rows) - 1, 0)}/{total if 'count=' in prefer else '*'}"}
+            return Response(json.dumps(rows), media_type="application/json", headers=headers)
+        if request.method == "POST":
+            body = json.loads(await request.body() or b"[]")
+            items = body if isinstance(body, list) else [body]
+            keys = params.get("on_conflict", "id").split(",")
+            out = []
+            for item in items:
+                existing = None
+                if "resolution=" in prefer:
+                    existing = next((r for r in pg.rows(table, _text(item.get("user_id")) if "user_id" in item else None)
+                                     if all(r.get(k) == item.get(k) for k in keys)), None)
+                if existing is not None:
+                    if "merge-duplicates" in prefer:
+                        existing.update(item)
+                        out.append(existing)
+                    continue
+                out.append(pg.insert(table, item))
+            return Response(json.dumps(out), status_code=201, media_type="application/json")
+        if request.method == "PATCH":
+            patch = json.loads(await request.body())
+            out = [r for r in pg.rows(table, scope) if _matches(r, filters)]
+            for r in out:
+                r.update(patch)
+            return Response(json.dumps(out), media_type="application/json")
+        gone = []
+        for user, rows in pg.tables[table].items():
+            if scope is None or user == scope:
+                keep = [r for r in rows if not _matches(r, filters)]
+                gone += [r for r in rows if _matches(r, filters)]
+                rows[:] = keep
+        return Response(json.dumps(gone), media_type="application/json")
+
+    return app
+
+# --- fake OpenAI ---
+
+class OpenAIStub:
+    def __init__(self, chat_latency: Callable[[], float], transcribe_latency: Callable[[], float], error_rate: float = 0.0):
+        self.chat_latency = chat_latency
+        self.transcribe_latency = transcribe_latency
+        self.error_rate = error_rate
+        self.calls: dict[str, int] = defaultdict(int)
+
+def _plan_for(message: str) -> dict:
+    # A plausible plan, so the bot does its usual inserts afterwards
+    low = message.lower()
+    if any(w in low for w in ("spent", "paid", "bought", "потратил", "sarfladim")):
+        return {"actions": [{"type": "add_transaction", "amount": random.randint(1, 500) * 1000, "currency": "UZS",
+                             "category": "Food", "description": message[:60]}], "reply": "Recorded."}
+    if any(w in low for w in ("remind", "meeting", "call", "task")):
+        return {"actions": [{"type": "add_task", "title": message[:60]}], "reply": "Added."}
+    return {"actions": [{"type": "none"}], "reply": "Could you tell me a bit more?"}
+
+def openai_app(stub: OpenAIStub) -> FastAPI:
+    app = FastAPI()
+
+    def _error() -> Optional[Response]:
+        if stub.error_rate and random.random() < stub.error_rate:
+            return Response('{"error":{"message":"stub failure","type":"server_error"}}', status_code=500,
+                            media_type="application/json")
+        return None
+
+    @app.post("/v1/chat/completions")
+    async def chat(request: Request):
+        stub.calls["chat"] += 1
+        body = json.loads(await request.body())
+        await asyncio.sleep(stub.chat_latency())
+        err = _error()
+        if err is not None:
+            return err
+        content = body["messages"][-1]["content"]
+        text = content if isinstance(content, str) else " ".join(p.get("text", "") for p in content if p.get("type") == "text")
+        prompt_tokens = sum(len(json.dumps(m.get("content"))) for m in body["messages"]) // 4
+        return {
+            "id": "chatcmpl-stub", "object": "chat.completion", "created": int(time.time()), "model": body.get("model"),
+            "choices": [{"index": 0, "finish_reason": "stop",
+                         "message": {"role": "assistant", "content": json.dumps(_plan_for(text))}}],
+            "usage": {"prompt_tokens": prompt_tokens, "completion_tokens": 40, "total_tokens": prompt_tokens + 40,
+                      "prompt_tokens_details": {"cached_tokens": 0}},
+        }
+
+    @app.post("/v1/audio/transcriptions")
+    async def transcribe(request: Request):
+        stub.calls["transcribe"] += 1
+        await request.body()
+        await asyncio.sleep(stub.transcribe_latency())
+        err = _error()
+        if err is not None:
+            return err
+        return {"text": random.choice(["spent 40000 on taxi", "remind me to call mom tomorrow at 9", "what did I spend this week"])}
+
+    return app
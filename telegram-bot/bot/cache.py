@@ -0,0 +1,108 @@
+import time, asyncio, weakref
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Hashable
+
+# Returned by TTLCache.get when a key is absent or expired, so that a cached
+# ``None`` (negative entry) can be told apart from a miss.
+MISSING = object()
+
+# Caches created with a name, for metrics
+_named: "weakref.WeakValueDictionary[str, TTLCache]" = weakref.WeakValueDictionary()
+
+def named_caches() -> dict:
+    return dict(_named)
+
+class TTLCache:
+    """Bounded in-process LRU cache whose entries expire after a TTL.
+
+    Not thread-safe; meant to be used from the event loop only.
+    """
+
+    def __init__(self, maxsize: int, ttl: float, name: str | None = None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._data: "OrderedDict[Hashable, tuple[float, Any]]" = OrderedDict()
+        if name:
+            _named[name] = self
+
+    def get(self, key: Hashable, default: Any = MISSING) -> Any:
+        item = self._data.get(key)
+        if item is None:
+            self.misses += 1
+            return default
+        expires_at, value = item
+        if expires_at <= time.monotonic():
+            del self._data[key]
+            self.misses += 1
+            return default
+        self._data.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def set(self, key: Hashable, value: Any, ttl: float | None = None) -> None:
+        self._data[key] = (time.monotonic() + (self.ttl if ttl is None else ttl), value)
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    def peek(self, key: Hashable, default: Any = MISSING) -> Any:
+        """Value for ``key`` (even if expired) without touching LRU order or hit counters."""
+        item = self._data.get(key)
+        return default if item is None else item[1]
+
+    def values(self) -> list:
+        return [v for _, v in self._data.values()]
+
+    def invalidate(self, key: Hashable) -> None:
+        self._data.pop(key, None)
+
+    def clear(self) -> None:
+        self._data.clear()
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            "size": len(self._data),
+            "maxsize": self.maxsize,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": (self.hits / total) if total else 0.0,
+        }
+
+class SingleFlight:
+    """Coalesce concurrent async calls that share a key.
+
+    While a call for ``key`` is running, further callers await the same
+    result instead of starting their own, so e.g. two parallel messages
+    cannot both decide a missing row needs to be created.
+    """
+
+    def __init__(self):
+        self._inflight: dict[Hashable, asyncio.Future] = {}
+
+    async def do(self, key: Hashable, fn: Callable[[], Awaitable[Any]]) -> Any:
+        fut = self._inflight.get(key)
+        if fut is not None:
+            return await asyncio.shield(fut)
+        fut = asyncio.get_running_loop().create_future()
+        self._inflight[key] = fut
+        try:
+            result = await fn()
+        except asyncio.CancelledError:
+            fut.cancel()
+            raise
+        except BaseException as e:
+            fut.set_exception(e)
+            # Mark retrieved so an error nobody else awaited is not logged
+            fut.exception()
+            raise
+        else:
+            fut.set_result(result)
+            return result
+        finally:
+            self._inflight.pop(key, None)
@@ -0,0 +1,243 @@
+import os, asyncio, contextlib, logging, stat, struct, tempfile, zlib
+from typing import Awaitable, Callable, Hashable
+
+try:  # File locks need fcntl; without it the process always runs alone
+    import fcntl
+except ImportError:
+    fcntl = None
+
+# Multi-process webhook mode: `uvicorn bot.server:app --workers N` with
+# BOT_PROCESSES=N. Each process takes a numbered slot through a file lock in
+# BOT_IPC_DIR and serves it on a Unix socket there. Whichever process receives
+# a webhook hashes the chat to a slot and hands the update to that process,
+# so a chat is always handled by one process, in order, next to its caches.
+# A separate lock elects the one process that registers the webhook and runs
+# the digest scheduler; another process takes over if it exits.
+BOT_PROCESSES = int(os.getenv("BOT_PROCESSES", os.getenv("WEB_CONCURRENCY", "1")))
+# Lock files and sockets; one directory per bot so several bots can share a host.
+# Defaults to the user's runtime dir, else a per-user name in the temp dir; it
+# must belong to this user and be closed to everyone else (mode 0700).
+BOT_IPC_DIR = os.getenv("BOT_IPC_DIR", "") or os.path.join(
+    os.getenv("XDG_RUNTIME_DIR", "") or tempfile.gettempdir(),
+    "artilect-bot-" + (os.getenv("BOT_TOKEN", "").split(":")[0] or "default")
+    + ("" if os.getenv("XDG_RUNTIME_DIR") or not hasattr(os, "getuid") else f"-{os.getuid()}"),
+)
+# Seconds to wait for the owning process to take an update before answering 503
+IPC_TIMEOUT = float(os.getenv("IPC_TIMEOUT", "5"))
+# Seconds between attempts of the other processes to take over leadership
+LEADER_RETRY = float(os.getenv("LEADER_RETRY", "5"))
+_MAX_IDLE = 32
+
+# Frames: kind (1 byte) + length (4 bytes) + payload; replies: length + payload
+_UPDATE, _METRICS = b"U", b"M"
+
+slot: int | None = None   # None: every slot is taken, this process only forwards
+_leader = False
+_lock_fds: dict[str, int] = {}
+_server: asyncio.AbstractServer | None = None
+_leader_task: asyncio.Task | None = None
+_idle: dict[int, list[tuple[asyncio.StreamReader, asyncio.StreamWriter]]] = {}
+_served: set[asyncio.StreamWriter] = set()
+_stats = {"forwarded": 0, "forward_errors": 0, "received": 0, "leader_changes": 0}
+
+def multi() -> bool:
+    return BOT_PROCESSES > 1 and fcntl is not None
+
+def is_leader() -> bool:
+    return _leader
+
+def owner(key: Hashable) -> int:
+    """Slot that handles the chat ``key``; the same on every process."""
+    if not multi():
+        return 0
+    n = key if isinstance(key, int) else zlib.crc32(str(key).encode())
+    return n % BOT_PROCESSES
+
+def is_local(key: Hashable) -> bool:
+    return not multi() or owner(key) == slot
+
+def slot_path(path: str) -> str:
+    """Per-slot variant of a local file path (slot 0 keeps the original)."""
+    if not multi() or not slot or not path:
+        return path
+    root, ext = os.path.splitext(path)
+    return f"{root}.slot{slot}{ext}"
+
+def cluster_stats() -> dict:
+    return {"processes": BOT_PROCESSES if multi() else 1, "slot": slot, "leader": _leader, "pid": os.getpid(), **_stats}
+
+def _socket_path(n: int) -> str:
+    return os.path.join(BOT_IPC_DIR, f"slot-{n}.sock")
+
+def _ipc_dir() -> str:
+    """Create BOT_IPC_DIR (mode 0700) or check that an existing one is private to this user."""
+    try:
+        os.mkdir(BOT_IPC_DIR, 0o700)
+    except FileExistsError:
+        pass
+    st = os.lstat(BOT_IPC_DIR)
+    if not stat.S_ISDIR(st.st_mode) or st.st_uid != os.getuid() or st.st_mode & 0o077:
+        # Another local user could otherwise take the slots or serve the sockets
+        raise PermissionError(f"BOT_IPC_DIR {BOT_IPC_DIR} must be a directory owned by uid {os.getuid()} with mode 0700")
+    return BOT_IPC_DIR
+
+def _try_lock(name: str) -> bool:
+    """Take an exclusive lock on BOT_IPC_DIR/name for the life of the process; False if another process holds it."""
+    fd = os.open(os.path.join(_ipc_dir(), name), os.O_RDWR | os.O_CREAT | os.O_NOFOLLOW, 0o600)
+    try:
+        fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except OSError:
+        os.close(fd)
+        return False
+    os.ftruncate(fd, 0)
+    os.write(fd, str(os.getpid()).encode())
+    _lock_fds[name] = fd
+    return True
+
+async def _read_frame(reader: asyncio.StreamReader) -> tuple[bytes, bytes]:
+    head = await reader.readexactly(5)
+    return head[:1], await reader.readexactly(struct.unpack(">I", head[1:])[0])
+
+async def start(on_update: Callable[[bytes], Awaitable[str]], on_metrics: Callable[[], bytes]) -> None:
+    """Take a slot and serve it: ``on_update(body)`` returns the enqueue result, ``on_metrics()`` the exposition."""
+    global slot, _server
+    if not multi():
+        slot = 0
+        return
+    for n in range(BOT_PROCESSES):
+        if _try_lock(f"slot-{n}.lock"):
+            slot = n
+            break
+    else:
+        logging.warning("All %d slots in %s are taken; this process only forwards updates", BOT_PROCESSES, BOT_IPC_DIR)
+        return
+
+    async def serve(reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        _served.add(writer)
+        try:
+            while True:
+                kind, payload = await _read_frame(reader)
+                if kind == _UPDATE:
+                    _stats["received"] += 1
+                    reply = (await on_update(payload)).encode()
+                else:
+                    reply = on_metrics()
+                writer.write(struct.pack(">I", len(reply)) + reply)
+                await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            _served.discard(writer)
+            writer.close()
+
+    # We hold the slot lock, so a socket file left here is stale
+    with contextlib.suppress(FileNotFoundError):
+        os.unlink(_socket_path(slot))
+    _server = await asyncio.start_unix_server(serve, _socket_path(slot))
+    logging.info("Process %d serves slot %d/%d at %s", os.getpid(), slot, BOT_PROCESSES, _socket_path(slot))
+
+async def elect(on_leader: Callable[[], Awaitable[None]]) -> None:
+    """Run ``on_leader()`` in exactly one process, now or once the current leader is gone."""
+    global _leader_task
+
+    async def lead() -> None:
+        global _leader
+        _leader = True
+        _stats["leader_changes"] += 1
+        logging.info("Process %d is the leader", os.getpid())
+        try:
+            await on_leader()
+        except Exception:
+            logging.exception("Leader startup failed")
+
+    async def wait() -> None:
+        while not _try_lock("leader.lock"):
+            await asyncio.sleep(LEADER_RETRY)
+        await lead()
+
+    if fcntl is None:
+        await lead()
+        return
+    try:
+        won = _try_lock("leader.lock")
+    except OSError as e:
+        if multi():
+            raise
+        # A lone process can do without the lock (e.g. a read-only temp dir)
+        logging.warning("Leader lock unavailable (%s); acting as leader", e)
+        won = True
+    if won:
+        await lead()
+    else:
+        _leader_task = asyncio.create_task(wait())
+
+async def _call(target: int, kind: bytes, payload: bytes) -> bytes:
+    conns = _idle.setdefault(target, [])
+    for attempt in range(2):
+        reused = bool(conns)
+        reader, writer = conns.pop() if reused else await asyncio.open_unix_connection(_socket_path(target))
+        try:
+            writer.write(kind + struct.pack(">I", len(payload)) + payload)
+            await writer.drain()
+            size = struct.unpack(">I", await reader.readexactly(4))[0]
+            reply = await reader.readexactly(size)
+        except (asyncio.IncompleteReadError, ConnectionError):
+            writer.close()
+            if reused and attempt == 0:
+                # The peer restarted since this connection was opened
+                continue
+            raise
+        except BaseException:
+            writer.close()
+            raise
+        if len(conns) < _MAX_IDLE:
+            conns.append((reader, writer))
+        else:
+            writer.close()
+        return reply
+    raise ConnectionError("unreachable")
+
+async def forward(key: Hashable, body: bytes) -> str:
+    """Hand a raw update to the process that owns its chat; returns its enqueue result or "unavailable"."""
+    target = owner(key)
+    try:
+        reply = await asyncio.wait_for(_call(target, _UPDATE, body), IPC_TIMEOUT)
+    except (OSError, asyncio.IncompleteReadError, asyncio.TimeoutError) as e:
+        _stats["forward_errors"] += 1
+        logging.warning("Slot %d unreachable, update not forwarded: %r", target, e)
+        return "unavailable"
+    _stats["forwarded"] += 1
+    return reply.decode()
+
+async def peer_metrics() -> dict[int, bytes]:
+    """Prometheus exposition of every other slot that answers within IPC_TIMEOUT."""
+    peers = [n for n in range(BOT_PROCESSES) if n != slot] if multi() else []
+    replies = await asyncio.gather(
+        *(asyncio.wait_for(_call(n, _METRICS, b""), IPC_TIMEOUT) for n in peers), return_exceptions=True
+    )
+    return {n: r for n, r in zip(peers, replies) if isinstance(r, bytes)}
+
+async def stop() -> None:
+    """Stop serving the slot and give up the locks so a replacement process can take them."""
+    global _server, _leader_task, _leader
+    if _leader_task is not None:
+        _leader_task.cancel()
+        await asyncio.gather(_leader_task, return_exceptions=True)
+        _leader_task = None
+    if _server is not None:
+        _server.close()
+        # Peers keep pooled connections open; wait_closed() would wait for them
+        for writer in list(_served):
+            writer.close()
+        await _server.wait_closed()
+        _server = None
+        with contextlib.suppress(FileNotFoundError):
+            os.unlink(_socket_path(slot))
+    for conns in _idle.values():
+        for _, writer in conns:
+            writer.close()
+    _idle.clear()
+    for fd in _lock_fds.values():
+        os.close(fd)
+    _lock_fds.clear()
+    _leader = False
@@ -0,0 +1,120 @@
+import os, asyncio, time
+import httpx
+from dotenv import load_dotenv
+from postgrest.exceptions import APIError
+from supabase import AsyncClient, AsyncClientOptions, acreate_client
+from .metrics import observe_supabase, query_labels
+from .tracing import span
+
+# Ensure .env is loaded for local runs
+load_dotenv()
+
+# URL comes from public env to keep single source
+SUPABASE_URL = os.environ.get("NEXT_PUBLIC_SUPABASE_URL")
+# Prefer service role for server-side bot to bypass RLS; fallback to anon if not set
+SUPABASE_KEY = (
+    os.environ.get("SUPABASE_SERVICE_ROLE_KEY")
+    or os.environ.get("NEXT_PUBLIC_SUPABASE_ANON_KEY")
+)
+if not SUPABASE_URL or not SUPABASE_KEY:
+    raise RuntimeError("Missing NEXT_PUBLIC_SUPABASE_URL or NEXT_PUBLIC_SUPABASE_ANON_KEY in environment.")
+
+# Pool sizing: one HTTP/2 connection multiplexes many requests, the extra
+# connections only matter when HTTP/2 is not negotiated.
+SUPABASE_MAX_CONNECTIONS = int(os.getenv("SUPABASE_MAX_CONNECTIONS", "20"))
+SUPABASE_MAX_CONCURRENCY = int(os.getenv("SUPABASE_MAX_CONCURRENCY", "32"))
+SUPABASE_TIMEOUT = float(os.getenv("SUPABASE_TIMEOUT", "10"))
+SUPABASE_KEEPALIVE = float(os.getenv("SUPABASE_KEEPALIVE", "60"))
+
+_client: AsyncClient | None = None
+_http: httpx.AsyncClient | None = None
+_lock = asyncio.Lock()
+_sem = asyncio.Semaphore(SUPABASE_MAX_CONCURRENCY)
+
+async def sb() -> AsyncClient:
+    """Return the process-wide Supabase client, creating it on first use.
+
+    All PostgREST calls share one pooled keep-alive httpx client, so no call
+    pays for a fresh TLS handshake.
+    """
+    global _client, _http
+    if _client is not None:
+        return _client
+    async with _lock:
+        if _client is None:
+            _http = httpx.AsyncClient(
+                http2=True,
+                timeout=SUPABASE_TIMEOUT,
+                limits=httpx.Limits(
+                    max_connections=SUPABASE_MAX_CONNECTIONS,
+                    max_keepalive_connections=SUPABASE_MAX_CONNECTIONS,
+                    keepalive_expiry=SUPABASE_KEEPALIVE,
+                ),
+            )
+            _client = await acreate_client(
+                SUPABASE_URL,
+                SUPABASE_KEY,
+                options=AsyncClientOptions(httpx_client=_http, postgrest_client_timeout=SUPABASE_TIMEOUT),
+            )
+    return _client
+
+async def execute(query):
+    """Run a PostgREST query builder, bounded by SUPABASE_MAX_CONCURRENCY."""
+    try:
+        table, op = query_labels(query)
+    except Exception:
+        table, op = "other", "other"
+    with span(f"db.{table}.{op}"):
+        async with _sem:
+            t0 = time.perf_counter()
+            ok = False
+            try:
+                res = await query.execute()
+                ok = not getattr(res, "error", None)
+                return res
+            finally:
+                observe_supabase(table, op, time.perf_counter() - t0, ok)
+
+async def close() -> None:
+    """Release pooled connections (call on shutdown)."""
+    global _client, _http
+    http, _client, _http = _http, None, None
+    if http is not None:
+        await http.aclose()
+
+# SQLSTATE classes that reject a row for its own values (data exception,
+# integrity constraint violation); anything else says nothing about the rows
+_ROW_ERROR_CLASSES = ("22", "23")
+
+def _row_rejected(e: APIError) -> bool:
+    return str(e.code or "")[:2] in _ROW_ERROR_CLASSES
+
+async def insert_many(table: str, rows: list[dict]) -> list[dict | None]:
+    """Insert rows with one request; returns the created row (or None) per input row.
+
+    PostgREST applies a bulk insert atomically, so when it rejects the batch
+    for a bad row the rows are retried one by one to find out which of them
+    are actually bad. Transport errors (timeouts, dropped connections) are
+    raised: the batch may have been committed, and retrying it would insert
+    the rows twice.
+    """
+    if not rows:
+        return []
+    s = await sb()
+    try:
+        res = await execute(s.table(table).insert(rows))
+    except APIError as e:
+        if len(rows) == 1 or not _row_rejected(e):
+            return [None] * len(rows)
+    else:
+        data = list(res.data or [])
+        return data + [None] * (len(rows) - len(data))
+
+    async def _one(row: dict) -> dict | None:
+        try:
+            r = await execute(s.table(table).insert(row))
+        except APIError:
+            return None
+        return r.data[0] if r.data else None
+
+    return list(await asyncio.gather(*(_one(r) for r in rows)))
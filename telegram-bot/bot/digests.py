@@ -0,0 +1,196 @@
+import os, asyncio, hashlib, logging, random
+from datetime import datetime, timedelta, timezone
+import pytz
+from .db import sb, execute
+from .cache import TTLCache, MISSING
+from .logic_summary import activity_summary, summary_text
+from .utils import tz as default_tz
+from .sender import bulk
+
+# Weekly digests: on = compute, store and send; store = compute and store only; off
+WEEKLY_DIGESTS = os.getenv("WEEKLY_DIGESTS", "on").strip().lower()
+# How often the scheduler looks for users whose local week has just ended (s)
+DIGEST_TICK = float(os.getenv("DIGEST_TICK", "300"))
+# Each user's digest is due at their local Monday 00:00 plus a stable offset in [0, DIGEST_JITTER)
+DIGEST_JITTER = float(os.getenv("DIGEST_JITTER", "3600"))
+DIGEST_CONCURRENCY = int(os.getenv("DIGEST_CONCURRENCY", "4"))
+DIGEST_BATCH_SIZE = int(os.getenv("DIGEST_BATCH_SIZE", "50"))
+# Slots missed by more than this (s), e.g. when deploying mid-week, are skipped rather than sent late
+DIGEST_GRACE = float(os.getenv("DIGEST_GRACE", "86400"))
+# /week serves a stored digest younger than this (s) instead of computing one
+DIGEST_MAX_AGE = float(os.getenv("DIGEST_MAX_AGE", "21600"))
+
+_TABLE = "telegram_weekly_digests"
+_PAGE = 1000
+_IN_CHUNK = 200
+_NEGATIVE_TTL = 300
+
+# user_id -> digest text (None when there is no fresh one)
+_fresh = TTLCache(10000, DIGEST_MAX_AGE, name="digests")
+# (user_id, period_start) pairs already stored, and the periods loaded from the table;
+# both only hold the periods of the current run (see _prune)
+_done: set[tuple[str, str]] = set()
+_loaded_periods: set[str] = set()
+_task: asyncio.Task | None = None
+_stats = {"runs": 0, "computed": 0, "sent": 0, "failed": 0, "last_run": None}
+
+def digest_stats() -> dict:
+    return {**_stats, "mode": WEEKLY_DIGESTS, "cache": _fresh.stats()}
+
+def _zone(name: str | None):
+    try:
+        return pytz.timezone(name) if name else default_tz
+    except pytz.UnknownTimeZoneError:
+        return default_tz
+
+def _last_local_week(now: datetime, zone) -> tuple[datetime, datetime]:
+    """Monday 00:00 of the previous local week and of the current one."""
+    local = now.astimezone(zone)
+    monday = local.date() - timedelta(days=local.weekday())
+    prev = monday - timedelta(days=7)
+    return (zone.localize(datetime(prev.year, prev.month, prev.day)),
+            zone.localize(datetime(monday.year, monday.month, monday.day)))
+
+def _jitter(user_id: str) -> timedelta:
+    # Stable per user, so a restart does not move anyone's slot
+    frac = int(hashlib.sha1(user_id.encode("utf-8")).hexdigest()[:8], 16) / 0xFFFFFFFF
+    return timedelta(seconds=frac * DIGEST_JITTER)
+
+async def _linked_users() -> list[dict]:
+    """All telegram_links rows with the user's app timezone."""
+    s = await sb()
+    links: list[dict] = []
+    offset = 0
+    while True:
+        res = await execute(s.table("telegram_links").select("user_id,telegram_user_id").order("created_at").range(offset, offset + _PAGE - 1))
+        rows = res.data or []
+        links.extend(rows)
+        if len(rows) < _PAGE:
+            break
+        offset += _PAGE
+    ids = list({r["user_id"] for r in links})
+    chunks = [ids[i:i + _IN_CHUNK] for i in range(0, len(ids), _IN_CHUNK)]
+    profiles = await asyncio.gather(*(
+        execute(s.table("user_profiles").select("user_id,app_timezone").in_("user_id", chunk)) for chunk in chunks
+    ))
+    tz_by_user = {p["user_id"]: p.get("app_timezone") for res in profiles for p in (res.data or [])}
+    return [{**r, "app_timezone": tz_by_user.get(r["user_id"])} for r in links]
+
+async def _load_done(periods: set[str]) -> None:
+    new = periods - _loaded_periods
+    if not new:
+        return
+    s = await sb()
+    res = await execute(s.table(_TABLE).select("user_id,period_start").in_("period_start", sorted(new)))
+    _done.update((r["user_id"], r["period_start"]) for r in (res.data or []))
+    _loaded_periods.update(new)
+
+def _prune(oldest: str) -> None:
+    """Forget periods before ``oldest`` (ISO date): no user can be due for them any more."""
+    global _done
+    if any(p < oldest for p in _loaded_periods):
+        _done = {d for d in _done if d[1] >= oldest}
+        _loaded_periods.difference_update({p for p in _loaded_periods if p < oldest})
+
+async def _digest_one(bot, user: dict, zone, start: datetime, end: datetime, sem: asyncio.Semaphore) -> None:
+    user_id = user["user_id"]
+    period = start.date().isoformat()
+    async with sem:
+        try:
+            summary = await activity_summary(user_id, start, end, zone.zone)
+            last_day = end - timedelta(days=1)
+            text = summary_text(summary, f"Your week ({start:%b %d} – {last_day:%b %d}):")
+            row = {
+                "user_id": user_id,
+                "period_start": period,
+                "timezone": zone.zone,
+                "text": text,
+                "summary": summary,
+                "created_at": datetime.now(timezone.utc).isoformat(),
+            }
+            if WEEKLY_DIGESTS == "on":
+                try:
+                    with bulk():
+                        await bot.send_message(user["telegram_user_id"], text)
+                    row["sent_at"] = datetime.now(timezone.utc).isoformat()
+                    _stats["sent"] += 1
+                except Exception as e:
+                    # Blocked bot, deleted chat...: keep the digest for /week anyway
+                    logging.info("Weekly digest not delivered to %s: %s", user["telegram_user_id"], e)
+            s = await sb()
+            await execute(s.table(_TABLE).upsert(row, on_conflict="user_id,period_start"))
+        except Exception:
+            _stats["failed"] += 1
+            logging.exception("Weekly digest failed for %s", user_id)
+            return
+    _done.add((user_id, period))
+    _fresh.set(user_id, text)
+    _stats["computed"] += 1
+
+async def run_once(bot, now: datetime | None = None) -> int:
+    """Compute (and send) digests for every linked user whose slot has passed; returns how many."""
+    now = now or datetime.now(timezone.utc)
+    due = []
+    periods = set()
+    for user in await _linked_users():
+        zone = _zone(user.get("app_timezone"))
+        start, end = _last_local_week(now, zone)
+        periods.add(start.date().isoformat())
+        slot = end + _jitter(user["user_id"])
+        if slot <= now < slot + timedelta(seconds=DIGEST_GRACE):
+            due.append((user, zone, start, end))
+    if periods:
+        _prune(min(periods))
+    await _load_done({start.date().isoformat() for _, _, start, _ in due})
+    due = [d for d in due if (d[0]["user_id"], d[2].date().isoformat()) not in _done]
+    sem = asyncio.Semaphore(DIGEST_CONCURRENCY)
+    for i in range(0, len(due), DIGEST_BATCH_SIZE):
+        await asyncio.gather(*(_digest_one(bot, u, z, st, en, sem) for u, z, st, en in due[i:i + DIGEST_BATCH_SIZE]))
+    _stats["runs"] += 1
+    _stats["last_run"] = now.isoformat()
+    return len(due)
+
+async def _loop(bot) -> None:
+    while True:
+        try:
+            n = await run_once(bot)
+            if n:
+                logging.info("Weekly digests: %d computed", n)
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            logging.exception("Weekly digest run failed")
+        # Jittered so several instances do not poll in lockstep
+        await asyncio.sleep(DIGEST_TICK * random.uniform(0.8, 1.2))
+
+def start(bot) -> None:
+    global _task
+    if WEEKLY_DIGESTS in ("on", "store") and _task is None:
+        _task = asyncio.create_task(_loop(bot))
+
+async def stop() -> None:
+    global _task
+    task, _task = _task, None
+    if task is not None:
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+
+async def fresh_digest(user_id: str) -> str | None:
+    """The user's stored digest if it was computed within DIGEST_MAX_AGE, else None."""
+    hit = _fresh.get(user_id)
+    if hit is not MISSING:
+        return hit
+    since = datetime.now(timezone.utc) - timedelta(seconds=DIGEST_MAX_AGE)
+    try:
+        s = await sb()
+        res = await execute(s.table(_TABLE).select("text,created_at").eq("user_id", user_id).gte("created_at", since.isoformat()).order("created_at", desc=True).limit(1))
+    except Exception:
+        return None
+    rows = res.data or []
+    if not rows:
+        _fresh.set(user_id, None, ttl=_NEGATIVE_TTL)
+        return None
+    created = datetime.fromisoformat(rows[0]["created_at"].replace("Z", "+00:00"))
+    left = DIGEST_MAX_AGE - (datetime.now(timezone.utc) - created).total_seconds()
+    _fresh.set(user_id, rows[0]["text"], ttl=max(0.0, left))
+    return rows[0]["text"]
@@ -1,103 +1,90 @@
-import os, secrets, json
+import os, secrets, json, asyncio, logging, random
 from datetime import datetime, timezone, timedelta
 from typing import List, Dict
 from aiogram import Router, F
 from aiogram.filters import CommandStart, Command
 from aiogram.types import Message
 from .keyboards import open_app_kb
+from .db import sb, execute
 from .supabase_link import get_user_by_telegram, create_link_code, consume_link_code, validate_init_data
-from .nlu import classify_intent
-from .logic_finance import insert_transaction
-from .logic_finance import insert_transaction_structured
-from .logic_tasks import create_task_from_text, create_task_structured
-from .openai_client import plan_actions, transcribe_audio
+from .nlu import classify_intent, parse_local, plans_agree
+from .logic_finance import insert_transaction, insert_transactions, parse_transaction_text, transaction_from_data
+from .logic_tasks import create_task_from_text, create_tasks, task_from_text, task_from_data
+from .logic_workout import log_workouts, workout_from_data
+from .openai_client import LLMUnavailable, llm_available, plan_actions, call_site
+from .voice import transcribe_voice
+from .images import prepare_photo
+from .user_context import user_context
+from .utils import TZ
+from .logic_summary import activity_summary, summary_text
+from .digests import fresh_digest
+from .tracing import traced
 
 router = Router()
 
-def _iso(dt: datetime) -> str:
-    return dt.astimezone(timezone.utc).isoformat()
+@router.message.middleware()
+async def _llm_call_site(handler, event, data):
+    # OpenAI usage is accounted per handler (see openai_client.llm_usage)
+    callback = getattr(data.get("handler"), "callback", None)
+    with call_site(getattr(callback, "__name__", "message")):
+        return await handler(event, data)
+
+# Local fast path: "on" applies confident local parses without calling OpenAI,
+# "shadow" always asks the LLM but logs where the local parser would disagree.
+LOCAL_PARSER_MODE = os.getenv("LOCAL_PARSER_MODE", "on").strip().lower()
+LOCAL_PARSER_THRESHOLD = float(os.getenv("LOCAL_PARSER_THRESHOLD", "0.8"))
+# In "on" mode, fraction of fast-path messages also sent to the LLM for comparison
+LOCAL_PARSER_SHADOW_SAMPLE = float(os.getenv("LOCAL_PARSER_SHADOW_SAMPLE", "0"))
+
+_background: set[asyncio.Task] = set()
+
+def _spawn(coro) -> None:
+    task = asyncio.create_task(coro)
+    _background.add(task)
+    task.add_done_callback(_background.discard)
 
 def _last_week_range():
     now = datetime.now(timezone.utc)
     start = now - timedelta(days=7)
     return start, now
 
-def _fmt_amount(v):
-    try:
-        return str(int(v))
-    except Exception:
-        return str(v)
-
 async def _weekly_summary_text(user_id: str) -> str:
-    from .supabase_link import sb
-    s = sb()
+    # A scheduled digest computed recently is served as is
+    digest = await fresh_digest(user_id)
+    if digest:
+        return digest
     start, end = _last_week_range()
-    # Finance: fetch transactions and categories to map names
-    tx = s.table("finance_transactions").select("id,amount,type,currency,category_id,description,occurred_at").eq("user_id", user_id).gte("occurred_at", _iso(start)).lte("occurred_at", _iso(end)).order("occurred_at", desc=True).execute()
-    cats = s.table("finance_categories").select("id,name").eq("user_id", user_id).execute()
-    cat_map = {c["id"]: c.get("name") for c in (cats.data or [])}
-    total_expense = 0
-    total_income = 0
-    by_cat: dict[str, float] = {}
-    currency = None
-    for r in (tx.data or []):
-        currency = currency or r.get("currency") or ""
-        amt = float(r.get("amount") or 0)
-        if r.get("type") == "income":
-            total_income += amt
-        else:
-            total_expense += amt
-            cname = cat_map.get(r.get("category_id")) or "Other"
-            by_cat[cname] = by_cat.get(cname, 0) + amt
-    top_cats = sorted(by_cat.items(), key=lambda kv: kv[1], reverse=True)[:3]
-
-    # Tasks: created/done in last week
-    tasks = s.table("planner_items").select("id,status,created_at,due_date").eq("user_id", user_id).or_(
-        f"created_at.gte.{_iso(start)},due_date.gte.{_iso(start)}"
-    ).lte("created_at", _iso(end)).execute()
-    created = len(tasks.data or [])
-    done = sum(1 for r in (tasks.data or []) if (r.get("status") or "").lower() in ("done","completed"))
-
-    lines = [
-        "Last 7 days:",
-        f"• Expenses: {_fmt_amount(total_expense)} {currency or ''}",
-        f"• Income: {_fmt_amount(total_income)} {currency or ''}",
-    ]
-    if top_cats:
-        lines.append("• Top categories:")
-        for name, amt in top_cats:
-            lines.append(f"   - {name}: {_fmt_amount(amt)} {currency or ''}")
-    lines.append(f"• Tasks created: {created}")
-    lines.append(f"• Tasks done: {done}")
-    return "\n".join(lines)
+    return summary_text(await activity_summary(user_id, start, end, TZ), "Last 7 days:")
 
 @router.message(Command("whoami"))
 async def whoami(m: Message):
-    from .supabase_link import sb
-    user_id = get_user_by_telegram(m.from_user.id)
+    user_id = await get_user_by_telegram(m.from_user.id)
     if not user_id:
         await m.answer("Not linked. Use /link, then paste the code in the app profile.")
         return
-    s = sb()
+    s = await sb()
     try:
         # Count a few rows per table for this user
-        tasks = s.table("planner_items").select("id", count="exact").eq("user_id", user_id).execute()
-        txs = s.table("finance_transactions").select("id", count="exact").eq("user_id", user_id).execute()
+        tasks, txs = await asyncio.gather(
+            execute(s.table("planner_items").select("id", count="exact").eq("user_id", user_id)),
+            execute(s.table("finance_transactions").select("id", count="exact").eq("user_id", user_id)),
+        )
         await m.answer(f"Linked user_id: {user_id}\nplanner_items: {(tasks.count or 0)} rows\nfinance_transactions: {(txs.count or 0)} rows")
     except Exception:
         await m.answer(f"Linked user_id: {user_id}\n(Could not query counts; check bot DB env)")
 
 @router.message(Command("latest"))
 async def latest(m: Message):
-    from .supabase_link import sb
-    user_id = get_user_by_telegram(m.from_user.id)
+    user_id = await get_user_by_telegram(m.from_user.id)
     if not user_id:
         await m.answer("Not linked. Use /link, then paste the code in the app profile.")
         return
-    s = sb()
+    s = await sb()
     try:
-        pi = s.table("planner_items").select("id,title,type,due_date,created_at").eq("user_id", user_id).order("created_at", desc=True).limit(3).execute()
-        ft = s.table("finance_transactions").select("id,amount,type,currency,description,created_at").eq("user_id", user_id).order("created_at", desc=True).limit(3).execute()
+        pi, ft = await asyncio.gather(
+            execute(s.table("planner_items").select("id,title,type,due_date,created_at").eq("user_id", user_id).order("created_at", desc=True).limit(3)),
+            execute(s.table("finance_transactions").select("id,amount,type,currency,description,created_at").eq("user_id", user_id).order("created_at", desc=True).limit(3)),
+        )
         lines = ["Latest planner_items:"]
         for r in (pi.data or []):
             lines.append(f"• {r.get('id')} | {r.get('title')} | {r.get('type')} | due={r.get('due_date')}")
@@ -122,33 +109,32 @@ async def week(m: Message):
 
 @router.message(Command("diag"))
 async def diag(m: Message):
-    from .supabase_link import sb, ensure_default_account
-    user_id = get_user_by_telegram(m.from_user.id)
+    user_id = await get_user_by_telegram(m.from_user.id)
     if not user_id:
         await m.answer("Not linked. Use /link, paste code in the app, then try again.")
         return
-    s = sb()
+    s = await sb()
     # Check select
     try:
-        sel = s.table("planner_items").select("id").eq("user_id", user_id).limit(1).execute()
+        sel = await execute(s.table("planner_items").select("id").eq("user_id", user_id).limit(1))
         sel_ok = not getattr(sel, "error", None)
     except Exception as e:
         sel_ok = False
     # Check insert
     try:
-        test = s.table("planner_items").insert({
+        test = await execute(s.table("planner_items").insert({
             "user_id": user_id,
             "title": "_diag",
             "status": "todo",
             "priority": "medium",
             "type": "daily"
-        }).execute()
+        }))
         ins_ok = not getattr(test, "error", None)
         if ins_ok:
             # cleanup
             try:
                 tid = test.data[0]["id"]
-                s.table("planner_items").delete().eq("id", tid).execute()
+                await execute(s.table("planner_items").delete().eq("id", tid))
             except Exception:
                 pass
     except Exception as e:
@@ -158,7 +144,7 @@ async def diag(m: Message):
 @router.message(CommandStart())
 async def start(m: Message):
     uid = m.from_user.id
-    linked = get_user_by_telegram(uid)
+    linked = await get_user_by_telegram(uid)
     if linked:
         await m.answer("✅ Linked to your Artilect account. Send me things like:\n• *I spent 25k on food*\n• *Tomorrow I have meeting at 10*",
                        reply_markup=open_app_kb(), parse_mode="Markdown")
@@ -169,7 +155,7 @@ async def start(m: Message):
 @router.message(Command("link"))
 async def link(m: Message):
     code = secrets.token_hex(3)  # 6 hex chars
-    create_link_code(code, m.from_user.id)
+    await create_link_code(code, m.from_user.id)
     await m.answer(f"Your one-time link code: `{code}`\nOpen Artilect → Profile → *Link Telegram* and paste the code.", parse_mode="Markdown")
 
 @router.message(Command("usecode"))
@@ -179,7 +165,7 @@ async def usecode(m: Message):
     if len(parts) != 3:
         await m.answer("Usage: /usecode CODE USER_ID")
         return
-    ok = consume_link_code(parts[1], parts[2])
+    ok = await consume_link_code(parts[1], parts[2])
     await m.answer("Linked." if ok else "Invalid code.")
 
 @router.message(F.web_app_data)
@@ -208,17 +194,39 @@ async def on_web_app_data(m: Message):
 
 async def _ensure_linked(m: Message) -> str | None:
     telegram_id = m.from_user.id
-    user_id = get_user_by_telegram(telegram_id)
+    user_id = await get_user_by_telegram(telegram_id)
     if not user_id:
         await m.answer("Please link your account first: /link (then paste the code in the app), or open the Mini App to auto-link.", reply_markup=open_app_kb())
         return None
     return user_id
 
+def _tx_confirmation(res: dict) -> str:
+    sign = "-" if res["type"] == "expense" else "+"
+    amt = int(res['amount']) if isinstance(res.get('amount'), (int,float)) else res.get('amount')
+    cat = res.get('category','')
+    return f"{sign}{amt} {res.get('currency','')} {f'· {cat}' if cat else ''}".strip()
+
+def _task_confirmation(res: dict) -> str:
+    when = res.get("due_date") or ""
+    title = (res.get('title') or '').strip()
+    # Very short, tidy confirmation
+    if title and when:
+        return f"Added: {title} · due {when[:16]}"
+    if title:
+        return f"Added: {title}"
+    return "Task added."
+
+@traced
 async def _apply_actions(user_id: str, actions: List[Dict]) -> List[str]:
-    from .logic_finance import insert_transaction as insert_tx
-    from .logic_tasks import create_task_from_text as create_task
-    confirmations: List[str] = []
+    """Apply an LLM plan, writing each target table with a single bulk insert.
+
+    Returns one confirmation per applied action, in plan order; rows the
+    database rejected get a short failure line instead.
+    """
     debug = bool(os.getenv("BOT_DEBUG"))
+    # Per action slot: a fixed message, or (group, index into that group)
+    slots: List[object] = []
+    groups: Dict[str, List[dict]] = {"finance_transactions": [], "planner_items": [], "workout_sessions": []}
     for a in actions or []:
         t = (a.get("type") or a.get("action") or "").lower()
         data = a
@@ -230,45 +238,100 @@ async def _apply_actions(user_id: str, actions: List[Dict]) -> List[str]:
                     payload["type"] = "income"
                 else:
                     payload["type"] = payload.get("type") or "expense"
-                res = insert_transaction_structured(user_id, payload)
+                spec = transaction_from_data(payload)
             else:
                 txt = data.get("description") or data.get("title") or data.get("text") or ""
-                res = insert_tx(user_id, txt)
-            if res.get("ok"):
-                sign = "-" if res["type"] == "expense" else "+"
-                amt = int(res['amount']) if isinstance(res.get('amount'), (int,float)) else res.get('amount')
-                cat = res.get('category','')
-                msg = f"{sign}{amt} {res.get('currency','')} {f'· {cat}' if cat else ''}".strip()
-                if debug:
-                    msg += f" [tx:{res.get('id')}]"
-                confirmations.append(msg)
+                spec = parse_transaction_text(txt)
+            if spec is None:
+                continue
+            slots.append(("finance_transactions", len(groups["finance_transactions"])))
+            groups["finance_transactions"].append(spec)
         elif t == "add_task":
             # Prefer structured if title present
             if isinstance(data, dict) and data.get("title"):
-                res = create_task_structured(user_id, data)
+                spec = task_from_data(data)
             else:
-                title = data.get("title") or data.get("text") or "Task"
-                res = create_task(user_id, title)
-            if res.get("ok"):
-                when = res.get("due_date") or ""
-                title = (res.get('title') or '').strip()
-                # Very short, tidy confirmation
-                if title and when:
-                    msg = f"Added: {title} · due {when[:16]}"
-                elif title:
-                    msg = f"Added: {title}"
-                else:
-                    msg = f"Task added."
-                if debug:
-                    msg += f" [task:{res.get('id')}]"
-                confirmations.append(msg)
+                spec = task_from_text(data.get("text") or "Task")
+            slots.append(("planner_items", len(groups["planner_items"])))
+            groups["planner_items"].append(spec)
         elif t == "log_workout":
-            # Placeholder: implement concrete workout insertion if needed
-            confirmations.append("Workout noted.")
+            slots.append(("workout_sessions", len(groups["workout_sessions"])))
+            groups["workout_sessions"].append(workout_from_data(data))
         elif t == "suggest_weekly":
-            confirmations.append("Weekly suggestions prepared.")
+            slots.append("Weekly suggestions prepared.")
+
+    tx_res, task_res, wo_res = await asyncio.gather(
+        insert_transactions(user_id, groups["finance_transactions"]),
+        create_tasks(user_id, groups["planner_items"]),
+        log_workouts(user_id, groups["workout_sessions"]),
+    )
+    results = {"finance_transactions": tx_res, "planner_items": task_res, "workout_sessions": wo_res}
+
+    confirmations: List[str] = []
+    for slot in slots:
+        if isinstance(slot, str):
+            confirmations.append(slot)
+            continue
+        group, idx = slot
+        res = results[group][idx]
+        if group == "finance_transactions":
+            msg = _tx_confirmation(res) if res.get("ok") else f"Couldn't save: {_tx_confirmation(groups[group][idx])}"
+            tag = "tx"
+        elif group == "planner_items":
+            msg = _task_confirmation(res) if res.get("ok") else f"Couldn't save task: {groups[group][idx]['title']}"
+            tag = "task"
+        else:
+            msg = "Workout noted." if res.get("ok") else "Couldn't save workout."
+            tag = "workout"
+        if debug and res.get("ok"):
+            msg += f" [{tag}:{res.get('id')}]"
+        confirmations.append(msg)
     return confirmations
 
+def _log_disagreement(text: str, local: dict, plan: dict) -> None:
+    actions = plan.get("actions") or []
+    if not plans_agree(local, actions):
+        logging.info(
+            "local parser disagreement: confidence=%.2f local=%s llm=%s text=%r",
+            local["confidence"], json.dumps(local["action"], ensure_ascii=False),
+            json.dumps(actions, ensure_ascii=False)[:500], text[:200],
+        )
+
+async def _shadow_compare(text: str, user_id: str, local: dict) -> None:
+    try:
+        with call_site("shadow_compare"):
+            plan = await plan_actions(text, await user_context(user_id))
+        _log_disagreement(text, local, plan)
+    except Exception as e:
+        logging.debug("shadow plan_actions failed: %s", e)
+
+async def _plan_text(text: str, user_id: str) -> Dict:
+    """Plan a text message, skipping OpenAI when the local parser is confident."""
+    local = parse_local(text) if LOCAL_PARSER_MODE in ("on", "shadow") else None
+    if local is not None and LOCAL_PARSER_MODE == "on" and local["confidence"] >= LOCAL_PARSER_THRESHOLD:
+        if LOCAL_PARSER_SHADOW_SAMPLE > 0 and random.random() < LOCAL_PARSER_SHADOW_SAMPLE:
+            _spawn(_shadow_compare(text, user_id, local))
+        return {"actions": [local["action"]], "reply": ""}
+    plan = await plan_actions(text, await user_context(user_id))
+    if local is not None and LOCAL_PARSER_MODE == "shadow":
+        _log_disagreement(text, local, plan)
+    return plan
+
+async def _legacy_confirmations(user_id: str, text: str) -> List[str]:
+    """Regex intent path for media whose plan applied nothing (or that could not be planned)."""
+    intent = classify_intent(text)
+    if intent in ("add_expense","add_income"):
+        res = await insert_transaction(user_id, text)
+        if res.get("ok"):
+            sign = "-" if res["type"] == "expense" else "+"
+            return [f"Recorded {sign}{int(res['amount'])} {res.get('currency','')} ({res.get('category','')})."]
+    elif intent == "add_task":
+        res = await create_task_from_text(user_id, text)
+        if res.get("ok"):
+            when = res.get("due_date") or ""
+            return [f"Task created. {('Due '+when) if when else ''}".strip()]
+    return []
+
 @router.message(F.voice)
 async def on_voice(m: Message):
     user_id = await _ensure_linked(m)
@@ -277,29 +340,17 @@ async def on_voice(m: Message):
     if not os.getenv("OPENAI_API_KEY"):
         await m.answer("Voice understanding requires OPENAI_API_KEY to be set.")
         return
-    # Download voice file and transcribe
-    file = await m.bot.get_file(m.voice.file_id)
-    bio = await m.bot.download_file(file.file_path)
-    audio_bytes = bio.read()
-    text = await transcribe_audio(audio_bytes)
-    plan = await plan_actions(text, {"userId": user_id})
+    # Streamed to a spooled temp file; long notes are transcribed in parallel chunks
+    text = await transcribe_voice(m.bot, m.voice)
+    try:
+        plan = await _plan_text(text, user_id)
+    except LLMUnavailable:
+        # Planner down or over its deadline: the transcript goes through the regex path
+        plan = {"actions": [], "reply": ""}
     confirmations = await _apply_actions(user_id, plan.get("actions", []))
     # Fallback to legacy parsing if no actions were executed
     if not confirmations:
-        from .nlu import classify_intent
-        intent = classify_intent(text)
-        if intent in ("add_expense","add_income"):
-            from .logic_finance import insert_transaction
-            res = insert_transaction(user_id, text)
-            if res.get("ok"):
-                sign = "-" if res["type"] == "expense" else "+"
-                confirmations.append(f"Recorded {sign}{int(res['amount'])} {res.get('currency','')} ({res.get('category','')}).")
-        elif intent == "add_task":
-            from .logic_tasks import create_task_from_text
-            res = create_task_from_text(user_id, text)
-            if res.get("ok"):
-                when = res.get("due_date") or ""
-                confirmations.append(f"Task created. {('Due '+when) if when else ''}".strip())
+        confirmations = await _legacy_confirmations(user_id, text)
     reply = plan.get("reply") or ""
     final = (reply + ("\n" + "\n".join(confirmations) if confirmations else "")).strip()
     await m.answer(final or "Done.")
@@ -312,28 +363,22 @@ async def on_photo(m: Message):
     if not os.getenv("OPENAI_API_KEY"):
         await m.answer("Image understanding requires OPENAI_API_KEY to be set.")
         return
-    # Highest-res photo
-    photo = m.photo[-1]
-    file = await m.bot.get_file(photo.file_id)
-    bio = await m.bot.download_file(file.file_path)
-    img_bytes = bio.read()
-    plan = await plan_actions(m.caption or "", {"userId": user_id}, images=[img_bytes])
+    plan = {"actions": [], "reply": ""}
+    # With the circuit open the photo is not even downloaded; only the caption is used
+    unavailable = not llm_available()
+    if not unavailable:
+        try:
+            image = await prepare_photo(m.bot, m.photo)
+            plan = await plan_actions(m.caption or "", await user_context(user_id), images=[image])
+        except LLMUnavailable:
+            unavailable = True
     confirmations = await _apply_actions(user_id, plan.get("actions", []))
     if not confirmations and m.caption:
-        from .nlu import classify_intent
-        intent = classify_intent(m.caption)
-        if intent in ("add_expense","add_income"):
-            from .logic_finance import insert_transaction
-            res = insert_transaction(user_id, m.caption)
-            if res.get("ok"):
-                sign = "-" if res["type"] == "expense" else "+"
-                confirmations.append(f"Recorded {sign}{int(res['amount'])} {res.get('currency','')} ({res.get('category','')}).")
-        elif intent == "add_task":
-            from .logic_tasks import create_task_from_text
-            res = create_task_from_text(user_id, m.caption)
-            if res.get("ok"):
-                when = res.get("due_date") or ""
-                confirmations.append(f"Task created. {('Due '+when) if when else ''}".strip())
+        confirmations = await _legacy_confirmations(user_id, m.caption)
+    if unavailable and not confirmations:
+        await m.answer("I can't read photos right now. Please type it instead, e.g. *coffee 15k*, or try again in a few minutes.",
+                       parse_mode="Markdown")
+        return
     reply = plan.get("reply") or ""
     final = (reply + ("\n" + "\n".join(confirmations) if confirmations else "")).strip()
     await m.answer(final or "Processed your image.")
@@ -346,7 +391,11 @@ async def any_text(m: Message):
 
     txt = m.text or ""
     if os.getenv("OPENAI_API_KEY"):
-        plan = await plan_actions(txt, {"userId": user_id})
+        try:
+            plan = await _plan_text(txt, user_id)
+        except LLMUnavailable:
+            # Planner down or over its deadline: answer from the legacy branch below
+            plan = {"actions": []}
         confirmations = await _apply_actions(user_id, plan.get("actions", []))
         if confirmations:
             reply = ""  # keep concise
@@ -368,7 +417,7 @@ async def any_text(m: Message):
             return
     intent = classify_intent(txt)
     if intent in ("add_expense","add_income"):
-        res = insert_transaction(user_id, txt)
+        res = await insert_transaction(user_id, txt)
         if res.get("ok"):
             sign = "-" if res["type"] == "expense" else "+"
             amt = int(res['amount']) if isinstance(res.get('amount'), (int,float)) else res.get('amount')
@@ -381,7 +430,7 @@ async def any_text(m: Message):
                 await m.answer("Couldn't save the transaction. Please try again later.")
         return
     if intent == "add_task":
-        res = create_task_from_text(user_id, txt)
+        res = await create_task_from_text(user_id, txt)
         if res.get("ok"):
             when = res.get("due_date","")
             title = (res.get('title') or '').strip()
@@ -0,0 +1,157 @@
+import os, io, asyncio, time, logging
+from .openai_client import ImageInput
+from .tracing import traced
+
+try:  # Pillow is in requirements.txt; without it photos are sent as Telegram delivered them
+    from PIL import Image, ImageFilter, ImageOps, ImageStat
+except ImportError:
+    Image = None
+    logging.warning("Pillow is not installed: photo preprocessing disabled (no crop, grayscale, resize or re-encode)")
+
+# Receipt photos are shrunk to what the vision model actually looks at: with
+# detail=high it scales the image so the short side is at most 768 px (and
+# the long side at most 2048), so anything larger only costs upload bytes.
+IMAGE_TARGET_PX = int(os.getenv("IMAGE_TARGET_PX", "768"))
+IMAGE_MAX_SIDE = int(os.getenv("IMAGE_MAX_SIDE", "2048"))
+IMAGE_JPEG_QUALITY = int(os.getenv("IMAGE_JPEG_QUALITY", "80"))
+IMAGE_GRAYSCALE = os.getenv("IMAGE_GRAYSCALE", "1") not in ("0", "false", "no", "")
+# Crop to the bright paper region when it covers between these fractions of the frame
+IMAGE_CROP = os.getenv("IMAGE_CROP", "1") not in ("0", "false", "no", "")
+IMAGE_CROP_MIN_AREA = float(os.getenv("IMAGE_CROP_MIN_AREA", "0.1"))
+IMAGE_CROP_MAX_AREA = float(os.getenv("IMAGE_CROP_MAX_AREA", "0.9"))
+# auto = low when the result fits in 512x512 (nothing to gain from tiles), else high
+IMAGE_DETAIL = os.getenv("IMAGE_DETAIL", "auto").strip().lower()
+
+_LOW_DETAIL_PX = 512
+_MASK_PX = 256
+
+_stats = {"photos": 0, "processed": 0, "cropped": 0, "bytes_in": 0, "bytes_out": 0,
+          "ms": {"download": 0.0, "decode": 0.0, "crop": 0.0, "resize": 0.0, "encode": 0.0}}
+
+def image_stats() -> dict:
+    return {**_stats, "ms": {k: round(v, 1) for k, v in _stats["ms"].items()}, "pillow": Image is not None,
+            "preprocessing": "enabled" if Image is not None else "disabled"}
+
+def pick_photo(sizes: list):
+    """Smallest PhotoSize whose short side reaches IMAGE_TARGET_PX, else the largest one."""
+    ordered = sorted(sizes, key=lambda s: s.width * s.height)
+    for s in ordered:
+        if min(s.width, s.height) >= IMAGE_TARGET_PX:
+            return s
+    return ordered[-1]
+
+def _detail(width: int, height: int) -> str:
+    if IMAGE_DETAIL in ("low", "high"):
+        return IMAGE_DETAIL
+    return "low" if max(width, height) <= _LOW_DETAIL_PX else "high"
+
+def _otsu(hist: list[int]) -> int:
+    total = sum(hist)
+    sum_all = sum(i * h for i, h in enumerate(hist))
+    w0 = sum0 = 0
+    best, best_t = -1.0, 127
+    for t, h in enumerate(hist):
+        w0 += h
+        if w0 == 0:
+            continue
+        w1 = total - w0
+        if w1 == 0:
+            break
+        sum0 += t * h
+        m0, m1 = sum0 / w0, (sum_all - sum0) / w1
+        between = w0 * w1 * (m0 - m1) ** 2
+        if between > best:
+            best, best_t = between, t
+    return best_t
+
+def _document_box(gray) -> tuple[int, int, int, int] | None:
+    """Bounding box of the bright paper on a darker background, or None if there is no clear one."""
+    small = gray.copy()
+    small.thumbnail((_MASK_PX, _MASK_PX))
+    t = _otsu(small.histogram())
+    mask = small.point(lambda v: 255 if v > t else 0).filter(ImageFilter.MedianFilter(5))
+    box = mask.getbbox()
+    if box is None:
+        return None
+    area = (box[2] - box[0]) * (box[3] - box[1]) / (small.width * small.height)
+    # The box should be mostly paper, not a few bright spots far apart
+    fill = ImageStat.Stat(mask.crop(box)).mean[0] / 255
+    if not (IMAGE_CROP_MIN_AREA <= area <= IMAGE_CROP_MAX_AREA) or fill < 0.6:
+        return None
+    sx, sy = gray.width / small.width, gray.height / small.height
+    pad = 2  # mask pixels of margin so edge text is not clipped
+    return (max(0, int((box[0] - pad) * sx)), max(0, int((box[1] - pad) * sy)),
+            min(gray.width, int((box[2] + pad) * sx)), min(gray.height, int((box[3] + pad) * sy)))
+
+def preprocess(raw: bytes) -> tuple[ImageInput, dict]:
+    """Crop, grayscale, downscale and re-encode a photo as JPEG; returns the image and per-stage timings (ms)."""
+    ms = {}
+    t = time.perf_counter()
+    img = Image.open(io.BytesIO(raw))
+    img = ImageOps.exif_transpose(img)
+    img = img.convert("L") if IMAGE_GRAYSCALE else img.convert("RGB")
+    ms["decode"] = (time.perf_counter() - t) * 1000
+
+    t = time.perf_counter()
+    cropped = False
+    if IMAGE_CROP:
+        box = _document_box(img if IMAGE_GRAYSCALE else img.convert("L"))
+        if box is not None:
+            img = img.crop(box)
+            cropped = True
+    if IMAGE_GRAYSCALE:
+        # Thermal receipts are low contrast; stretching helps the model read them
+        img = ImageOps.autocontrast(img, cutoff=1)
+    ms["crop"] = (time.perf_counter() - t) * 1000
+
+    t = time.perf_counter()
+    scale = min(1.0, IMAGE_TARGET_PX / min(img.size), IMAGE_MAX_SIDE / max(img.size))
+    if scale < 1.0:
+        img = img.resize((max(1, round(img.width * scale)), max(1, round(img.height * scale))), Image.LANCZOS)
+    ms["resize"] = (time.perf_counter() - t) * 1000
+
+    t = time.perf_counter()
+    out = io.BytesIO()
+    img.save(out, "JPEG", quality=IMAGE_JPEG_QUALITY, optimize=True)
+    data = out.getvalue()
+    ms["encode"] = (time.perf_counter() - t) * 1000
+
+    if len(data) >= len(raw) and not cropped and scale >= 1.0:
+        # Nothing gained; keep Telegram's encoding
+        return ImageInput(raw, "image/jpeg", _detail(*img.size)), {"ms": ms, "cropped": False, "size": img.size}
+    return ImageInput(data, "image/jpeg", _detail(*img.size)), {"ms": ms, "cropped": cropped, "size": img.size}
+
+@traced
+async def prepare_photo(bot, sizes: list) -> ImageInput:
+    """Download the best-fitting size of a Telegram photo and prepare it for the vision model."""
+    photo = pick_photo(sizes)
+    t = time.perf_counter()
+    file = await bot.get_file(photo.file_id)
+    bio = await bot.download_file(file.file_path)
+    raw = bio.getvalue()
+    download_ms = (time.perf_counter() - t) * 1000
+
+    _stats["photos"] += 1
+    _stats["bytes_in"] += len(raw)
+    _stats["ms"]["download"] += download_ms
+    if Image is None:
+        _stats["bytes_out"] += len(raw)
+        return ImageInput(raw, "image/jpeg", _detail(photo.width, photo.height))
+    try:
+        image, report = await asyncio.to_thread(preprocess, raw)
+    except Exception as e:
+        logging.warning("Photo preprocessing failed, sending original: %s", e)
+        _stats["bytes_out"] += len(raw)
+        return ImageInput(raw, "image/jpeg", _detail(photo.width, photo.height))
+    _stats["processed"] += 1
+    _stats["cropped"] += report["cropped"]
+    _stats["bytes_out"] += len(image.data)
+    for k, v in report["ms"].items():
+        _stats["ms"][k] += v
+    logging.info(
+        "Photo %dx%d %d B -> %dx%d %d B (%s, detail=%s); ms download=%.0f %s",
+        photo.width, photo.height, len(raw), *report["size"], len(image.data),
+        "cropped" if report["cropped"] else "full frame", image.detail, download_ms,
+        " ".join(f"{k}={v:.0f}" for k, v in report["ms"].items()),
+    )
+    return image
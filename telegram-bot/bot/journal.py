@@ -0,0 +1,96 @@
+import os, sqlite3, time, logging
+
+# Local journal of webhook updates (SQLite, WAL). Every accepted update is
+# written before it is acknowledged and marked done after it was handled, so
+# a restart replays unfinished updates and a redelivered update_id is dropped.
+# Set UPDATE_JOURNAL_PATH to an empty string to disable.
+UPDATE_JOURNAL_PATH = os.getenv("UPDATE_JOURNAL_PATH", "update_journal.sqlite3")
+# Done entries are kept this long (s) so late redeliveries are still recognized
+UPDATE_JOURNAL_RETENTION = float(os.getenv("UPDATE_JOURNAL_RETENTION", str(48 * 3600)))
+_PRUNE_EVERY = 500
+
+_conn: sqlite3.Connection | None = None
+_done_since_prune = 0
+duplicates = 0
+
+def set_path(path: str) -> None:
+    """Journal to ``path`` instead (e.g. one file per process); call before the first record()."""
+    global UPDATE_JOURNAL_PATH
+    close()
+    UPDATE_JOURNAL_PATH = path
+
+def enabled() -> bool:
+    return bool(UPDATE_JOURNAL_PATH)
+
+def _db() -> sqlite3.Connection:
+    global _conn
+    if _conn is None:
+        _conn = sqlite3.connect(UPDATE_JOURNAL_PATH, isolation_level=None)
+        _conn.execute("PRAGMA journal_mode=WAL")
+        # WAL + NORMAL survives a process crash; only an OS crash can lose the tail
+        _conn.execute("PRAGMA synchronous=NORMAL")
+        _conn.execute(
+            "create table if not exists updates ("
+            "update_id integer primary key, received_at real not null, done_at real, body blob not null)"
+        )
+    return _conn
+
+def record(update_id: int, body: bytes) -> bool:
+    """Journal a new update; returns False if this update_id was seen before."""
+    global duplicates
+    if not enabled():
+        return True
+    cur = _db().execute(
+        "insert or ignore into updates (update_id, received_at, body) values (?, ?, ?)",
+        (update_id, time.time(), body),
+    )
+    if cur.rowcount == 0:
+        duplicates += 1
+        return False
+    return True
+
+def forget(update_id: int) -> None:
+    """Drop an update that was not accepted (e.g. the queue was full), so its redelivery is taken."""
+    if enabled():
+        _db().execute("delete from updates where update_id = ? and done_at is null", (update_id,))
+
+def mark_done(update_id: int) -> None:
+    global _done_since_prune
+    if not enabled():
+        return
+    _db().execute("update updates set done_at = ?, body = x'' where update_id = ?", (time.time(), update_id))
+    _done_since_prune += 1
+    if _done_since_prune >= _PRUNE_EVERY:
+        prune()
+
+def prune() -> None:
+    global _done_since_prune
+    _done_since_prune = 0
+    _db().execute(
+        "delete from updates where done_at is not null and done_at < ?",
+        (time.time() - UPDATE_JOURNAL_RETENTION,),
+    )
+
+def unfinished() -> list[tuple[int, bytes]]:
+    """Updates that were accepted but never marked done, oldest first."""
+    if not enabled():
+        return []
+    prune()
+    rows = _db().execute("select update_id, body from updates where done_at is null order by update_id").fetchall()
+    if rows:
+        logging.info("Update journal: %d unfinished update(s) to replay", len(rows))
+    return [(r[0], bytes(r[1])) for r in rows]
+
+def stats() -> dict:
+    if not enabled():
+        return {"enabled": False}
+    open_, total = _db().execute(
+        "select count(*) filter (where done_at is null), count(*) from updates"
+    ).fetchone()
+    return {"enabled": True, "unfinished": open_, "rows": total, "duplicates": duplicates}
+
+def close() -> None:
+    global _conn
+    if _conn is not None:
+        _conn.close()
+        _conn = None
@@ -1,10 +1,16 @@
-import os, re
+import os, asyncio
 from datetime import datetime, timezone
-from .supabase_link import sb, ensure_default_account
-from .utils import parse_money, normalize_category_hint
+from .db import sb, execute, insert_many
+from .cache import TTLCache, SingleFlight, MISSING
+from .supabase_link import ensure_default_account, invalidate_default_account, RESOLVE_CACHE_SIZE, RESOLVE_CACHE_TTL
+from .utils import now_tz, parse
 
 DEFAULT_CURRENCY = os.getenv("DEFAULT_CURRENCY","UZS")
 
+# (user_id, category name, type) -> category id
+_category_cache = TTLCache(RESOLVE_CACHE_SIZE, RESOLVE_CACHE_TTL, name="categories")
+_category_flight = SingleFlight()
+
 def map_category_name(s: str) -> str:
     s = (s or "").strip().lower()
     mapping = {
@@ -20,55 +26,70 @@ def map_category_name(s: str) -> str:
     }
     return mapping.get(s, s.title() if s else None)
 
-def find_or_create_category(user_id: str, cat_name: str, tx_type: str) -> str | None:
+async def find_or_create_category(user_id: str, cat_name: str, tx_type: str) -> str | None:
     if not cat_name:
         return None
-    s = sb()
-    q = s.table("finance_categories").select("id").eq("user_id", user_id).eq("name", cat_name).limit(1).execute()
+    key = (user_id, cat_name, "income" if tx_type == "income" else "expense")
+    cached = _category_cache.get(key)
+    if cached is not MISSING:
+        return cached
+    cat_id = await _category_flight.do(key, lambda: _load_category(user_id, cat_name, tx_type))
+    _category_cache.set(key, cat_id)
+    return cat_id
+
+async def _load_category(user_id: str, cat_name: str, tx_type: str) -> str:
+    s = await sb()
+    cat_type = "income" if tx_type == "income" else "expense"
+
+    def find():
+        return s.table("finance_categories").select("id").eq("user_id", user_id).eq("name", cat_name).eq("type", cat_type).limit(1)
+
+    q = await execute(find())
     if q.data:
         return q.data[0]["id"]
-    ins = s.table("finance_categories").insert({
+    # Insert-if-absent on the (user_id, name, type) unique key; a row created
+    # concurrently (e.g. from the app) is kept as is and re-read below.
+    ins = await execute(s.table("finance_categories").upsert({
         "user_id": user_id,
         "name": cat_name,
-        "type": "income" if tx_type=="income" else "expense",
+        "type": cat_type,
         "color": "#ef4444" if tx_type=="expense" else "#16a34a"
-    }).execute()
-    return ins.data[0]["id"]
-
-def insert_transaction(user_id: str, text: str) -> dict:
-    amount = parse_money(text)
-    if amount is None:
-        return {"ok": False, "reason": "amount_not_found"}
+    }, on_conflict="user_id,name,type", ignore_duplicates=True))
+    if ins.data:
+        return ins.data[0]["id"]
+    q = await execute(find())
+    return q.data[0]["id"]
 
-    lower = text.lower()
-    tx_type = "expense"
-    if re.search(r'\b(income|salary|bonus|earned|получил|доход)\b', lower):
-        tx_type = "income"
-
-    cat_hint = normalize_category_hint(text)
-    cat_mapped = map_category_name(cat_hint)
-    cat_id = find_or_create_category(user_id, cat_mapped, tx_type) if cat_mapped else None
+def _forget_refs(user_id: str, categories) -> None:
+    # A failed insert may mean a cached id was deleted from the app side
+    invalidate_default_account(user_id)
+    for name, tx_type in categories:
+        if name:
+            _category_cache.invalidate((user_id, name, tx_type))
 
-    s = sb()
-    account_id = ensure_default_account(user_id)
-
-    # Ensure occurred_at for UI visibility
-    occurred_at = datetime.now(timezone.utc).isoformat()
-    ins = s.table("finance_transactions").insert({
-        "user_id": user_id,
-        "account_id": account_id,
-        "category_id": cat_id,
-        "type": tx_type,
-        "amount": amount,
-        "currency": DEFAULT_CURRENCY,
+def parse_transaction_text(text: str) -> dict | None:
+    """Turn free text into a transaction spec, or None if no amount is found."""
+    p = parse(text)
+    if p.amount is None:
+        return None
+    occurred = datetime.now(timezone.utc)
+    if p.when is not None and (p.time_explicit or p.when.date() != now_tz().date()):
+        # 'yesterday', 'on monday', 'at 9am': the stated time, or the current time of day on the stated date
+        local = p.when if p.time_explicit else now_tz().replace(year=p.when.year, month=p.when.month, day=p.when.day)
+        if local <= now_tz():
+            occurred = local.astimezone(timezone.utc)
+    return {
+        "type": "income" if p.intent == "add_income" else "expense",
+        "amount": p.amount,
+        "currency": p.currency or DEFAULT_CURRENCY,
+        "category": map_category_name(p.category_hint),
         "description": text,
-        "occurred_at": occurred_at,
-    }).execute()
-    if getattr(ins, "error", None) or not getattr(ins, "data", None):
-        return {"ok": False, "reason": "db_error", "error": str(getattr(ins, "error", None) or "unknown")}
-    return {"ok": True, "id": ins.data[0]["id"], "type": tx_type, "amount": amount, "category": cat_mapped, "occurred_at": occurred_at}
+        # Ensure occurred_at for UI visibility
+        "occurred_at": occurred.isoformat(),
+    }
 
-def insert_transaction_structured(user_id: str, data: dict) -> dict:
+def transaction_from_data(data: dict) -> dict | None:
+    """Normalize an LLM/structured payload into a transaction spec, or None without amount."""
     # Normalize type to satisfy DB constraint (only 'income' or 'expense')
     raw_type = (data.get("type") or "").lower()
     if raw_type in ("income", "add_income", "credit") or data.get("source"):
@@ -77,25 +98,63 @@ def insert_transaction_structured(user_id: str, data: dict) -> dict:
         tx_type = "expense"
     amount = data.get("amount")
     if amount is None:
-        return {"ok": False, "reason": "amount_not_found"}
-    currency = data.get("currency") or DEFAULT_CURRENCY
-    description = data.get("description") or data.get("note") or ""
-    occurred_at = data.get("occurredAt") or data.get("occurred_at") or datetime.now(timezone.utc).isoformat()
-    cat_name = map_category_name(data.get("category")) if data.get("category") else None
-    cat_id = find_or_create_category(user_id, cat_name, tx_type) if cat_name else None
+        return None
+    return {
+        "type": tx_type,
+        "amount": amount,
+        "currency": data.get("currency") or DEFAULT_CURRENCY,
+        "category": map_category_name(data.get("category")) if data.get("category") else None,
+        "description": data.get("description") or data.get("note") or "",
+        "occurred_at": data.get("occurredAt") or data.get("occurred_at") or datetime.now(timezone.utc).isoformat(),
+    }
 
-    s = sb()
-    account_id = ensure_default_account(user_id)
-    ins = s.table("finance_transactions").insert({
+async def insert_transactions(user_id: str, specs: list[dict]) -> list[dict]:
+    """Insert several transaction specs with one request; returns one result per spec.
+
+    Distinct categories and the default account are resolved together before
+    the write. Each result is {"ok": True, "id", ...} or {"ok": False, "reason"}.
+    """
+    if not specs:
+        return []
+    # An income and an expense category may share a name
+    categories = list(dict.fromkeys((sp["category"], sp["type"]) for sp in specs if sp.get("category")))
+    account_id, *cat_ids = await asyncio.gather(
+        ensure_default_account(user_id),
+        *(find_or_create_category(user_id, name, tx_type) for name, tx_type in categories),
+    )
+    cat_map = dict(zip(categories, cat_ids))
+    rows = [{
         "user_id": user_id,
         "account_id": account_id,
-        "category_id": cat_id,
-        "type": tx_type,
-        "amount": amount,
-        "currency": currency,
-        "description": description,
-        "occurred_at": occurred_at,
-    }).execute()
-    if getattr(ins, "error", None) or not getattr(ins, "data", None):
-        return {"ok": False, "reason": "db_error", "error": str(getattr(ins, "error", None) or "unknown")}
-    return {"ok": True, "id": ins.data[0]["id"], "type": tx_type, "amount": amount, "currency": currency, "category": cat_name}
+        "category_id": cat_map.get((sp.get("category"), sp["type"])),
+        "type": sp["type"],
+        "amount": sp["amount"],
+        "currency": sp["currency"],
+        "description": sp["description"],
+        "occurred_at": sp["occurred_at"],
+    } for sp in specs]
+    created = await insert_many("finance_transactions", rows)
+    results = []
+    failed = set()
+    for sp, row in zip(specs, created):
+        if row is None:
+            failed.add((sp.get("category"), sp["type"]))
+            results.append({"ok": False, "reason": "db_error"})
+        else:
+            results.append({"ok": True, "id": row["id"], "type": sp["type"], "amount": sp["amount"],
+                            "currency": sp["currency"], "category": sp.get("category"), "occurred_at": sp["occurred_at"]})
+    if failed:
+        _forget_refs(user_id, failed)
+    return results
+
+async def insert_transaction(user_id: str, text: str) -> dict:
+    spec = parse_transaction_text(text)
+    if spec is None:
+        return {"ok": False, "reason": "amount_not_found"}
+    return (await insert_transactions(user_id, [spec]))[0]
+
+async def insert_transaction_structured(user_id: str, data: dict) -> dict:
+    spec = transaction_from_data(data)
+    if spec is None:
+        return {"ok": False, "reason": "amount_not_found"}
+    return (await insert_transactions(user_id, [spec]))[0]
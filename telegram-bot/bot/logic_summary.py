@@ -0,0 +1,48 @@
+from datetime import datetime, timezone
+from .db import sb, execute
+
+def _iso(dt: datetime) -> str:
+    return dt.astimezone(timezone.utc).isoformat()
+
+def _fmt_amount(v):
+    try:
+        return str(int(v))
+    except Exception:
+        return str(v)
+
+async def activity_summary(user_id: str, start: datetime, end: datetime, tz_name: str,
+                           granularity: str = "week", top: int = 3) -> dict:
+    """Totals, top categories and task counts for [start, end], aggregated in the database."""
+    s = await sb()
+    res = await execute(s.rpc("activity_summary", {
+        "p_user_id": user_id,
+        "p_from": _iso(start),
+        "p_to": _iso(end),
+        "p_granularity": granularity,
+        "p_top": top,
+        "p_tz": tz_name,
+    }))
+    return res.data or {}
+
+def summary_text(summary: dict, heading: str) -> str:
+    totals = summary.get("totals") or {}
+    currency = summary.get("currency") or ""
+    total_income = float(totals.get("income") or 0)
+    total_expense = sum(float(v or 0) for k, v in totals.items() if k != "income")
+    top_cats = [(c.get("name") or "Other", c.get("amount") or 0) for c in (summary.get("top_categories") or [])]
+    tasks = summary.get("tasks") or {}
+    created = int(tasks.get("created") or 0)
+    done = int(tasks.get("done") or 0)
+
+    lines = [
+        heading,
+        f"• Expenses: {_fmt_amount(total_expense)} {currency}",
+        f"• Income: {_fmt_amount(total_income)} {currency}",
+    ]
+    if top_cats:
+        lines.append("• Top categories:")
+        for name, amt in top_cats:
+            lines.append(f"   - {name}: {_fmt_amount(amt)} {currency}")
+    lines.append(f"• Tasks created: {created}")
+    lines.append(f"• Tasks done: {done}")
+    return "\n".join(lines)
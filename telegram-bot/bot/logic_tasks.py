@@ -1,49 +1,54 @@
 from datetime import datetime, timezone
-from .supabase_link import sb
-from .utils import parse_time_tomorrow, parse_time_today_or_tomorrow, summarize_task_title
+from .db import insert_many
+from .utils import parse, summarize_task_title
 
-def create_task_from_text(user_id: str, text: str) -> dict:
-    # Try robust parser first; fallback to legacy 'tomorrow ... at' matcher
-    due = parse_time_today_or_tomorrow(text) or parse_time_tomorrow(text)
+def task_from_text(text: str) -> dict:
+    # One pass gives both the due time and the title
+    r = parse(text)
+    due = r.when
     if not due:
         # Default to today to ensure it appears in Daily view
         due = datetime.now(timezone.utc)
-    title = summarize_task_title(text)
+    title = r.title
     # enforce concise title
     title = (title or "Task").strip()[:60]
-    s = sb()
-    ins = s.table("planner_items").insert({
-        "user_id": user_id,
-        "title": title,
-        "status": "todo",
-        "priority": "medium",
-        "due_date": due.isoformat() if due else None,
-        "type": "daily",
-    }).execute()
-    if getattr(ins, "error", None) or not getattr(ins, "data", None):
-        return {"ok": False, "reason": "db_error", "error": str(getattr(ins, "error", None) or "unknown")}
-    return {"ok": True, "id": ins.data[0]["id"], "due_date": due.isoformat() if due else None, "title": title}
+    return {"title": title, "priority": "medium", "due_date": due.isoformat(), "start_date": None}
 
-def create_task_structured(user_id: str, data: dict) -> dict:
+def task_from_data(data: dict) -> dict:
     # Always summarize/shorten whatever was provided
     raw_title = (data.get("title") or data.get("text") or "Task").strip()
     title = summarize_task_title(raw_title).strip()[:60]
     due = data.get("dueAt") or data.get("due_date")
     start = data.get("startAt") or data.get("start_date")
     priority = data.get("priority") or "medium"
-    s = sb()
+    # The planner schema uses 'medium' where the assistant prompt says 'normal'
+    if priority not in ("low", "medium", "high"):
+        priority = "medium"
     if not due:
         # Default to today to ensure it appears in Daily view when due not provided
         due = datetime.now(timezone.utc).isoformat()
-    ins = s.table("planner_items").insert({
+    return {"title": title, "priority": priority, "due_date": due, "start_date": start}
+
+async def create_tasks(user_id: str, specs: list[dict]) -> list[dict]:
+    """Insert several task specs with one request; returns one result per spec."""
+    rows = [{
         "user_id": user_id,
-        "title": title,
+        "title": sp["title"],
         "status": "todo",
-        "priority": priority,
-        "due_date": due,
-        "start_date": start,
+        "priority": sp["priority"],
+        "due_date": sp["due_date"],
+        "start_date": sp["start_date"],
         "type": "daily",
-    }).execute()
-    if getattr(ins, "error", None) or not getattr(ins, "data", None):
-        return {"ok": False, "reason": "db_error", "error": str(getattr(ins, "error", None) or "unknown")}
-    return {"ok": True, "id": ins.data[0]["id"], "due_date": due, "title": title}
+    } for sp in specs]
+    created = await insert_many("planner_items", rows)
+    return [
+        {"ok": True, "id": row["id"], "due_date": sp["due_date"], "title": sp["title"]}
+        if row is not None else {"ok": False, "reason": "db_error"}
+        for sp, row in zip(specs, created)
+    ]
+
+async def create_task_from_text(user_id: str, text: str) -> dict:
+    return (await create_tasks(user_id, [task_from_text(text)]))[0]
+
+async def create_task_structured(user_id: str, data: dict) -> dict:
+    return (await create_tasks(user_id, [task_from_data(data)]))[0]
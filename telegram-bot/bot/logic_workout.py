@@ -1,17 +1,29 @@
-from .supabase_link import sb
+from datetime import datetime, timezone
+from .db import insert_many
 
-def log_workout(user_id: str, data: dict) -> dict:
+def workout_from_data(data: dict) -> dict:
     sport = data.get("sport") or data.get("sportType") or "workout"
     duration = data.get("durationMin")
     intensity = data.get("intensity")
-    occurred_at = data.get("occurredAt")
-    s = sb()
-    ins = s.table("workout_sessions").insert({
+    started_at = data.get("occurredAt") or datetime.now(timezone.utc).isoformat()
+    # workout_sessions has no sport/intensity columns; keep them readable in notes
+    notes = " · ".join(str(p) for p in (sport, intensity, data.get("notes")) if p)
+    return {"sport": sport, "duration_min": duration, "started_at": started_at, "notes": notes}
+
+async def log_workouts(user_id: str, specs: list[dict]) -> list[dict]:
+    """Insert several workout specs with one request; returns one result per spec."""
+    rows = [{
         "user_id": user_id,
-        "sport_type": sport,
-        "duration_min": duration,
-        "intensity": intensity,
-        "occurred_at": occurred_at,
-        "notes": data.get("notes")
-    }).execute()
-    return {"ok": True, "id": ins.data[0]["id"]}
+        "started_at": sp["started_at"],
+        "duration_min": sp["duration_min"],
+        "notes": sp["notes"],
+    } for sp in specs]
+    created = await insert_many("workout_sessions", rows)
+    return [
+        {"ok": True, "id": row["id"], "sport": sp["sport"], "duration_min": sp["duration_min"]}
+        if row is not None else {"ok": False, "reason": "db_error"}
+        for sp, row in zip(specs, created)
+    ]
+
+async def log_workout(user_id: str, data: dict) -> dict:
+    return (await log_workouts(user_id, [workout_from_data(data)]))[0]
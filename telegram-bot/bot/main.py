@@ -1,4 +1,4 @@
-import os, asyncio
+import os, asyncio, logging, signal
 from dotenv import load_dotenv, find_dotenv
 
 # Load .env BEFORE importing modules that access env at import time
@@ -7,15 +7,39 @@ if not load_dotenv(find_dotenv(filename=".env", raise_error_if_not_found=False))
     load_dotenv(find_dotenv(filename=".env.example", raise_error_if_not_found=False))
 
 from aiogram import Bot, Dispatcher
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.telegram import TelegramAPIServer
 from .handlers import router
+from .sender import install as install_limiter, sender_stats
+from . import db, digests, metrics, throttle, tracing, user_context
+from .polling import Poller, polling_stats, serve_metrics
+from .openai_client import llm_stats, plan_cache_stats
+from .images import image_stats
+from .voice import voice_stats
 
 BOT_TOKEN = os.environ.get("BOT_TOKEN")
 if not BOT_TOKEN:
     raise RuntimeError("BOT_TOKEN is not set. Add it to telegram-bot/.env or your environment.")
 
-bot = Bot(BOT_TOKEN)
+# Optional Bot API base URL (a local telegram-bot-api server, or the load-test stand-in)
+TELEGRAM_API_URL = os.getenv("TELEGRAM_API_URL", "")
+_session = AiohttpSession(api=TelegramAPIServer.from_base(TELEGRAM_API_URL)) if TELEGRAM_API_URL else None
+# All outgoing sends are paced to stay under Telegram's rate limits
+bot = install_limiter(Bot(BOT_TOKEN, session=_session))
 dp = Dispatcher()
 dp.include_router(router)
+metrics.install(dp)
+tracing.install(dp)
+throttle.install(dp)
+poller = Poller(bot, dp)
+
+for _name, _fn in (
+    ("webhook_queue", poller.pool.stats), ("polling", polling_stats), ("sender", sender_stats),
+    ("digests", digests.digest_stats), ("user_context", user_context.context_stats),
+    ("openai", llm_stats), ("tracing", tracing.tracing_stats), ("plan_cache", plan_cache_stats), ("images", image_stats), ("voice", voice_stats),
+    ("throttle", throttle.throttle_stats),
+):
+    metrics.register_stats(_name, _fn)
 
 async def main():
     # Ensure webhook is removed when using polling, otherwise Telegram won't deliver updates via getUpdates
@@ -23,7 +47,28 @@ async def main():
         await bot.delete_webhook(drop_pending_updates=False)
     except Exception:
         pass
-    await dp.start_polling(bot)
+    digests.start(bot)
+    user_context.start()
+    runner = await serve_metrics(poller)
+    polling = asyncio.create_task(poller.run())
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        try:
+            asyncio.get_running_loop().add_signal_handler(sig, polling.cancel)
+        except NotImplementedError:  # Windows
+            pass
+    try:
+        await polling
+    except asyncio.CancelledError:
+        logging.info("Polling stopped")
+    finally:
+        await digests.stop()
+        await user_context.stop()
+        # Let the fetched updates finish, then confirm them to Telegram
+        await poller.drain()
+        if runner is not None:
+            await runner.cleanup()
+        await db.close()
+        await bot.session.close()
 
 if __name__ == "__main__":
     asyncio.run(main())
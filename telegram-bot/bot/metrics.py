@@ -0,0 +1,146 @@
+import time
+from typing import Callable
+from aiogram import Dispatcher
+from aiogram.dispatcher.event.bases import UNHANDLED
+from prometheus_client import REGISTRY, CONTENT_TYPE_LATEST, CollectorRegistry, Counter, Histogram, generate_latest
+from prometheus_client.core import GaugeMetricFamily, Metric
+from prometheus_client.parser import text_string_to_metric_families
+from .cache import named_caches
+
+# Prometheus metrics. Labels only ever hold code-defined values (update types,
+# handler names, table names, models), never user or chat ids, so the number
+# of series stays bounded. Queue depths, cache hit ratios and module counters
+# are read from the existing stats() functions at scrape time, which costs
+# nothing on the hot path.
+
+_FAST = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5)
+_SLOW = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 60)
+
+UPDATE_SECONDS = Histogram("bot_update_seconds", "Time to process an update, by update type", ["update_type", "outcome"], buckets=_SLOW)
+HANDLER_SECONDS = Histogram("bot_handler_seconds", "Time spent in a handler", ["handler", "outcome"], buckets=_SLOW)
+QUEUE_SECONDS = Histogram("bot_webhook_queue_seconds", "Time an update waited in the webhook queue", buckets=_FAST)
+WEBHOOK_REQUESTS = Counter("bot_webhook_requests_total", "Webhook deliveries by result", ["result"])
+SUPABASE_SECONDS = Histogram("bot_supabase_seconds", "Supabase (PostgREST) call latency", ["table", "op", "outcome"], buckets=_FAST)
+OPENAI_SECONDS = Histogram("bot_openai_seconds", "OpenAI API attempt latency", ["kind", "model", "outcome"], buckets=_SLOW)
+OPENAI_TOKENS = Counter("bot_openai_tokens_total", "OpenAI tokens", ["kind", "model", "type"])
+THROTTLED = Counter("bot_throttled_total", "Updates dropped by the per-user throttle, by cost class", ["cost"])
+
+_REST = "/rest/v1/"
+
+def query_labels(query) -> tuple[str, str]:
+    """(table or rpc function, operation) of a PostgREST query builder."""
+    req = query.request
+    path = str(req.path)
+    name = path[path.rfind(_REST) + len(_REST):] if _REST in path else "other"
+    if name.startswith("rpc/"):
+        return name[4:], "rpc"
+    method = req.http_method
+    if method == "GET":
+        return name, "select"
+    if method == "POST":
+        return name, "upsert" if "resolution=" in (req.headers.get("Prefer") or "") else "insert"
+    return name, {"PATCH": "update", "DELETE": "delete"}.get(method, method.lower())
+
+def observe_supabase(table: str, op: str, seconds: float, ok: bool) -> None:
+    SUPABASE_SECONDS.labels(table, op, "ok" if ok else "error").observe(seconds)
+
+def observe_openai(kind: str, model: str, seconds: float, error: str | None, prompt: int, cached: int, completion: int) -> None:
+    OPENAI_SECONDS.labels(kind, model, "ok" if error is None else "error").observe(seconds)
+    if prompt:
+        OPENAI_TOKENS.labels(kind, model, "prompt").inc(prompt)
+    if cached:
+        OPENAI_TOKENS.labels(kind, model, "cached").inc(cached)
+    if completion:
+        OPENAI_TOKENS.labels(kind, model, "completion").inc(completion)
+
+async def _update_middleware(handler, event, data):
+    t0 = time.perf_counter()
+    outcome = "error"
+    try:
+        result = await handler(event, data)
+        outcome = "unhandled" if result is UNHANDLED else "ok"
+        return result
+    finally:
+        UPDATE_SECONDS.labels(event.event_type, outcome).observe(time.perf_counter() - t0)
+
+async def _handler_middleware(handler, event, data):
+    callback = getattr(data.get("handler"), "callback", None)
+    name = getattr(callback, "__name__", "unknown")
+    t0 = time.perf_counter()
+    outcome = "error"
+    try:
+        result = await handler(event, data)
+        outcome = "ok"
+        return result
+    finally:
+        HANDLER_SECONDS.labels(name, outcome).observe(time.perf_counter() - t0)
+
+def install(dp: Dispatcher) -> Dispatcher:
+    """Time every update (outer) and every handler call (inner) of ``dp`` and its routers."""
+    dp.update.outer_middleware(_update_middleware)
+    for observer in (dp.message, dp.edited_message, dp.callback_query):
+        observer.middleware(_handler_middleware)
+    return dp
+
+class _StatsCollector:
+    """Exposes numeric values of registered stats() dicts as gauges named bot_<source>_<key>."""
+
+    def __init__(self):
+        self._sources: dict[str, Callable[[], dict]] = {}
+
+    def add(self, name: str, fn: Callable[[], dict]) -> None:
+        self._sources[name] = fn
+
+    def collect(self):
+        for source, fn in self._sources.items():
+            try:
+                stats = fn()
+            except Exception:
+                continue
+            for key, value in _flatten(stats):
+                yield GaugeMetricFamily(f"bot_{source}_{key}", f"{source} stats: {key}", value=value)
+        caches = named_caches()
+        for field in ("size", "hits", "misses", "hit_ratio"):
+            g = GaugeMetricFamily(f"bot_cache_{field}", f"In-process cache {field}", labels=["cache"])
+            for name, cache in caches.items():
+                g.add_metric([name], cache.stats()[field])
+            yield g
+
+def _flatten(stats: dict, prefix: str = ""):
+    for key, value in stats.items():
+        name = prefix + key
+        if isinstance(value, (int, float)):  # bools included
+            yield name, float(value)
+        elif isinstance(value, dict) and not prefix and key != "cache":  # caches are exported below, labelled
+            yield from _flatten(value, name + "_")
+
+_stats_collector = _StatsCollector()
+REGISTRY.register(_stats_collector)
+
+def register_stats(name: str, fn: Callable[[], dict]) -> None:
+    """Export ``fn()``'s numeric values (one level of nesting) on every scrape."""
+    _stats_collector.add(name, fn)
+
+def render() -> tuple[bytes, str]:
+    return generate_latest(REGISTRY), CONTENT_TYPE_LATEST
+
+class _Merged:
+    def __init__(self, families: list[Metric]):
+        self.families = families
+
+    def collect(self):
+        return self.families
+
+def merge(parts: dict[str, bytes]) -> bytes:
+    """One exposition from several processes' render() output, each sample labelled with its ``worker``."""
+    families: dict[str, Metric] = {}
+    for worker, text in parts.items():
+        for fam in text_string_to_metric_families(text.decode()):
+            merged = families.get(fam.name)
+            if merged is None:
+                merged = families[fam.name] = Metric(fam.name, fam.documentation, fam.type, fam.unit)
+            for s in fam.samples:
+                merged.add_sample(s.name, {**s.labels, "worker": worker}, s.value, s.timestamp)
+    registry = CollectorRegistry(auto_describe=False)
+    registry.register(_Merged(list(families.values())))
+    return generate_latest(registry)
@@ -1,11 +1,97 @@
 import re
+from .utils import now_tz, parse
 
 def classify_intent(text: str) -> str:
-    t = text.lower().strip()
-    if re.search(r'\b(spent|потратил|расход|оплатил)\b', t):
-        return "add_expense"
-    if re.search(r'\b(add income|income|salary|bonus|заработал|доход)\b', t):
-        return "add_income"
-    if re.search(r'\b(meeting|встреча|task|задача|todo)\b', t) or re.search(r'\btomorrow\b', t):
-        return "add_task"
-    return "unknown"
+    return parse(text).intent
+
+# Things the one-action local parser cannot express: several items, questions, edits
+_COMPLEX = re.compile(r'\?|\b(and|и|va|then|потом|undo|delete|remove|удали|change|измени|how much|сколько)\b', re.IGNORECASE)
+# Dates the lexer does not resolve ('12.05', '3/14', 'last week', '2 days ago')
+_DATED = re.compile(
+    r'(?<![\d.,])(?:\d{1,2}/\d{1,2}|(?:0?[1-9]|[12]\d|3[01])\.(?:0?[1-9]|1[0-2]))(?:[./]\d{2,4})?(?![\d.,])'
+    r'|\b(?:ago|last|назад|прошл\w*|o\'tgan|morning|evening|tonight|night|утром|вечером|ночью|ertalab|kechqurun)\b',
+    re.IGNORECASE,
+)
+# More than one of these makes the category ambiguous ('on a gift for mom')
+_PREPOSITIONS = re.compile(r'\b(?:on|for|на|для|за)\b', re.IGNORECASE)
+# A number glued to a unit, not a thousands suffix: '2m cable', '5kg', '300g', '2x'
+# ('1.5m' reads as a million, but a 2 m cable reads the same, so neither is sure)
+_UNIT = re.compile(r'\d(?:[mм]|(?!(?:k|к|тыс)\b)[^\W\d_]+)\b', re.IGNORECASE)
+
+def parse_local(text: str) -> dict | None:
+    """Parse a simple message into one plan action with a confidence in [0, 1].
+
+    Returns {"intent", "action", "confidence"} or None when the message does
+    not look like something the regex parsers handle. The action uses the
+    same shape as plan_actions output so it can go straight to _apply_actions.
+    """
+    t = (text or "").strip()
+    if not t:
+        return None
+    p = parse(t)
+    if p.intent == "unknown" or p.question:
+        return None
+    complex_msg = bool(_COMPLEX.search(t))
+    short = len(t.split()) <= 8
+
+    if p.intent in ("add_expense", "add_income"):
+        # The spec is always stamped "now" with one amount; anything else is for the LLM
+        if p.amount is None or p.numbers != 1 or p.when is not None or _DATED.search(t) or _UNIT.search(t) \
+                or len(_PREPOSITIONS.findall(t)) > 1:
+            return None
+        # Intent keyword plus an amount
+        confidence = 0.85
+        if p.category_hint:
+            confidence += 0.05
+        if p.category_known:
+            confidence += 0.05
+        if short:
+            confidence += 0.05
+        if complex_msg:
+            confidence -= 0.4
+        action = {
+            "type": "add_income" if p.intent == "add_income" else "add_transaction",
+            "amount": p.amount,
+            "category": p.category_hint,
+            "description": t,
+        }
+        if p.currency:
+            action["currency"] = p.currency
+        if p.intent == "add_income":
+            action["source"] = p.category_hint or "income"
+        return {"intent": p.intent, "action": action, "confidence": max(0.0, min(1.0, confidence))}
+
+    # add_task
+    if _DATED.search(t) or (p.when is not None and p.when < now_tz()):
+        return None
+    confidence = 0.5
+    if p.when is not None:
+        confidence += 0.25
+    if p.title_matched:
+        confidence += 0.1
+    if short:
+        confidence += 0.05
+    if p.numbers:
+        # Numbers besides a time: possibly an expense too
+        confidence -= 0.2
+    if complex_msg:
+        confidence -= 0.4
+    action = {"type": "add_task", "text": t}
+    return {"intent": p.intent, "action": action, "confidence": max(0.0, min(1.0, confidence))}
+
+def plans_agree(local: dict, actions: list[dict]) -> bool:
+    """True when the LLM produced the same single action as the local parser."""
+    if len(actions or []) != 1:
+        return False
+    ours, theirs = local["action"], actions[0]
+    kind = (theirs.get("type") or theirs.get("action") or "").lower()
+    if ours["type"] == "add_task":
+        return kind == "add_task"
+    is_income = kind == "add_income" or (theirs.get("type") or "").lower() == "income"
+    if kind not in ("add_transaction", "add_income") or is_income != (ours["type"] == "add_income"):
+        return False
+    try:
+        amount = float(theirs.get("amount"))
+    except (TypeError, ValueError):
+        return False
+    return abs(amount - float(ours["amount"])) <= 0.01 * max(1.0, abs(float(ours["amount"])))
@@ -1,8 +1,286 @@
-import os, asyncio, json, base64
-from typing import Any, Dict, List, Optional, Union
-from openai import OpenAI
+import os, asyncio, json, base64, logging, random, hashlib, sqlite3, threading, time, contextvars
+from collections import deque
+from contextlib import contextmanager
+from dataclasses import dataclass
+from datetime import date, datetime, timedelta
+from typing import Any, Awaitable, BinaryIO, Callable, Dict, List, Optional, Tuple, TypeVar, Union
+import openai
+from openai import AsyncOpenAI
+from .cache import TTLCache, SingleFlight, MISSING
+from .utils import now_tz, parse, tz
+from .metrics import observe_openai
+from .tracing import span, traced
 
-client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+T = TypeVar("T")
+
+# Global governor for outbound LLM calls
+OPENAI_MAX_CONCURRENCY = int(os.getenv("OPENAI_MAX_CONCURRENCY", "8"))
+OPENAI_TIMEOUT = float(os.getenv("OPENAI_TIMEOUT", "30"))
+OPENAI_TRANSCRIBE_TIMEOUT = float(os.getenv("OPENAI_TRANSCRIBE_TIMEOUT", "60"))
+OPENAI_MAX_RETRIES = int(os.getenv("OPENAI_MAX_RETRIES", "2"))
+OPENAI_BACKOFF_BASE = float(os.getenv("OPENAI_BACKOFF_BASE", "0.5"))
+OPENAI_BACKOFF_MAX = float(os.getenv("OPENAI_BACKOFF_MAX", "8"))
+
+# Latency SLO for plan_actions: seconds per call in total, waiting for the
+# governor and retries included. OPENAI_BREAKER_FAILURES failures or timeouts
+# in a row open the circuit; while it is open plan_actions raises
+# LLMUnavailable at once, and after OPENAI_BREAKER_COOLDOWN one call is let
+# through to probe whether the provider has recovered.
+PLAN_DEADLINE = float(os.getenv("PLAN_DEADLINE", "12"))
+OPENAI_BREAKER_FAILURES = int(os.getenv("OPENAI_BREAKER_FAILURES", "5"))
+OPENAI_BREAKER_COOLDOWN = float(os.getenv("OPENAI_BREAKER_COOLDOWN", "30"))
+
+# plan_actions response cache; PLAN_CACHE_DB (a file path) makes it survive restarts
+PLAN_CACHE_SIZE = int(os.getenv("PLAN_CACHE_SIZE", "2000"))
+PLAN_CACHE_TTL = float(os.getenv("PLAN_CACHE_TTL", "86400"))
+PLAN_CACHE_DB = os.getenv("PLAN_CACHE_DB", "")
+PLAN_CACHE_DB_MAX_ROWS = int(os.getenv("PLAN_CACHE_DB_MAX_ROWS", "50000"))
+
+# Per-call usage records kept for /debug/llm-usage
+LLM_USAGE_RECENT = int(os.getenv("LLM_USAGE_RECENT", "200"))
+
+# One client per process so HTTP connections are reused; retries are done
+# here (with jitter, inside the governor) rather than by the SDK.
+client = AsyncOpenAI(api_key=os.getenv("OPENAI_API_KEY"), max_retries=0, timeout=OPENAI_TIMEOUT)
+
+_sem = asyncio.Semaphore(OPENAI_MAX_CONCURRENCY)
+_waiting = 0
+_inflight = 0
+
+_RETRYABLE = (
+    openai.APITimeoutError,
+    openai.APIConnectionError,
+    openai.RateLimitError,
+    openai.InternalServerError,
+    asyncio.TimeoutError,
+)
+
+class LLMUnavailable(Exception):
+    """plan_actions gave up: the circuit is open, the deadline passed or the provider kept failing."""
+
+@dataclass(frozen=True)
+class ImageInput:
+    """Encoded image bytes with their MIME type and the vision ``detail`` level to request."""
+    data: bytes
+    mime: str = "image/jpeg"
+    detail: str = "auto"
+
+ImageArg = Union[str, bytes, ImageInput]
+
+# --- usage accounting ---
+# Label of the code path making OpenAI calls (the aiogram handler name, set by a router middleware)
+_call_site: contextvars.ContextVar[str] = contextvars.ContextVar("llm_call_site", default="other")
+_usage: Dict[Tuple[str, str, str], Dict[str, float]] = {}
+_recent: deque = deque(maxlen=LLM_USAGE_RECENT)
+
+@contextmanager
+def call_site(name: str):
+    """Attribute OpenAI calls made inside this block to ``name``."""
+    token = _call_site.set(name)
+    try:
+        yield
+    finally:
+        _call_site.reset(token)
+
+def _account(kind: str, model: str, seconds: float, usage: Any = None, error: Optional[str] = None) -> None:
+    # Chat completions report prompt/completion tokens, transcription models input/output tokens
+    prompt = getattr(usage, "prompt_tokens", None) or getattr(usage, "input_tokens", None) or 0
+    completion = getattr(usage, "completion_tokens", None) or getattr(usage, "output_tokens", None) or 0
+    details = getattr(usage, "prompt_tokens_details", None) or getattr(usage, "input_token_details", None)
+    cached = getattr(details, "cached_tokens", None) or 0
+    observe_openai(kind, model, seconds, error, prompt, cached, completion)
+    site = _call_site.get()
+    agg = _usage.get((site, kind, model))
+    if agg is None:
+        agg = _usage[(site, kind, model)] = {
+            "calls": 0, "errors": 0, "prompt_tokens": 0, "cached_tokens": 0,
+            "completion_tokens": 0, "seconds": 0.0, "max_seconds": 0.0,
+        }
+    agg["calls"] += 1
+    agg["errors"] += error is not None
+    agg["prompt_tokens"] += prompt
+    agg["cached_tokens"] += cached
+    agg["completion_tokens"] += completion
+    agg["seconds"] += seconds
+    agg["max_seconds"] = max(agg["max_seconds"], seconds)
+    _recent.append({
+        "at": round(time.time(), 3), "site": site, "kind": kind, "model": model,
+        "prompt_tokens": prompt, "cached_tokens": cached, "completion_tokens": completion,
+        "ms": round(seconds * 1000, 1), "error": error,
+    })
+
+async def _metered(kind: str, model: str, call: Callable[[], Awaitable[T]]) -> T:
+    """Run one API attempt and record its latency and token usage."""
+    t0 = time.monotonic()
+    try:
+        with span(f"openai.{kind}"):
+            resp = await call()
+    except asyncio.CancelledError:
+        # wait_for cancels the attempt when OPENAI_TIMEOUT expires
+        _account(kind, model, time.monotonic() - t0, error="cancelled")
+        raise
+    except Exception as e:
+        _account(kind, model, time.monotonic() - t0, error=type(e).__name__)
+        raise
+    _account(kind, model, time.monotonic() - t0, getattr(resp, "usage", None))
+    return resp
+
+def llm_usage(recent: int = 0) -> Dict[str, Any]:
+    """Token and latency totals per (call site, kind, model), most expensive first, plus the last ``recent`` calls."""
+    rows = []
+    for (site, kind, model), agg in _usage.items():
+        rows.append({
+            "site": site, "kind": kind, "model": model, **agg,
+            "seconds": round(agg["seconds"], 3), "max_seconds": round(agg["max_seconds"], 3),
+            "avg_ms": round(agg["seconds"] / agg["calls"] * 1000, 1),
+            "cache_hit_ratio": round(agg["cached_tokens"] / agg["prompt_tokens"], 3) if agg["prompt_tokens"] else 0.0,
+        })
+    rows.sort(key=lambda r: r["prompt_tokens"] + r["completion_tokens"], reverse=True)
+    totals = {k: sum(r[k] for r in rows) for k in ("calls", "errors", "prompt_tokens", "cached_tokens", "completion_tokens")}
+    totals["cache_hit_ratio"] = round(totals["cached_tokens"] / totals["prompt_tokens"], 3) if totals["prompt_tokens"] else 0.0
+    out: Dict[str, Any] = {"totals": totals, "by_call": rows}
+    if recent:
+        out["recent"] = list(_recent)[-recent:]
+    return out
+
+def llm_stats() -> Dict[str, Any]:
+    """Queue depth (calls waiting for a slot), in-flight gauges and the plan circuit breaker."""
+    return {"waiting": _waiting, "in_flight": _inflight, "limit": OPENAI_MAX_CONCURRENCY, "breaker": _breaker.stats()}
+
+def _backoff(attempt: int) -> float:
+    # Full jitter: uniform in [0, min(max, base * 2^attempt)]
+    return random.uniform(0, min(OPENAI_BACKOFF_MAX, OPENAI_BACKOFF_BASE * (2 ** attempt)))
+
+async def _governed(call: Callable[[], Awaitable[T]], timeout: float) -> T:
+    """Run ``call`` under the global semaphore with a deadline and jittered retries."""
+    global _waiting, _inflight
+    _waiting += 1
+    try:
+        await _sem.acquire()
+    finally:
+        _waiting -= 1
+    _inflight += 1
+    try:
+        attempt = 0
+        while True:
+            try:
+                return await asyncio.wait_for(call(), timeout)
+            except _RETRYABLE:
+                if attempt >= OPENAI_MAX_RETRIES:
+                    raise
+                await asyncio.sleep(_backoff(attempt))
+                attempt += 1
+    finally:
+        _inflight -= 1
+        _sem.release()
+
+class CircuitBreaker:
+    """Consecutive-failure breaker: closed, open for ``cooldown`` seconds, then half-open for a single probe.
+
+    allow() hands out a ticket that the caller passes back with the outcome.
+    Tickets carry the generation (number of times the circuit has opened) they
+    were issued in, so a call that was already in flight when the circuit
+    opened cannot close it or count towards the next trip; only the probe's
+    outcome decides in half-open state.
+    """
+
+    def __init__(self, failures: int, cooldown: float):
+        self.failures = failures
+        self.cooldown = cooldown
+        self.state = "closed"
+        self._generation = 0
+        self._streak = 0
+        self._opened_at = 0.0
+        self._probing = False
+        self._stats = {"opened": 0, "rejected": 0, "probes": 0, "failures": 0, "deadline_exceeded": 0, "stale": 0}
+
+    @property
+    def is_open(self) -> bool:
+        """True while calls are refused outright; an expired cooldown moves the circuit to half-open first."""
+        if self.state == "open" and time.monotonic() - self._opened_at >= self.cooldown:
+            self.state = "half_open"
+        return self.state == "open"
+
+    def allow(self) -> Optional[Tuple[int, bool]]:
+        """A (generation, is_probe) ticket if a call may go out now, else None; in half-open state only one caller gets one."""
+        if self.is_open:
+            self._stats["rejected"] += 1
+            return None
+        if self.state == "closed":
+            return (self._generation, False)
+        if self.state == "half_open" and not self._probing:
+            self._probing = True
+            self._stats["probes"] += 1
+            return (self._generation, True)
+        self._stats["rejected"] += 1
+        return None
+
+    def _current(self, ticket: Tuple[int, bool]) -> bool:
+        generation, probe = ticket
+        if generation != self._generation or (self.state == "half_open") != probe:
+            self._stats["stale"] += 1
+            return False
+        return True
+
+    def success(self, ticket: Tuple[int, bool]) -> None:
+        if not self._current(ticket):
+            return
+        if ticket[1]:
+            logging.info("OpenAI probe succeeded; closing the circuit")
+            self.state = "closed"
+            self._probing = False
+        self._streak = 0
+
+    def failure(self, ticket: Tuple[int, bool], timeout: bool = False) -> None:
+        self._stats["failures"] += 1
+        self._stats["deadline_exceeded"] += timeout
+        if not self._current(ticket):
+            return
+        self._streak += 1
+        if ticket[1] or self._streak >= self.failures:
+            logging.warning("OpenAI circuit open for %gs after %d failure(s) in a row", self.cooldown, self._streak)
+            self.state = "open"
+            self._generation += 1
+            self._opened_at = time.monotonic()
+            self._stats["opened"] += 1
+            self._probing = False
+
+    def release(self, ticket: Tuple[int, bool]) -> None:
+        """The call ended without a verdict on the provider (cancelled, or a request error)."""
+        if ticket[1] and ticket[0] == self._generation and self.state == "half_open":
+            self._probing = False
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "open": self.is_open, "state": self.state, "half_open": self.state == "half_open",
+            "consecutive_failures": self._streak, **self._stats,
+        }
+
+_breaker = CircuitBreaker(OPENAI_BREAKER_FAILURES, OPENAI_BREAKER_COOLDOWN)
+
+def llm_available() -> bool:
+    """False while the plan circuit is open (cache hits are still served); True again once a probe may go out."""
+    return not _breaker.is_open
+
+async def _within_slo(call: Callable[[], Awaitable[T]]) -> T:
+    """Run a governed call under PLAN_DEADLINE and the circuit breaker; raises LLMUnavailable instead of waiting."""
+    ticket = _breaker.allow()
+    if ticket is None:
+        raise LLMUnavailable("circuit open")
+    try:
+        result = await asyncio.wait_for(call(), PLAN_DEADLINE)
+    except asyncio.TimeoutError as e:
+        # Either PLAN_DEADLINE or the last OPENAI_TIMEOUT attempt
+        _breaker.failure(ticket, timeout=True)
+        raise LLMUnavailable("deadline exceeded") from e
+    except _RETRYABLE as e:
+        _breaker.failure(ticket)
+        raise LLMUnavailable(type(e).__name__) from e
+    except BaseException:
+        _breaker.release(ticket)
+        raise
+    _breaker.success(ticket)
+    return result
 
 # System prompt that turns the model into a proactive personal assistant.
 SYSTEM_PROMPT = (
@@ -26,16 +304,168 @@ SYSTEM_PROMPT = (
     "- suggest_weekly: { scope?: 'finance'|'tasks'|'workout'|'all' }\n"
 )
 
-def _image_content_items(images: Optional[List[Union[str, bytes]]]) -> List[Dict[str, Any]]:
+# Part of the plan cache key, so editing the prompt retires old plans
+SYSTEM_PROMPT_VERSION = hashlib.sha256(SYSTEM_PROMPT.encode("utf-8")).hexdigest()[:12]
+
+# --- plan_actions response cache ---
+# Only these context fields change what a plan looks like; anything else in
+# UserContext (e.g. recent rows) is left out of the key.
+_PLAN_KEY_CONTEXT = ("userId", "timezone", "currency", "locale")
+# ISO date/time fields inside actions that are rebased on a cache hit
+_PLAN_DATE_FIELDS = ("occurredAt", "dueAt", "startAt")
+# Dates this close to the generation time meant "now"
+_NOW_SLACK = timedelta(minutes=2)
+
+_plan_cache = TTLCache(PLAN_CACHE_SIZE, PLAN_CACHE_TTL, name="plans")
+_plan_flight = SingleFlight()
+_plan_disk_hits = 0
+_db: Optional[sqlite3.Connection] = None
+# sqlite connections must not be used from two worker threads at once
+_db_lock = threading.Lock()
+
+def plan_cache_stats() -> Dict[str, Any]:
+    return {**_plan_cache.stats(), "disk_hits": _plan_disk_hits, "disk": bool(PLAN_CACHE_DB)}
+
+def _normalize_message(text: str) -> str:
+    return " ".join((text or "").split()).casefold()
+
+def _plan_key(
+    user_input: str,
+    user_context: Dict[str, Any],
+    images: Optional[List[ImageArg]],
+    model: str,
+) -> str:
+    blob = json.dumps({
+        "m": _normalize_message(user_input),
+        "model": model,
+        "prompt": SYSTEM_PROMPT_VERSION,
+        "ctx": {k: user_context.get(k) for k in _PLAN_KEY_CONTEXT if k in user_context},
+        "img": [_image_digest(i) for i in (images or [])],
+    }, ensure_ascii=False, sort_keys=True)
+    return hashlib.sha256(blob.encode("utf-8")).hexdigest()
+
+def _db_conn() -> sqlite3.Connection:
+    global _db
+    if _db is None:
+        _db = sqlite3.connect(PLAN_CACHE_DB, check_same_thread=False, isolation_level=None)
+        _db.execute("PRAGMA journal_mode=WAL")
+        _db.execute(
+            "create table if not exists plan_cache ("
+            "key text primary key, created_at real not null, expires_at real not null, plan text not null)"
+        )
+        _db.execute("delete from plan_cache where expires_at <= ?", (time.time(),))
+        _db.execute(
+            "delete from plan_cache where key not in "
+            "(select key from plan_cache order by created_at desc limit ?)",
+            (PLAN_CACHE_DB_MAX_ROWS,),
+        )
+    return _db
+
+def _db_get(key: str) -> Optional[Tuple[float, str]]:
+    with _db_lock:
+        row = _db_conn().execute(
+            "select created_at, plan from plan_cache where key = ? and expires_at > ?", (key, time.time())
+        ).fetchone()
+    return (row[0], row[1]) if row else None
+
+def _db_put(key: str, created_at: float, raw: str) -> None:
+    with _db_lock:
+        _db_conn().execute(
+            "insert or replace into plan_cache (key, created_at, expires_at, plan) values (?, ?, ?, ?)",
+            (key, created_at, created_at + PLAN_CACHE_TTL, raw),
+        )
+
+async def _cache_get(key: str) -> Optional[Tuple[float, str]]:
+    global _plan_disk_hits
+    hit = _plan_cache.get(key)
+    if hit is not MISSING:
+        return hit
+    if not PLAN_CACHE_DB:
+        return None
+    try:
+        hit = await asyncio.to_thread(_db_get, key)
+    except sqlite3.Error:
+        return None
+    if hit is not None:
+        _plan_disk_hits += 1
+        _plan_cache.set(key, hit, ttl=max(0.0, hit[0] + PLAN_CACHE_TTL - time.time()))
+    return hit
+
+async def _cache_put(key: str, created_at: float, raw: str) -> None:
+    _plan_cache.set(key, (created_at, raw))
+    if PLAN_CACHE_DB:
+        try:
+            await asyncio.to_thread(_db_put, key, created_at, raw)
+        except sqlite3.Error:
+            pass
+
+def _shift_iso(value: Any, generated: datetime, now: datetime, delta: timedelta) -> Any:
+    if not isinstance(value, str):
+        return value
+    try:
+        if len(value) == 10:
+            return (date.fromisoformat(value) + timedelta(days=delta.days)).isoformat()
+        dt = datetime.fromisoformat(value.replace("Z", "+00:00"))
+    except ValueError:
+        return value
+    if dt.tzinfo is None:
+        dt = tz.localize(dt)
+    if abs(dt - generated) <= _NOW_SLACK:
+        # The model filled in "now"; keep the same small offset from the new now
+        return (now + (dt - generated)).isoformat()
+    return (dt + delta).isoformat()
+
+def _rebase_plan(plan: Dict[str, Any], user_input: str, generated: datetime, now: datetime) -> Dict[str, Any]:
+    """Move the dates of a cached plan from the time it was generated to ``now``.
+
+    When the local parser understands the time expression ("tomorrow at 10",
+    "in 2 hours") dates move by the difference of its two readings; otherwise
+    they move by whole calendar days.
+    """
+    if now - generated <= _NOW_SLACK and now.date() == generated.date():
+        return plan
+    before, after = parse(user_input, now=generated).when, parse(user_input, now=now).when
+    if before is not None and after is not None:
+        delta = after - before
+    else:
+        delta = timedelta(days=(now.date() - generated.date()).days)
+    for action in plan.get("actions") or []:
+        if not isinstance(action, dict):
+            continue
+        for target in (action, action.get("data")):
+            if isinstance(target, dict):
+                for f in _PLAN_DATE_FIELDS:
+                    if f in target:
+                        target[f] = _shift_iso(target[f], generated, now, delta)
+    return plan
+
+def _sniff_mime(data: bytes) -> str:
+    if data.startswith(b"\x89PNG"):
+        return "image/png"
+    if data[:4] == b"RIFF" and data[8:12] == b"WEBP":
+        return "image/webp"
+    if data.startswith((b"GIF87a", b"GIF89a")):
+        return "image/gif"
+    # Telegram photos are JPEG
+    return "image/jpeg"
+
+def _image_digest(img: ImageArg) -> str:
+    if isinstance(img, ImageInput):
+        return hashlib.sha256(img.data).hexdigest() + ":" + img.detail
+    return hashlib.sha256(img if isinstance(img, bytes) else img.encode("utf-8")).hexdigest()
+
+def _image_content_items(images: Optional[List[ImageArg]]) -> List[Dict[str, Any]]:
     items: List[Dict[str, Any]] = []
     if not images:
         return items
     for img in images:
         if isinstance(img, bytes):
-            b64 = base64.b64encode(img).decode("utf-8")
+            img = ImageInput(img, _sniff_mime(img))
+        if isinstance(img, ImageInput):
+            b64 = base64.b64encode(img.data).decode("utf-8")
             items.append({
                 "type": "image_url",
-                "image_url": {"url": f"data:image/png;base64,{b64}"}
+                "image_url": {"url": f"data:{img.mime};base64,{b64}", "detail": img.detail}
             })
         elif isinstance(img, str):
             # Treat as URL or data URL
@@ -47,74 +477,123 @@ def _image_content_items(images: Optional[List[Union[str, bytes]]]) -> List[Dict
 
 async def complete(prompt: str) -> str:
     """Legacy helper returning a free-form answer using the new assistant persona."""
-    def _call():
-        resp = client.chat.completions.create(
-            model=os.getenv("OPENAI_MODEL", "gpt-4o-mini"),
+    model = os.getenv("OPENAI_MODEL", "gpt-4o-mini")
+
+    async def _call():
+        resp = await _metered("complete", model, lambda: client.chat.completions.create(
+            model=model,
             messages=[
                 {"role": "system", "content": SYSTEM_PROMPT},
                 {"role": "user", "content": prompt},
             ],
             temperature=0.2,
-        )
+        ))
         return resp.choices[0].message.content or ""
-    return await asyncio.to_thread(_call)
+    return await _governed(_call, OPENAI_TIMEOUT)
 
+@traced
 async def plan_actions(
     user_input: str,
     user_context: Optional[Dict[str, Any]] = None,
-    images: Optional[List[Union[str, bytes]]] = None,
+    images: Optional[List[ImageArg]] = None,
+    use_cache: bool = True,
 ) -> Dict[str, Any]:
     """
     Produce a structured plan from user input and optional images.
     Returns a dict with shape: { actions: Action[], reply: string }.
+
+    Plans are cached by normalized message, model, prompt version and the
+    context fields in _PLAN_KEY_CONTEXT; dates in a cached plan are re-resolved
+    against the current time. Raises LLMUnavailable when a plan that is not
+    cached cannot be had within PLAN_DEADLINE or the circuit is open.
     """
     user_context = user_context or {}
+    model = os.getenv("OPENAI_MODEL", "gpt-4o-mini")
+    if not use_cache:
+        return (await _plan_uncached(user_input, user_context, images, model))[0]
 
-    # Build a multimodal user message: JSON context + text + optional images
-    user_content: List[Dict[str, Any]] = [
-        {"type": "text", "text": json.dumps({
-            "UserContext": user_context,
-            "Message": user_input
-        }, ensure_ascii=False)}
+    key = _plan_key(user_input, user_context, images, model)
+    hit = await _cache_get(key)
+    if hit is None:
+        # Redelivered or duplicated messages arriving together share one call
+        hit = await _plan_flight.do(key, lambda: _plan_and_store(key, user_input, user_context, images, model))
+    created_at, raw = hit
+    now = now_tz()
+    generated = datetime.fromtimestamp(created_at, now.tzinfo)
+    return _rebase_plan(json.loads(raw), user_input, generated, now)
+
+async def _plan_and_store(
+    key: str,
+    user_input: str,
+    user_context: Dict[str, Any],
+    images: Optional[List[ImageArg]],
+    model: str,
+) -> Tuple[float, str]:
+    created_at = time.time()
+    plan, parsed = await _plan_uncached(user_input, user_context, images, model)
+    raw = json.dumps(plan, ensure_ascii=False)
+    # Unparseable output is not worth repeating
+    if parsed:
+        await _cache_put(key, created_at, raw)
+    return created_at, raw
+
+async def _plan_uncached(
+    user_input: str,
+    user_context: Dict[str, Any],
+    images: Optional[List[ImageArg]],
+    model: str,
+) -> Tuple[Dict[str, Any], bool]:
+    # Most stable first, so the provider's prompt cache can reuse the longest
+    # prefix: the system prompt (same for everyone), then the user's context
+    # (serialized canonically, so it only changes when the data does), then
+    # the message and images.
+    messages = [
+        {"role": "system", "content": SYSTEM_PROMPT},
+        {"role": "user", "content": "UserContext: " + json.dumps(
+            user_context, ensure_ascii=False, sort_keys=True, separators=(",", ":"), default=str)},
+        {"role": "user", "content": [
+            {"type": "text", "text": "Message: " + user_input},
+            *_image_content_items(images),
+        ]},
     ]
-    user_content.extend(_image_content_items(images))
 
-    def _call():
-        resp = client.chat.completions.create(
-            model=os.getenv("OPENAI_MODEL", "gpt-4o-mini"),
-            messages=[
-                {"role": "system", "content": SYSTEM_PROMPT},
-                {"role": "user", "content": user_content},
-            ],
+    async def _call():
+        resp = await _metered("plan", model, lambda: client.chat.completions.create(
+            model=model,
+            messages=messages,
             temperature=0,
             response_format={"type": "json_object"}
-        )
-        raw = resp.choices[0].message.content or "{}"
-        try:
-            return json.loads(raw)
-        except Exception:
-            # Fallback: wrap as a minimal contract
-            return {"actions": [], "reply": raw}
+        ))
+        return resp.choices[0].message.content or "{}"
 
-    return await asyncio.to_thread(_call)
+    raw = await _within_slo(lambda: _governed(_call, OPENAI_TIMEOUT))
+    try:
+        return json.loads(raw), True
+    except Exception:
+        # Fallback: wrap as a minimal contract
+        return {"actions": [], "reply": raw}, False
 
-async def transcribe_audio(path_or_bytes: Union[str, bytes]) -> str:
-    """Transcribe voice messages. Supports a file path or raw bytes. Uses Whisper-1 by default."""
+@traced
+async def transcribe_audio(path_or_bytes: Union[str, bytes, BinaryIO]) -> str:
+    """Transcribe voice messages. Supports a file path, raw bytes or an open binary file. Uses Whisper-1 by default."""
     model = os.getenv("OPENAI_TRANSCRIBE_MODEL", "whisper-1")
 
-    def _call_from_path(p: str) -> str:
-        with open(p, "rb") as f:
-            tr = client.audio.transcriptions.create(model=model, file=f)
-        # SDK returns an object with .text
-        return getattr(tr, "text", "") or ""
+    def _create(file):
+        return _metered("transcribe", model, lambda: client.audio.transcriptions.create(
+            model=model, file=file, timeout=OPENAI_TRANSCRIBE_TIMEOUT))
 
-    def _call_from_bytes(b: bytes) -> str:
-        import io
-        f = io.BytesIO(b)
-        f.name = "audio.ogg"  # Telegram voice default; server will infer
-        tr = client.audio.transcriptions.create(model=model, file=f)
+    async def _call():
+        if hasattr(path_or_bytes, "read"):
+            # Streamed from the file; rewound so a retry sends it again
+            path_or_bytes.seek(0)
+            tr = await _create(("audio.ogg", path_or_bytes))
+        elif isinstance(path_or_bytes, bytes):
+            # Telegram voice default; server will infer
+            tr = await _create(("audio.ogg", path_or_bytes))
+        else:
+            with open(path_or_bytes, "rb") as fh:
+                tr = await _create(fh)
+        # SDK returns an object with .text
         return getattr(tr, "text", "") or ""
 
-    if isinstance(path_or_bytes, bytes):
-        return await asyncio.to_thread(_call_from_bytes, path_or_bytes)
-    return await asyncio.to_thread(_call_from_path, path_or_bytes)
+    return await _governed(_call, OPENAI_TRANSCRIBE_TIMEOUT)
@@ -0,0 +1,135 @@
+import os, asyncio, logging, time
+from aiogram import Bot, Dispatcher
+from aiogram.exceptions import TelegramUnauthorizedError
+from aiogram.types import Update
+from aiogram.utils.backoff import Backoff, BackoffConfig
+from aiohttp import web
+from . import digests, metrics, sender, user_context
+from .openai_client import llm_stats
+from .workers import ChatWorkerPool, update_chat_key
+
+# Long polling for single-node deployments (e.g. behind NAT). getUpdates runs
+# in one loop; updates go to the same per-chat-ordered worker pool as the
+# webhook, and polling pauses while POLL_MAX_PENDING updates are waiting, so
+# a burst is buffered by Telegram rather than in memory.
+POLL_TIMEOUT = int(os.getenv("POLL_TIMEOUT", "30"))           # long-poll wait (s)
+POLL_LIMIT = max(1, min(100, int(os.getenv("POLL_LIMIT", "100"))))  # updates per getUpdates (1..100)
+POLL_WORKERS = int(os.getenv("POLL_WORKERS", "16"))
+POLL_MAX_PENDING = int(os.getenv("POLL_MAX_PENDING", "1000"))
+POLL_DRAIN_TIMEOUT = float(os.getenv("POLL_DRAIN_TIMEOUT", "25"))
+# Comma-separated update types to receive; default: the types the handlers use
+POLL_ALLOWED_UPDATES = [t.strip() for t in os.getenv("POLL_ALLOWED_UPDATES", "").split(",") if t.strip()]
+# Port for /metrics and /healthz while polling (0 = off)
+METRICS_PORT = int(os.getenv("METRICS_PORT", "0"))
+
+_BACKOFF = BackoffConfig(min_delay=1.0, max_delay=5.0, factor=1.3, jitter=0.1)
+_stats = {"batches": 0, "received": 0, "empty_polls": 0, "errors": 0, "paused": 0}
+
+def polling_stats() -> dict:
+    return dict(_stats)
+
+class Poller:
+    def __init__(self, bot: Bot, dp: Dispatcher):
+        self.bot = bot
+        self.dp = dp
+        self.pool = ChatWorkerPool(self._process, workers=POLL_WORKERS, max_pending=POLL_MAX_PENDING)
+        self.allowed_updates = POLL_ALLOWED_UPDATES or dp.resolve_used_update_types()
+        # Telegram drops updates below the offset of the *next* getUpdates call
+        self.offset: int | None = None
+        self._unfinished: set[int] = set()
+
+    async def _process(self, item: tuple[Update, float]) -> None:
+        update, queued_at = item
+        metrics.QUEUE_SECONDS.observe(time.monotonic() - queued_at)
+        try:
+            await self.dp.feed_update(self.bot, update)
+        except asyncio.CancelledError:
+            # Cut off by the shutdown drain: left unconfirmed, so it is delivered again
+            raise
+        except Exception:
+            logging.exception("Update %s failed", update.update_id)
+        self._unfinished.discard(update.update_id)
+
+    def _full(self) -> bool:
+        return self.pool.pending > 0 and self.pool.pending + POLL_LIMIT > self.pool.max_pending
+
+    async def _room(self) -> None:
+        """Wait until a full batch fits under POLL_MAX_PENDING."""
+        if not self._full():
+            return
+        _stats["paused"] += 1
+        while self._full():
+            await asyncio.sleep(0.05)
+
+    async def run(self) -> None:
+        """Fetch updates until cancelled; each one is queued behind earlier updates of its chat."""
+        me = await self.bot.me()
+        logging.info("Polling @%s: timeout=%ss limit=%d workers=%d allowed_updates=%s",
+                     me.username, POLL_TIMEOUT, POLL_LIMIT, POLL_WORKERS, ",".join(self.allowed_updates))
+        self.pool.start()
+        backoff = Backoff(config=_BACKOFF)
+        while True:
+            await self._room()
+            try:
+                updates = await self.bot.get_updates(
+                    offset=self.offset, limit=POLL_LIMIT, timeout=POLL_TIMEOUT,
+                    allowed_updates=self.allowed_updates, request_timeout=POLL_TIMEOUT + 10,
+                )
+            except TelegramUnauthorizedError:
+                raise
+            except Exception as e:
+                # Includes 409 Conflict while a previous instance is still polling
+                _stats["errors"] += 1
+                logging.error("getUpdates failed (%s: %s); retrying in %.1fs", type(e).__name__, e, backoff.next_delay)
+                await backoff.asleep()
+                continue
+            backoff.reset()
+            if not updates:
+                _stats["empty_polls"] += 1
+                continue
+            _stats["batches"] += 1
+            _stats["received"] += len(updates)
+            now = time.monotonic()
+            for update in updates:
+                # Confirmed to Telegram by the next offset, so never refused here
+                self._unfinished.add(update.update_id)
+                self.pool.submit(update_chat_key(update), (update, now), force=True)
+            self.offset = updates[-1].update_id + 1
+
+    async def drain(self) -> None:
+        """Finish the fetched updates, then confirm them so a restart does not receive them again.
+
+        Updates the drain timeout cut off (and any after them) stay unconfirmed
+        and are redelivered on the next start.
+        """
+        await self.pool.drain(POLL_DRAIN_TIMEOUT)
+        if self.offset is None:
+            return
+        offset = min(self._unfinished, default=self.offset)
+        try:
+            await self.bot.get_updates(offset=offset, limit=1, timeout=0, allowed_updates=self.allowed_updates)
+        except Exception as e:
+            logging.warning("Could not confirm updates below %d; they will be delivered again: %s", offset, e)
+
+async def serve_metrics(poller: Poller) -> web.AppRunner | None:
+    """/metrics and /healthz on METRICS_PORT, with the series names webhook mode uses."""
+    if not METRICS_PORT:
+        return None
+
+    async def prometheus(_request):
+        body, content_type = metrics.render()
+        return web.Response(body=body, headers={"Content-Type": content_type})
+
+    async def healthz(_request):
+        return web.json_response({"ok": True, "queue": poller.pool.stats(), "polling": polling_stats(),
+                                  "digests": digests.digest_stats(), "sender": sender.sender_stats(),
+                                  "context": user_context.context_stats(), "openai": llm_stats()})
+
+    app = web.Application()
+    app.router.add_get("/metrics", prometheus)
+    app.router.add_get("/healthz", healthz)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, port=METRICS_PORT).start()
+    logging.info("Metrics on :%d/metrics", METRICS_PORT)
+    return runner
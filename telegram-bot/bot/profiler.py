@@ -0,0 +1,52 @@
+import os, sys, time, threading
+from collections import Counter
+
+# Sampling profiler for the live process: a background thread snapshots every
+# thread's Python stack at a fixed interval and counts identical stacks. The
+# result is in collapsed-stack format ("root;caller;callee count" per line),
+# which flamegraph.pl, speedscope and inferno read directly.
+PROFILE_MAX_SECONDS = float(os.getenv("PROFILE_MAX_SECONDS", "60"))
+
+_running = threading.Lock()
+
+def _label(frame) -> str:
+    code = frame.f_code
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+def _stack(frame) -> list[str]:
+    out = []
+    while frame is not None:
+        out.append(_label(frame))
+        frame = frame.f_back
+    out.reverse()
+    return out
+
+def sample(seconds: float, interval: float = 0.005) -> tuple[Counter, int]:
+    """Sample all other threads for ``seconds``; returns (stack counts, number of sampling rounds).
+
+    Blocking: run it in a worker thread. Raises RuntimeError if a profile is already running.
+    """
+    if not _running.acquire(blocking=False):
+        raise RuntimeError("a profile is already running")
+    try:
+        me = threading.get_ident()
+        names = {}
+        counts: Counter = Counter()
+        rounds = 0
+        deadline = time.monotonic() + min(seconds, PROFILE_MAX_SECONDS)
+        while time.monotonic() < deadline:
+            for ident, frame in sys._current_frames().items():
+                if ident == me:
+                    continue
+                if ident not in names:
+                    names = {t.ident: t.name for t in threading.enumerate()}
+                stack = [f"thread {names.get(ident, ident)}"] + _stack(frame)
+                counts[";".join(s.replace(";", ":") for s in stack)] += 1
+            rounds += 1
+            time.sleep(interval)
+        return counts, rounds
+    finally:
+        _running.release()
+
+def collapsed(counts: Counter) -> str:
+    return "".join(f"{stack} {n}\n" for stack, n in counts.most_common())
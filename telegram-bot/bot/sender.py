@@ -0,0 +1,187 @@
+import os, asyncio, time, logging, contextvars
+from collections import deque
+from contextlib import contextmanager
+from aiogram import Bot
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware
+from aiogram.exceptions import TelegramRetryAfter
+from .tracing import span
+
+# Outbound limits (Telegram: ~30 msg/s per bot, ~1 msg/s per private chat, 20 msg/min per group)
+SEND_GLOBAL_RATE = float(os.getenv("SEND_GLOBAL_RATE", "30"))
+SEND_GLOBAL_BURST = float(os.getenv("SEND_GLOBAL_BURST", "30"))
+SEND_CHAT_RATE = float(os.getenv("SEND_CHAT_RATE", "1"))
+SEND_CHAT_BURST = float(os.getenv("SEND_CHAT_BURST", "3"))
+SEND_GROUP_RATE = float(os.getenv("SEND_GROUP_RATE", str(20 / 60)))
+SEND_GROUP_BURST = float(os.getenv("SEND_GROUP_BURST", "5"))
+# How many times a send is retried after a 429 (waiting retry_after each time)
+SEND_MAX_RETRIES = int(os.getenv("SEND_MAX_RETRIES", "3"))
+_MAX_CHAT_BUCKETS = 10000
+
+INTERACTIVE = "interactive"
+BULK = "bulk"
+# Lane for sends made in the current task; digests and other fan-out wrap theirs in bulk()
+_lane: contextvars.ContextVar[str] = contextvars.ContextVar("send_lane", default=INTERACTIVE)
+
+@contextmanager
+def bulk():
+    """Send from this block in the bulk lane (behind interactive replies)."""
+    token = _lane.set(BULK)
+    try:
+        yield
+    finally:
+        _lane.reset(token)
+
+class TokenBucket:
+    """Refills ``rate`` tokens per second up to ``burst``."""
+
+    __slots__ = ("rate", "burst", "tokens", "stamp", "paused_until")
+
+    def __init__(self, rate: float, burst: float):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.stamp = time.monotonic()
+        self.paused_until = 0.0
+
+    def _refill(self, now: float) -> None:
+        # stamp is in the future while paused: nothing refills until then
+        if now > self.stamp:
+            self.tokens = min(self.burst, self.tokens + (now - self.stamp) * self.rate)
+            self.stamp = now
+
+    def delay(self) -> float:
+        """Seconds until a token is available (0 if one is available now)."""
+        now = time.monotonic()
+        self._refill(now)
+        if now < self.paused_until:
+            return self.paused_until - now
+        return 0.0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+
+    def take(self) -> None:
+        self.tokens -= 1
+
+    def pause(self, seconds: float) -> None:
+        self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+        self.tokens = 0
+        self.stamp = self.paused_until
+
+    def idle(self) -> bool:
+        self._refill(time.monotonic())
+        return self.tokens >= self.burst and time.monotonic() >= self.paused_until
+
+class OutboundLimiter(BaseRequestMiddleware):
+    """aiogram request middleware that paces sends to stay under Telegram's limits.
+
+    Every send waits for a token from its chat's bucket and then from the global
+    bucket. Global tokens are handed out in order, interactive sends before
+    bulk ones. A 429 pauses the chat for retry_after (and every chat for
+    up to a second) and retries the send.
+    """
+
+    def __init__(self):
+        self.global_bucket = TokenBucket(SEND_GLOBAL_RATE, SEND_GLOBAL_BURST)
+        self.chats: dict[int | str, TokenBucket] = {}
+        self.waiting = {INTERACTIVE: 0, BULK: 0}
+        # Sends that have their chat token and wait for a global one, per lane
+        self._queues: dict[str, deque] = {INTERACTIVE: deque(), BULK: deque()}
+        self._pump: asyncio.Task | None = None
+        self.sent = 0
+        self.throttled = 0
+        self.throttle_seconds = 0.0
+        self.retry_after = 0
+
+    def _chat_bucket(self, chat_id) -> TokenBucket:
+        b = self.chats.get(chat_id)
+        if b is None:
+            if len(self.chats) >= _MAX_CHAT_BUCKETS:
+                # Full buckets carry no state worth keeping
+                for k in [k for k, v in self.chats.items() if v.idle()]:
+                    del self.chats[k]
+            group = isinstance(chat_id, str) or chat_id < 0
+            b = TokenBucket(SEND_GROUP_RATE, SEND_GROUP_BURST) if group else TokenBucket(SEND_CHAT_RATE, SEND_CHAT_BURST)
+            self.chats[chat_id] = b
+        return b
+
+    async def _acquire(self, chat: TokenBucket, lane: str) -> None:
+        started = time.monotonic()
+        self.waiting[lane] += 1
+        try:
+            d = chat.delay()
+            while d > 0:
+                await asyncio.sleep(d)
+                d = chat.delay()
+            chat.take()
+            if self._queues[INTERACTIVE] or self._queues[BULK] or self.global_bucket.delay() > 0:
+                fut = asyncio.get_running_loop().create_future()
+                self._queues[lane].append(fut)
+                if self._pump is None or self._pump.done():
+                    self._pump = asyncio.create_task(self._run_pump())
+                await fut
+            else:
+                self.global_bucket.take()
+        finally:
+            self.waiting[lane] -= 1
+        waited = time.monotonic() - started
+        if waited > 0.001:
+            self.throttled += 1
+            self.throttle_seconds += waited
+
+    async def _run_pump(self) -> None:
+        """Hand out global tokens as they refill, interactive waiters first."""
+        while self._queues[INTERACTIVE] or self._queues[BULK]:
+            d = self.global_bucket.delay()
+            if d > 0:
+                await asyncio.sleep(d)
+                continue
+            fut = (self._queues[INTERACTIVE] or self._queues[BULK]).popleft()
+            if not fut.done():
+                self.global_bucket.take()
+                fut.set_result(None)
+
+    async def __call__(self, make_request, bot: Bot, method):
+        with span(f"tg.{method.__api_method__}"):
+            return await self._send(make_request, bot, method)
+
+    async def _send(self, make_request, bot: Bot, method):
+        chat_id = getattr(method, "chat_id", None)
+        if chat_id is None or not method.__api_method__.startswith(("send", "copy", "forward")):
+            return await make_request(bot, method)
+        chat = self._chat_bucket(chat_id)
+        lane = _lane.get()
+        attempt = 0
+        while True:
+            await self._acquire(chat, lane)
+            try:
+                res = await make_request(bot, method)
+                self.sent += 1
+                return res
+            except TelegramRetryAfter as e:
+                self.retry_after += 1
+                if attempt >= SEND_MAX_RETRIES:
+                    raise
+                attempt += 1
+                logging.warning("Telegram 429 for chat %s, retrying in %ss", chat_id, e.retry_after)
+                chat.pause(e.retry_after)
+                # Flood limits are per bot as well: slow everything down for a moment
+                self.global_bucket.pause(min(e.retry_after, 1))
+
+    def stats(self) -> dict:
+        return {
+            "queued_interactive": self.waiting[INTERACTIVE],
+            "queued_bulk": self.waiting[BULK],
+            "sent": self.sent,
+            "throttled": self.throttled,
+            "throttle_seconds": round(self.throttle_seconds, 3),
+            "retry_after": self.retry_after,
+            "chat_buckets": len(self.chats),
+        }
+
+limiter = OutboundLimiter()
+
+def install(bot: Bot) -> Bot:
+    """Route all of ``bot``'s requests through the shared limiter."""
+    bot.session.middleware(limiter)
+    return bot
+
+def sender_stats() -> dict:
+    return limiter.stats()
@@ -1,13 +1,23 @@
-import os, logging
+import os, asyncio, logging, time
 from urllib.parse import urlparse
-from fastapi import FastAPI, Request, Header, HTTPException
+from fastapi import FastAPI, Request, Header, HTTPException, Response
+from fastapi.responses import PlainTextResponse
+from pydantic import ValidationError
 from aiogram import Bot, Dispatcher
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.telegram import TelegramAPIServer
 from aiogram.types import Update
 from dotenv import load_dotenv
 
 # Load env before imports that use it
 load_dotenv()
 from .handlers import router
+from .sender import install as install_limiter, sender_stats
+from . import cluster, db, digests, journal, metrics, profiler, throttle, tracing, user_context
+from .workers import ChatWorkerPool, update_chat_key
+from .openai_client import llm_stats, llm_usage, plan_cache_stats
+from .images import image_stats
+from .voice import voice_stats
 
 BOT_TOKEN = os.environ.get("BOT_TOKEN")
 if not BOT_TOKEN:
@@ -32,20 +42,66 @@ def _truthy(v: str | None, default: bool = False) -> bool:
     return str(v).strip().lower() in {"1", "true", "yes", "on"}
 
 DELETE_WEBHOOK_ON_SHUTDOWN = _truthy(os.getenv("DELETE_WEBHOOK_ON_SHUTDOWN"), False)
+# Updates are acknowledged at once and handled by a worker pool; when it is
+# full we answer 503 and Telegram redelivers later.
+WEBHOOK_WORKERS = int(os.getenv("WEBHOOK_WORKERS", "16"))
+WEBHOOK_MAX_PENDING = int(os.getenv("WEBHOOK_MAX_PENDING", "1000"))
+WEBHOOK_DRAIN_TIMEOUT = float(os.getenv("WEBHOOK_DRAIN_TIMEOUT", "25"))
 if not WEBHOOK_URL:
     raise RuntimeError("WEBHOOK_URL is not set. Set it to your public https URL (e.g., https://host/telegram/webhook/secret).")
 
-bot = Bot(BOT_TOKEN)
+# Optional Bot API base URL (a local telegram-bot-api server, or the load-test stand-in)
+TELEGRAM_API_URL = os.getenv("TELEGRAM_API_URL", "")
+_session = AiohttpSession(api=TelegramAPIServer.from_base(TELEGRAM_API_URL)) if TELEGRAM_API_URL else None
+# All outgoing sends are paced to stay under Telegram's rate limits
+bot = install_limiter(Bot(BOT_TOKEN, session=_session))
 dp = Dispatcher()
 dp.include_router(router)
+metrics.install(dp)
+tracing.install(dp)
+throttle.install(dp)
+
+async def _process(item: tuple[Update, float]) -> None:
+    update, queued_at = item
+    metrics.QUEUE_SECONDS.observe(time.monotonic() - queued_at)
+    try:
+        await dp.feed_update(bot, update)
+    except asyncio.CancelledError:
+        # Cut off by the shutdown drain: stays unfinished and is replayed on boot
+        raise
+    except Exception:
+        logging.exception("Update %s failed", update.update_id)
+    journal.mark_done(update.update_id)
+
+pool = ChatWorkerPool(_process, workers=WEBHOOK_WORKERS, max_pending=WEBHOOK_MAX_PENDING)
+
+for _name, _fn in (
+    ("webhook_queue", pool.stats), ("journal", journal.stats), ("sender", sender_stats),
+    ("digests", digests.digest_stats), ("user_context", user_context.context_stats),
+    ("openai", llm_stats), ("tracing", tracing.tracing_stats), ("plan_cache", plan_cache_stats), ("images", image_stats), ("voice", voice_stats),
+    ("cluster", cluster.cluster_stats), ("throttle", throttle.throttle_stats),
+):
+    metrics.register_stats(_name, _fn)
 
 app = FastAPI()
 
 @app.on_event("startup")
 async def _startup():
+    pool.start()
+    # With BOT_PROCESSES > 1 each process owns a share of the chats and journals them in its own file
+    await cluster.start(_accept_forwarded, lambda: metrics.render()[0])
+    journal.set_path(cluster.slot_path(journal.UPDATE_JOURNAL_PATH))
+    _replay_journal()
+    user_context.start()
+    await cluster.elect(_lead)
+
+async def _lead():
+    """Once per deployment: the digest scheduler and webhook registration."""
+    digests.start(bot)
     logging.info(f"Setting Telegram webhook to: {WEBHOOK_URL}")
     logging.info(f"Webhook path configured: {WEBHOOK_PATH} (derived from URL if not set explicitly)")
-    ok = await bot.set_webhook(WEBHOOK_URL, secret_token=WEBHOOK_SECRET or None, drop_pending_updates=True)
+    # Keep Telegram's backlog: the journal drops anything already handled
+    ok = await bot.set_webhook(WEBHOOK_URL, secret_token=WEBHOOK_SECRET or None, drop_pending_updates=False)
     logging.info("set_webhook result: %s", ok)
     try:
         info = await bot.get_webhook_info()
@@ -59,9 +115,29 @@ async def _startup():
 
 @app.on_event("shutdown")
 async def _shutdown():
-    if DELETE_WEBHOOK_ON_SHUTDOWN:
+    if DELETE_WEBHOOK_ON_SHUTDOWN and cluster.is_leader():
         logging.info("Deleting webhook on shutdown per configuration")
         await bot.delete_webhook()
+    await digests.stop()
+    await user_context.stop()
+    # Other processes get 503s for our chats from here on; Telegram retries them
+    await cluster.stop()
+    # Let accepted updates finish before connections are closed
+    await pool.drain(WEBHOOK_DRAIN_TIMEOUT)
+    journal.close()
+    await db.close()
+
+def _replay_journal() -> None:
+    """Queue updates that were accepted before a restart but never finished."""
+    if cluster.slot is None:
+        return
+    for update_id, body in journal.unfinished():
+        try:
+            update = Update.model_validate_json(body)
+        except ValidationError:
+            journal.mark_done(update_id)
+            continue
+        pool.submit(update_chat_key(update), (update, time.monotonic()), force=True)
 
 @app.get("/")
 async def root():
@@ -79,11 +155,48 @@ async def webhook(request: Request, x_telegram_bot_api_secret_token: str | None
     logging.info("Webhook hit: validating secret header")
     if WEBHOOK_SECRET and (x_telegram_bot_api_secret_token or "") != WEBHOOK_SECRET:
         raise HTTPException(status_code=401, detail="invalid token")
-    data = await request.json()
-    logging.info("Webhook update received; forwarding to dispatcher")
-    await dp.feed_update(bot, Update.model_validate(data))
+    await _enqueue(await request.body())
     return {"ok": True}
 
+async def _enqueue(body: bytes) -> None:
+    """Validate the raw update and queue it here or in the process that owns its chat.
+
+    Raises HTTPException on bad input, a full queue or an unreachable owner.
+    """
+    try:
+        update = Update.model_validate_json(body)
+    except ValidationError as e:
+        logging.warning("Rejecting malformed update: %s", e.error_count())
+        metrics.WEBHOOK_REQUESTS.labels("invalid").inc()
+        raise HTTPException(status_code=400, detail="invalid update")
+    key = update_chat_key(update)
+    result = _accept(update, body, key) if cluster.is_local(key) else await cluster.forward(key, body)
+    metrics.WEBHOOK_REQUESTS.labels(result).inc()
+    if result == "duplicate":
+        logging.info("Duplicate update %s ignored", update.update_id)
+    elif result in ("busy", "unavailable"):
+        raise HTTPException(status_code=503, detail=result)
+    elif result == "invalid":
+        raise HTTPException(status_code=400, detail="invalid update")
+
+def _accept(update: Update, body: bytes, key) -> str:
+    """Journal and queue an update of a chat this process owns: accepted, duplicate or busy."""
+    if not journal.record(update.update_id, body):
+        return "duplicate"
+    if not pool.submit(key, (update, time.monotonic())):
+        journal.forget(update.update_id)
+        logging.warning("Update queue full (%d pending); asking Telegram to retry", pool.pending)
+        return "busy"
+    return "accepted"
+
+async def _accept_forwarded(body: bytes) -> str:
+    # The receiving process validated it already; parsing again is cheaper than shipping the model
+    try:
+        update = Update.model_validate_json(body)
+    except ValidationError:
+        return "invalid"
+    return _accept(update, body, update_chat_key(update))
+
 # Guarded catch-all to avoid 404 when minor path differences occur (e.g., missing secret segment or trailing slash)
 @app.post("/tg/webhook/{tail:path}")
 async def webhook_catch_all(tail: str, request: Request, x_telegram_bot_api_secret_token: str | None = Header(default=None)):
@@ -95,14 +208,23 @@ async def webhook_catch_all(tail: str, request: Request, x_telegram_bot_api_secr
         # If no secret, require last segment to match configured token segment to prevent random posts
         if _WEBHOOK_TOKEN_SEGMENT and not request.url.path.rstrip("/").endswith("/" + _WEBHOOK_TOKEN_SEGMENT):
             raise HTTPException(status_code=404, detail="not found")
-    data = await request.json()
     logging.info("Webhook catch-all matched: %s", request.url.path)
-    await dp.feed_update(bot, Update.model_validate(data))
+    await _enqueue(await request.body())
     return {"ok": True, "alias": True}
 
 @app.get("/healthz")
 async def healthz():
-    return {"ok": True}
+    return {"ok": True, "queue": pool.stats(), "journal": journal.stats(), "digests": digests.digest_stats(), "sender": sender_stats(), "context": user_context.context_stats(), "openai": llm_stats(), "cluster": cluster.cluster_stats()}
+
+@app.get("/metrics")
+async def prometheus_metrics():
+    body, content_type = metrics.render()
+    if cluster.multi():
+        # Whichever process is scraped answers for all of them, labelled by slot
+        own = str(cluster.slot) if cluster.slot is not None else f"pid{os.getpid()}"
+        parts = {own: body, **{str(n): b for n, b in (await cluster.peer_metrics()).items()}}
+        body = metrics.merge(parts)
+    return Response(body, media_type=content_type)
 
 @app.get("/debug/webhook")
 async def debug_webhook():
@@ -128,6 +250,26 @@ def _check_admin_token(token: str | None) -> None:
     if (token or "") != DEBUG_ADMIN_TOKEN:
         raise HTTPException(status_code=401, detail="invalid admin token")
 
+@app.get("/debug/llm-usage")
+async def debug_llm_usage(token: str | None = None, recent: int = 0):
+    _check_admin_token(token)
+    return {"ok": True, **llm_usage(recent), "plan_cache": plan_cache_stats()}
+
+@app.get("/debug/traces")
+async def debug_traces(token: str | None = None):
+    _check_admin_token(token)
+    return {"ok": True, "slow_update_seconds": tracing.SLOW_UPDATE_SECONDS, "traces": tracing.slow_traces()}
+
+@app.get("/debug/profile")
+async def debug_profile(token: str | None = None, seconds: float = 10, interval_ms: float = 5):
+    """Sample the live process for ``seconds`` and return collapsed stacks (flamegraph.pl / speedscope input)."""
+    _check_admin_token(token)
+    try:
+        counts, rounds = await asyncio.to_thread(profiler.sample, seconds, max(interval_ms, 1) / 1000)
+    except RuntimeError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    return PlainTextResponse(profiler.collapsed(counts), headers={"X-Profile-Samples": str(rounds)})
+
 @app.get("/debug/set-webhook")
 async def debug_set_webhook(token: str | None = None):
     _check_admin_token(token)
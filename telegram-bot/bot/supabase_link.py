@@ -1,78 +1,102 @@
 import os, time, hmac, hashlib, urllib.parse
-from dotenv import load_dotenv
-from supabase import create_client, Client
+from .db import sb, execute
+from .cache import TTLCache, SingleFlight, MISSING
+from .tracing import traced
 
-# Ensure .env is loaded for local runs
-load_dotenv()
+# Telegram id -> user_id (or None for "not linked"). Unlinked users get a
+# short TTL so that linking from the app is picked up quickly.
+LINK_CACHE_SIZE = int(os.getenv("LINK_CACHE_SIZE", "10000"))
+LINK_CACHE_TTL = float(os.getenv("LINK_CACHE_TTL", "600"))
+LINK_CACHE_NEGATIVE_TTL = float(os.getenv("LINK_CACHE_NEGATIVE_TTL", "15"))
+_link_cache = TTLCache(LINK_CACHE_SIZE, LINK_CACHE_TTL, name="links")
 
-# URL comes from public env to keep single source
-SUPABASE_URL = os.environ.get("NEXT_PUBLIC_SUPABASE_URL")
-# Prefer service role for server-side bot to bypass RLS; fallback to anon if not set
-SUPABASE_KEY = (
-    os.environ.get("SUPABASE_SERVICE_ROLE_KEY")
-    or os.environ.get("NEXT_PUBLIC_SUPABASE_ANON_KEY")
-)
-if not SUPABASE_URL or not SUPABASE_KEY:
-    raise RuntimeError("Missing NEXT_PUBLIC_SUPABASE_URL or NEXT_PUBLIC_SUPABASE_ANON_KEY in environment.")
+# user_id -> default finance account id. Shared single-flight so concurrent
+# messages from one user resolve (and, if needed, create) the account once.
+RESOLVE_CACHE_SIZE = int(os.getenv("RESOLVE_CACHE_SIZE", "10000"))
+RESOLVE_CACHE_TTL = float(os.getenv("RESOLVE_CACHE_TTL", "3600"))
+_account_cache = TTLCache(RESOLVE_CACHE_SIZE, RESOLVE_CACHE_TTL, name="accounts")
+_resolve_flight = SingleFlight()
 
-def sb() -> Client:
-    return create_client(SUPABASE_URL, SUPABASE_KEY)
+def link_cache_stats() -> dict:
+    return _link_cache.stats()
+
+def invalidate_link(telegram_user_id: int) -> None:
+    _link_cache.invalidate(telegram_user_id)
 
 # --- Linking helpers ---
-def get_user_by_telegram(telegram_user_id: int):
+@traced
+async def get_user_by_telegram(telegram_user_id: int):
+    cached = _link_cache.get(telegram_user_id)
+    if cached is not MISSING:
+        return cached
     try:
-        s = sb()
-        res = s.table("telegram_links").select("user_id").eq("telegram_user_id", telegram_user_id).limit(1).execute()
+        s = await sb()
+        res = await execute(s.table("telegram_links").select("user_id").eq("telegram_user_id", telegram_user_id).limit(1))
         if getattr(res, "error", None):
             # RLS or table missing: treat as not linked
             return None
         if res.data:
-            return res.data[0]["user_id"]
+            user_id = res.data[0]["user_id"]
+            _link_cache.set(telegram_user_id, user_id)
+            return user_id
+        _link_cache.set(telegram_user_id, None, ttl=LINK_CACHE_NEGATIVE_TTL)
     except Exception:
         # Misconfig or network: treat as not linked so /start still replies
         return None
     return None
 
-def ensure_default_account(user_id: str) -> str:
-    s = sb()
-    res = s.table("finance_accounts").select("id").eq("user_id", user_id).eq("is_default", True).limit(1).execute()
+async def ensure_default_account(user_id: str) -> str:
+    cached = _account_cache.get(user_id)
+    if cached is not MISSING:
+        return cached
+    account_id = await _resolve_flight.do(("account", user_id), lambda: _load_default_account(user_id))
+    _account_cache.set(user_id, account_id)
+    return account_id
+
+async def _load_default_account(user_id: str) -> str:
+    s = await sb()
+    res = await execute(s.table("finance_accounts").select("id").eq("user_id", user_id).eq("is_default", True).limit(1))
     if getattr(res, "error", None):
         raise RuntimeError(f"RLS blocked reading finance_accounts: {res.error}")
     if res.data:
         return res.data[0]["id"]
-    ins = s.table("finance_accounts").insert({
-        "user_id": user_id,
-        "name": "Cash",
-        "type": "cash",
-        "is_default": True
-    }).execute()
-    if getattr(ins, "error", None):
-        raise RuntimeError(f"RLS blocked creating default account: {ins.error}")
-    return ins.data[0]["id"]
+    # Insert-if-absent on the one-default-per-user index, see supabase/schema.sql
+    ins = await execute(s.rpc("ensure_default_finance_account", {"p_user_id": user_id}))
+    if getattr(ins, "error", None) or not ins.data:
+        raise RuntimeError(f"RLS blocked creating default account: {getattr(ins, 'error', None)}")
+    return ins.data
+
+def invalidate_default_account(user_id: str) -> None:
+    _account_cache.invalidate(user_id)
 
-def create_link_code(code: str, telegram_user_id: int):
-    s = sb()
-    res = s.table("telegram_link_codes").upsert({
+async def create_link_code(code: str, telegram_user_id: int):
+    s = await sb()
+    res = await execute(s.table("telegram_link_codes").upsert({
         "code": code,
         "telegram_user_id": telegram_user_id,
-    }).execute()
+    }))
     if getattr(res, "error", None):
         # Not fatal for /link UX, just ignore
         return False
     return True
 
-def consume_link_code(code: str, user_id: str) -> bool:
-    s = sb()
-    res = s.table("telegram_link_codes").select("*").eq("code", code).limit(1).execute()
+async def consume_link_code(code: str, user_id: str) -> bool:
+    s = await sb()
+    res = await execute(s.table("telegram_link_codes").select("*").eq("code", code).limit(1))
     if getattr(res, "error", None) or not res.data:
         return False
-    up = s.table("telegram_links").upsert({
+    telegram_user_id = res.data[0]["telegram_user_id"]
+    # Drop any cached (possibly negative) entry before the write so a failed
+    # upsert cannot leave a stale answer behind.
+    _link_cache.invalidate(telegram_user_id)
+    up = await execute(s.table("telegram_links").upsert({
         "user_id": user_id,
-        "telegram_user_id": res.data[0]["telegram_user_id"]
-    }).execute()
+        "telegram_user_id": telegram_user_id
+    }, on_conflict="telegram_user_id"))
     if getattr(up, "error", None):
         return False
-    s.table("telegram_link_codes").update({"consumed_by": user_id}).eq("code", code).execute()
+    _link_cache.set(telegram_user_id, user_id)
+    await execute(s.table("telegram_link_codes").update({"consumed_by": user_id}).eq("code", code))
     return True
 
 # Validate WebApp initData (per Telegram docs)
@@ -0,0 +1,121 @@
+import os, time, logging
+from itertools import islice
+from aiogram import Dispatcher
+from aiogram.types import Update
+from . import metrics
+
+# Per-user limits on incoming updates, checked before any handler runs. Every
+# user has a token bucket per cost class: text, commands and button presses
+# are cheap; voice notes, photos and other media (a download, a transcription
+# and a vision call each) are expensive. Over the limit, the update is dropped
+# and the user is told once how long to wait. Set THROTTLE=off to disable.
+THROTTLE = os.getenv("THROTTLE", "on").strip().lower() not in ("0", "off", "false", "no")
+THROTTLE_TEXT_PER_MIN = float(os.getenv("THROTTLE_TEXT_PER_MIN", "30"))
+THROTTLE_TEXT_BURST = float(os.getenv("THROTTLE_TEXT_BURST", "10"))
+THROTTLE_MEDIA_PER_MIN = float(os.getenv("THROTTLE_MEDIA_PER_MIN", "4"))
+THROTTLE_MEDIA_BURST = float(os.getenv("THROTTLE_MEDIA_BURST", "3"))
+# Users tracked at once; idle (full) entries are evicted first
+THROTTLE_MAX_USERS = int(os.getenv("THROTTLE_MAX_USERS", "50000"))
+# At most one "slow down" reply per user per this many seconds
+THROTTLE_NOTICE_INTERVAL = float(os.getenv("THROTTLE_NOTICE_INTERVAL", "30"))
+
+TEXT, MEDIA = "text", "media"
+# Row layout: [refill stamp, text tokens, media tokens, no notice before]
+_STAMP, _NOTICE = 0, 3
+_COL = {TEXT: 1, MEDIA: 2}
+_RATE = {TEXT: THROTTLE_TEXT_PER_MIN / 60, MEDIA: THROTTLE_MEDIA_PER_MIN / 60}
+_BURST = {TEXT: THROTTLE_TEXT_BURST, MEDIA: THROTTLE_MEDIA_BURST}
+_MEDIA_FIELDS = ("voice", "audio", "video", "video_note", "photo", "document", "animation")
+_NOTICES = {
+    TEXT: "You're sending messages faster than I can keep up. Please wait {s}s and try again.",
+    MEDIA: "That's a lot of voice notes and photos in a row. Please wait about {s}s before sending the next one.",
+}
+
+_table: dict[int, list[float]] = {}
+_stats = {"allowed": 0, "throttled": {TEXT: 0, MEDIA: 0}, "notices": 0, "evicted": 0}
+
+def throttle_stats() -> dict:
+    return {**_stats, "throttled": dict(_stats["throttled"]), "users": len(_table)}
+
+def cost_class(update: Update) -> str:
+    message = update.message or update.edited_message
+    if message is not None and any(getattr(message, f) for f in _MEDIA_FIELDS):
+        return MEDIA
+    return TEXT
+
+def _refill(row: list[float], now: float) -> None:
+    elapsed = now - row[_STAMP]
+    if elapsed > 0:
+        row[_STAMP] = now
+        for cls, col in _COL.items():
+            row[col] = min(_BURST[cls], row[col] + elapsed * _RATE[cls])
+
+def _evict(now: float) -> None:
+    """Drop users whose buckets are full again; if that is not enough, the oldest entries."""
+    idle = []
+    for user_id, row in _table.items():
+        _refill(row, now)
+        if all(row[col] >= _BURST[cls] for cls, col in _COL.items()) and row[_NOTICE] <= now:
+            idle.append(user_id)
+    for user_id in idle:
+        del _table[user_id]
+    evicted = len(idle)
+    excess = len(_table) - int(THROTTLE_MAX_USERS * 0.9)
+    if excess > 0:
+        # Everyone is active: forgetting the oldest entries only resets their buckets
+        for user_id in list(islice(_table, excess)):
+            del _table[user_id]
+        evicted += excess
+    _stats["evicted"] += evicted
+
+def take(user_id: int, cls: str) -> float:
+    """Spend a token of ``cls`` for the user; returns 0, or the seconds until one is available."""
+    now = time.monotonic()
+    row = _table.get(user_id)
+    if row is None:
+        if len(_table) >= THROTTLE_MAX_USERS:
+            _evict(now)
+        row = _table[user_id] = [now, THROTTLE_TEXT_BURST, THROTTLE_MEDIA_BURST, 0.0]
+    else:
+        _refill(row, now)
+    col = _COL[cls]
+    if row[col] >= 1:
+        row[col] -= 1
+        return 0.0
+    return (1 - row[col]) / _RATE[cls]
+
+async def _notify(update: Update, user_id: int, cls: str, wait: float) -> None:
+    row = _table[user_id]
+    now = time.monotonic()
+    if now < row[_NOTICE]:
+        return
+    row[_NOTICE] = now + max(wait, THROTTLE_NOTICE_INTERVAL)
+    text = _NOTICES[cls].format(s=max(1, round(wait)))
+    _stats["notices"] += 1
+    try:
+        if update.callback_query is not None:
+            await update.callback_query.answer(text)
+        elif (message := update.message or update.edited_message) is not None:
+            await message.answer(text)
+    except Exception as e:
+        logging.warning("Throttle notice to %s failed: %s", user_id, e)
+
+async def _throttle_middleware(handler, event: Update, data):
+    user = data.get("event_from_user")
+    if user is None:
+        return await handler(event, data)
+    cls = cost_class(event)
+    wait = take(user.id, cls)
+    if wait <= 0:
+        _stats["allowed"] += 1
+        return await handler(event, data)
+    _stats["throttled"][cls] += 1
+    metrics.THROTTLED.labels(cls).inc()
+    await _notify(event, user.id, cls, wait)
+    return None
+
+def install(dp: Dispatcher) -> Dispatcher:
+    """Throttle every update of ``dp`` per user (outer middleware, before any handler or filter)."""
+    if THROTTLE:
+        dp.update.outer_middleware(_throttle_middleware)
+    return dp
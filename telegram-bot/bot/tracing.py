@@ -0,0 +1,119 @@
+import os, time, logging, contextvars, functools
+from collections import deque
+from contextlib import contextmanager
+from aiogram import Dispatcher
+
+# Per-update phase timing. A trace is started for every update; span() and
+# @traced record named phases (lookups, OpenAI calls, database calls, sends)
+# into the trace of the update that is being handled, through contextvars,
+# so nothing has to be passed around. Updates slower than SLOW_UPDATE_SECONDS
+# are logged with their full breakdown.
+SLOW_UPDATE_SECONDS = float(os.getenv("SLOW_UPDATE_SECONDS", "2"))
+# Slow traces kept for /debug/traces
+TRACE_RECENT = int(os.getenv("TRACE_RECENT", "50"))
+_MAX_SPANS = 200
+
+class Trace:
+    __slots__ = ("update_id", "update_type", "handler", "started", "spans", "dropped")
+
+    def __init__(self, update_id: int, update_type: str):
+        self.update_id = update_id
+        self.update_type = update_type
+        self.handler = None
+        self.started = time.perf_counter()
+        # (name, depth, start offset, duration) in seconds
+        self.spans: list[tuple[str, int, float, float]] = []
+        self.dropped = 0
+
+    def as_dict(self, total: float) -> dict:
+        return {
+            "update_id": self.update_id,
+            "update_type": self.update_type,
+            "handler": self.handler,
+            "seconds": round(total, 4),
+            "spans": [
+                {"name": n, "depth": d, "start_ms": round(s * 1000, 1), "ms": round(t * 1000, 1)}
+                for n, d, s, t in sorted(self.spans, key=lambda x: x[2])
+            ],
+            "dropped_spans": self.dropped,
+        }
+
+_trace: contextvars.ContextVar[Trace | None] = contextvars.ContextVar("update_trace", default=None)
+_depth: contextvars.ContextVar[int] = contextvars.ContextVar("span_depth", default=0)
+_slow: deque = deque(maxlen=TRACE_RECENT)
+_stats = {"traced": 0, "slow": 0}
+
+def tracing_stats() -> dict:
+    return dict(_stats)
+
+def slow_traces() -> list[dict]:
+    return list(_slow)
+
+@contextmanager
+def span(name: str):
+    """Time the block as a phase of the current update (no-op outside one)."""
+    trace = _trace.get()
+    if trace is None:
+        yield
+        return
+    depth = _depth.get()
+    token = _depth.set(depth + 1)
+    t0 = time.perf_counter()
+    try:
+        yield
+    finally:
+        _depth.reset(token)
+        if len(trace.spans) < _MAX_SPANS:
+            trace.spans.append((name, depth, t0 - trace.started, time.perf_counter() - t0))
+        else:
+            trace.dropped += 1
+
+def traced(fn):
+    """Record each call of an async function as a span named after it."""
+    name = fn.__name__
+
+    @functools.wraps(fn)
+    async def wrapper(*args, **kwargs):
+        if _trace.get() is None:
+            return await fn(*args, **kwargs)
+        with span(name):
+            return await fn(*args, **kwargs)
+    return wrapper
+
+def _format(trace: Trace) -> str:
+    parts = []
+    for name, depth, start, dur in sorted(trace.spans, key=lambda x: x[2]):
+        parts.append(f"{'  ' * depth}{name} +{start * 1000:.0f}ms {dur * 1000:.0f}ms")
+    if trace.dropped:
+        parts.append(f"... {trace.dropped} more span(s)")
+    return "\n  ".join(parts)
+
+async def _trace_middleware(handler, event, data):
+    trace = Trace(event.update_id, event.event_type)
+    token = _trace.set(trace)
+    try:
+        return await handler(event, data)
+    finally:
+        _trace.reset(token)
+        total = time.perf_counter() - trace.started
+        _stats["traced"] += 1
+        if total >= SLOW_UPDATE_SECONDS:
+            _stats["slow"] += 1
+            _slow.append(trace.as_dict(total))
+            logging.warning(
+                "Slow update %s (%s/%s) took %.2fs:\n  %s",
+                trace.update_id, trace.update_type, trace.handler or "-", total, _format(trace),
+            )
+
+async def _handler_name_middleware(handler, event, data):
+    trace = _trace.get()
+    if trace is not None:
+        trace.handler = getattr(getattr(data.get("handler"), "callback", None), "__name__", None)
+    return await handler(event, data)
+
+def install(dp: Dispatcher) -> Dispatcher:
+    """Trace every update handled by ``dp``."""
+    dp.update.outer_middleware(_trace_middleware)
+    for observer in (dp.message, dp.edited_message, dp.callback_query):
+        observer.middleware(_handler_name_middleware)
+    return dp
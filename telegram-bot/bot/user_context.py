@@ -0,0 +1,236 @@
+import os, asyncio, json, logging, random, time
+from .db import sb, execute
+from .cache import TTLCache, SingleFlight, MISSING
+from .tracing import traced
+
+# Per-user UserContext for plan_actions (profile, categories, recent
+# transactions, open tasks). Snapshots are loaded once, then patched from
+# Supabase Realtime postgres_changes; they are reloaded after CONTEXT_RESYNC
+# seconds anyway, or after CONTEXT_OFFLINE_TTL while Realtime is down.
+CONTEXT_CACHE_SIZE = int(os.getenv("CONTEXT_CACHE_SIZE", "5000"))
+CONTEXT_RESYNC = float(os.getenv("CONTEXT_RESYNC", "900"))
+CONTEXT_OFFLINE_TTL = float(os.getenv("CONTEXT_OFFLINE_TTL", "60"))
+CONTEXT_RECENT_TX = int(os.getenv("CONTEXT_RECENT_TX", "15"))
+CONTEXT_OPEN_TASKS = int(os.getenv("CONTEXT_OPEN_TASKS", "15"))
+# Rough token budget for the serialized context (4 characters per token)
+CONTEXT_TOKEN_BUDGET = int(os.getenv("CONTEXT_TOKEN_BUDGET", "600"))
+CONTEXT_REALTIME = os.getenv("CONTEXT_REALTIME", "1") not in ("0", "false", "no", "")
+
+_TABLES = ("user_profiles", "finance_categories", "finance_transactions", "planner_items")
+_ROW_ATTR = {"finance_categories": "categories", "finance_transactions": "transactions", "planner_items": "tasks"}
+_CLOSED_STATUSES = {"done", "skipped", "completed"}
+_TEXT_MAX = 60
+
+class Snapshot:
+    """Raw rows for one user; ``render()`` builds the trimmed UserContext."""
+
+    __slots__ = ("user_id", "profile", "categories", "transactions", "tasks", "loaded_at", "_rendered")
+
+    def __init__(self, user_id: str, profile: dict, categories: list, transactions: list, tasks: list):
+        self.user_id = user_id
+        self.profile = profile
+        self.categories = {r["id"]: r for r in categories}
+        self.transactions = {r["id"]: r for r in transactions}
+        self.tasks = {r["id"]: r for r in tasks}
+        self.loaded_at = time.monotonic()
+        self._rendered = None
+
+    def apply(self, table: str, kind: str, row: dict) -> None:
+        self._rendered = None
+        if table == "user_profiles":
+            if kind != "DELETE":
+                self.profile.update(row)
+        elif table == "finance_categories":
+            if kind == "DELETE":
+                self.categories.pop(row["id"], None)
+            else:
+                self.categories[row["id"]] = row
+        elif table == "finance_transactions":
+            if kind == "DELETE":
+                self.transactions.pop(row["id"], None)
+                return
+            self.transactions[row["id"]] = row
+            if len(self.transactions) > CONTEXT_RECENT_TX:
+                oldest = min(self.transactions.values(), key=lambda r: r.get("occurred_at") or "")
+                del self.transactions[oldest["id"]]
+        elif table == "planner_items":
+            if kind == "DELETE" or row.get("status") in _CLOSED_STATUSES:
+                self.tasks.pop(row["id"], None)
+                return
+            self.tasks[row["id"]] = row
+            if len(self.tasks) > CONTEXT_OPEN_TASKS:
+                last = max(self.tasks.values(), key=_task_order)
+                del self.tasks[last["id"]]
+
+    def render(self) -> dict:
+        if self._rendered is None:
+            self._rendered = _trim(self._build(), CONTEXT_TOKEN_BUDGET)
+        return self._rendered
+
+    def _build(self) -> dict:
+        names = {c["id"]: c.get("name") for c in self.categories.values()}
+        categories: dict[str, list[str]] = {}
+        for c in sorted(self.categories.values(), key=lambda c: c.get("name") or ""):
+            categories.setdefault(c.get("type") or "expense", []).append(c.get("name"))
+        txs = sorted(self.transactions.values(), key=lambda r: r.get("occurred_at") or "", reverse=True)
+        tasks = sorted(self.tasks.values(), key=_task_order)
+        return {
+            "userId": self.user_id,
+            "timezone": self.profile.get("app_timezone") or "UTC",
+            "currency": self.profile.get("currency"),
+            "name": self.profile.get("name"),
+            "categories": categories,
+            "recentTransactions": [_compact({
+                "type": r.get("type"),
+                "amount": r.get("amount"),
+                "currency": r.get("currency"),
+                "category": names.get(r.get("category_id")),
+                "description": _clip(r.get("description")),
+                "date": (r.get("occurred_at") or "")[:10] or None,
+            }) for r in txs],
+            "openTasks": [_compact({
+                "title": _clip(r.get("title")),
+                "status": r.get("status"),
+                "priority": r.get("priority"),
+                "dueAt": r.get("due_date") or r.get("target_date"),
+            }) for r in tasks],
+        }
+
+def _task_order(r: dict) -> str:
+    # Soonest due first; undated tasks last
+    return r.get("due_date") or r.get("target_date") or "9999"
+
+def _clip(s: str | None) -> str | None:
+    return s if not s or len(s) <= _TEXT_MAX else s[:_TEXT_MAX - 1] + "…"
+
+def _compact(d: dict) -> dict:
+    return {k: v for k, v in d.items() if v is not None}
+
+def _tokens(obj) -> int:
+    return len(json.dumps(obj, ensure_ascii=False, default=str)) // 4 + 1
+
+def _trim(ctx: dict, budget: int) -> dict:
+    """Drop the oldest transactions, then the latest-due tasks, then categories until ``ctx`` fits ``budget``."""
+    over = _tokens(ctx) - budget
+    if over <= 0:
+        return ctx
+    for key in ("recentTransactions", "openTasks"):
+        items = ctx[key]
+        while items and over > 0:
+            over -= _tokens(items.pop())
+    for names in ctx["categories"].values():
+        while names and over > 0:
+            over -= _tokens(names.pop())
+    return ctx
+
+_snapshots = TTLCache(CONTEXT_CACHE_SIZE, CONTEXT_RESYNC, name="user_context")
+_flight = SingleFlight()
+_live = False
+_channel = None
+_task: asyncio.Task | None = None
+_stats = {"loads": 0, "events": 0, "applied": 0, "resubscribed": 0}
+
+def context_stats() -> dict:
+    return {**_stats, "realtime": _live, "cache": _snapshots.stats()}
+
+async def _load(user_id: str) -> Snapshot:
+    s = await sb()
+    profile, cats, txs, tasks = await asyncio.gather(
+        execute(s.table("user_profiles").select("name,app_timezone,currency").eq("user_id", user_id).limit(1)),
+        execute(s.table("finance_categories").select("id,name,type").eq("user_id", user_id)),
+        execute(s.table("finance_transactions").select("id,type,amount,currency,category_id,description,occurred_at")
+                .eq("user_id", user_id).order("occurred_at", desc=True).limit(CONTEXT_RECENT_TX)),
+        execute(s.table("planner_items").select("id,title,status,priority,due_date,target_date")
+                .eq("user_id", user_id).not_.in_("status", sorted(_CLOSED_STATUSES))
+                .order("due_date", nullsfirst=False).limit(CONTEXT_OPEN_TASKS)),
+    )
+    _stats["loads"] += 1
+    snap = Snapshot(user_id, (profile.data or [{}])[0], cats.data or [], txs.data or [], tasks.data or [])
+    _snapshots.set(user_id, snap)
+    return snap
+
+@traced
+async def user_context(user_id: str) -> dict:
+    """UserContext for plan_actions; falls back to just the user id if it cannot be loaded."""
+    snap = _snapshots.get(user_id)
+    if snap is not MISSING and (_live or time.monotonic() - snap.loaded_at < CONTEXT_OFFLINE_TTL):
+        return snap.render()
+    try:
+        snap = await _flight.do(user_id, lambda: _load(user_id))
+    except Exception:
+        logging.exception("Loading context for %s failed", user_id)
+        return {"userId": user_id}
+    return snap.render()
+
+def _on_change(payload: dict) -> None:
+    _stats["events"] += 1
+    data = payload.get("data") or {}
+    kind = data.get("type")
+    row = data.get("record") if kind != "DELETE" else data.get("old_record")
+    if not row:
+        return
+    table = data.get("table")
+    user_id = row.get("user_id")
+    if user_id is not None:
+        snaps = [_snapshots.peek(str(user_id), None)]
+    else:
+        # DELETE only carries the primary key unless the table has REPLICA IDENTITY FULL
+        attr = _ROW_ATTR.get(table)
+        snaps = [s for s in _snapshots.values() if attr and row.get("id") in getattr(s, attr)]
+    for snap in snaps:
+        if snap is not None:
+            snap.apply(table, kind, row)
+            _stats["applied"] += 1
+
+def _on_status(status, err) -> None:
+    global _live
+    name = getattr(status, "value", status)
+    if name == "SUBSCRIBED":
+        if _stats["resubscribed"] or _live:
+            # Events may have been missed while disconnected
+            _snapshots.clear()
+        _stats["resubscribed"] += 1
+        _live = True
+    else:
+        if _live:
+            logging.warning("Context realtime channel %s: %s", name, err)
+        _live = False
+
+async def _subscribe() -> None:
+    global _channel
+    delay = 1.0
+    while True:
+        try:
+            s = await sb()
+            channel = s.channel("bot-user-context")
+            for table in _TABLES:
+                channel.on_postgres_changes("*", schema="public", table=table, callback=_on_change)
+            await channel.subscribe(_on_status)
+            _channel = channel
+            return
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logging.warning("Context realtime subscribe failed (retrying in %.0fs): %s", delay, e)
+            await asyncio.sleep(delay * random.uniform(0.8, 1.2))
+            delay = min(delay * 2, 60)
+
+def start() -> None:
+    global _task
+    if CONTEXT_REALTIME and _task is None:
+        _task = asyncio.create_task(_subscribe())
+
+async def stop() -> None:
+    global _task, _channel, _live
+    task, _task = _task, None
+    if task is not None:
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+    channel, _channel = _channel, None
+    _live = False
+    if channel is not None:
+        try:
+            s = await sb()
+            await s.remove_channel(channel)
+        except Exception:
+            pass
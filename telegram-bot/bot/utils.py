@@ -1,6 +1,6 @@
 import os
+from dataclasses import dataclass
 from datetime import datetime, timedelta
-from dateutil import parser as dateparser
 import pytz
 import re
 
@@ -10,17 +10,142 @@ tz = pytz.timezone(TZ)
 def now_tz():
     return datetime.now(tz)
 
-def parse_money(text: str):
-    # returns amount as float or None
-    m = re.search(r'(?<!\d)(\d{1,3}(?:[\s,._]\d{3})+|\d+)(?:\s?([kк]))?', text, re.IGNORECASE)
-    if not m:
-        return None
-    raw = m.group(1)
-    raw = raw.replace(" ", "").replace(",", "").replace(".", "").replace("_","")
-    amount = float(raw)
-    if m.group(2):
-        amount *= 1000.0
-    return amount
+# --- Single-pass message lexer ---
+# Every extractor below (money, time, category hint, intent, task title) reads
+# the tokens of one scan over the text. Keyword lists for EN/RU/UZ live here
+# only; nlu.classify_intent and logic_finance reuse them through parse().
+
+# Hour used when only a day is given ("tomorrow buy milk")
+DEFAULT_TASK_HOUR = int(os.getenv("DEFAULT_TASK_HOUR", "9"))
+
+_EXPENSE_WORDS = (
+    "spent", "paid", "bought",
+    "потратил", "потратила", "расход", "оплатил", "оплатила", "купил", "купила", "заплатил", "заплатила",
+    "sarfladim", "to'ladim", "xarajat",
+)
+_INCOME_WORDS = (
+    "add income", "income", "salary", "bonus", "earned",
+    "заработал", "заработала", "доход", "получил", "получила", "зарплата",
+    "daromad", "oylik", "maosh",
+)
+_TASK_WORDS = (
+    "meeting", "task", "todo", "remind",
+    "встреча", "встречу", "задача", "напомни",
+    "uchrashuv", "vazifa", "eslat",
+)
+_KEYWORDS = {w: "expense" for w in _EXPENSE_WORDS}
+_KEYWORDS.update({w: "income" for w in _INCOME_WORDS})
+_KEYWORDS.update({w: "task" for w in _TASK_WORDS})
+
+_DAY_OFFSETS = {
+    "day before yesterday": -2, "позавчера": -2, "o'tgan kuni": -2,
+    "yesterday": -1, "вчера": -1, "kecha": -1,
+    "today": 0, "сегодня": 0, "bugun": 0,
+    "tomorrow": 1, "завтра": 1, "эртага": 1, "ertaga": 1,
+    "day after tomorrow": 2, "послезавтра": 2, "indinga": 2,
+}
+_WEEKDAYS = {
+    "monday": 0, "tuesday": 1, "wednesday": 2, "thursday": 3, "friday": 4, "saturday": 5, "sunday": 6,
+    "понедельник": 0, "вторник": 1, "среда": 2, "среду": 2, "четверг": 3,
+    "пятница": 4, "пятницу": 4, "суббота": 5, "субботу": 5, "воскресенье": 6,
+    "dushanba": 0, "seshanba": 1, "chorshanba": 2, "payshanba": 3, "juma": 4, "shanba": 5, "yakshanba": 6,
+}
+_CURRENCIES = {
+    "$": "USD", "usd": "USD", "dollar": "USD", "dollars": "USD", "доллар": "USD", "доллара": "USD", "долларов": "USD",
+    "€": "EUR", "eur": "EUR", "euro": "EUR", "евро": "EUR",
+    "₽": "RUB", "rub": "RUB", "руб": "RUB", "рубль": "RUB", "рубля": "RUB", "рублей": "RUB",
+    "uzs": "UZS", "сум": "UZS", "сума": "UZS", "сумов": "UZS", "so'm": "UZS", "soʻm": "UZS", "som": "UZS", "sum": "UZS",
+}
+_MULTIPLIERS = {
+    "k": 1e3, "к": 1e3, "тыс": 1e3, "thousand": 1e3, "ming": 1e3,
+    "m": 1e6, "м": 1e6, "mln": 1e6, "млн": 1e6, "million": 1e6,
+}
+_KNOWN_CATEGORIES = ("food", "groceries", "grocery", "transport", "bus", "taxi", "dining", "meal", "salary", "bonus")
+# Words that end a trailing category ('on food yesterday', 'for the bus at 9am')
+_CATEGORY_STOPS = (
+    *_DAY_OFFSETS, *_WEEKDAYS, "at", "in", "on", "by", "ago", "last", "next", "this", "tonight", "morning", "evening",
+    "в", "во", "через", "утром", "вечером", "днём", "днем", "назад", "soat",
+)
+
+def _alt(words) -> str:
+    # Longest first so that e.g. 'add income' wins over 'income'
+    return "|".join(re.escape(w) for w in sorted(words, key=len, reverse=True))
+
+_LEXER = re.compile(
+    # Tokens only start at a word start (or on a currency symbol); checking that
+    # first lets the scanner skip mid-word positions without trying every branch.
+    r"(?:(?<!\w)|(?=[$€₽]))(?:" + "|".join([
+        # in 2 hours / через 30 минут / in an hour
+        r"(?P<rel>\b(?:in|через)\s+(?:(?P<rel_n>\d+(?:[.,]\d+)?|an?|one|half\s+an?)\s*)?"
+        r"(?P<rel_u>hours?|hrs?|h|minutes?|mins?|min|days?|weeks?|час(?:а|ов)?|минут[уы]?|мин|дн(?:я|ей)|день|недел[юиья])\b)",
+        # 2 soatdan keyin
+        r"(?P<relz>\b(?P<relz_n>\d+)\s*(?P<relz_u>soat|daqiqa|kun)dan\s+keyin\b)",
+        rf"(?P<day>\b(?:{_alt(_DAY_OFFSETS)})\b)",
+        rf"(?P<wd>\b(?:{_alt(_WEEKDAYS)})\b)",
+        # 21:00 / at 9:30pm / в 10:15
+        r"(?P<clock>(?:\b(?:at|в|soat)\s+)?(?<!\d)(?P<clock_h>\d{1,2}):(?P<clock_m>\d{2})(?!\d)\s*(?P<clock_ap>am|pm)?\b)",
+        # at 9 / в 9 / soat 9 (but not 'at 5k')
+        r"(?P<at>\b(?:at|в|soat)\s+(?P<at_h>\d{1,2})(?!\d|[.,]\d|\s?[kкmм]\b)\s*(?P<at_ap>am|pm)?\b)",
+        # 9pm
+        r"(?P<ampm>(?<!\d)(?P<ampm_h>\d{1,2})\s*(?P<ampm_ap>am|pm)\b)",
+        # Trailing category after a preposition, up to a time/date word, a number or the end;
+        # only the preposition is consumed
+        r"(?P<cat>\b(?:on|for|на|для)\s+(?=(?P<cat_v>(?!(?:" + _alt(_CATEGORY_STOPS) + r")\b)[^\W\d][^\W\d]*"
+        r"(?:[\- ]+(?!(?:" + _alt(_CATEGORY_STOPS) + r")\b)[^\W\d][^\W\d]*)*)\s*(?:$|\d|[.,;!]|(?:"
+        + _alt(_CATEGORY_STOPS) + r")\b)))",
+        r"(?P<meet>\bmeeting\s+with\s+(?=(?P<meet_v>[\w\- ]{2,40})))",
+        r"(?P<call>\bcall\s+(?=(?P<call_v>[\w\- ]{2,40})))",
+        r"(?P<verb>\b(?P<verb_w>email|pay|send)\s+(?=(?P<verb_v>[\w\- ]{2,40})))",
+        rf"(?P<kw>\b(?:{_alt(_KEYWORDS)})\b)",
+        rf"(?P<known>\b(?:{_alt(_KNOWN_CATEGORIES)})\w*)",
+        rf"(?P<cur>[$€₽]|\b(?:{_alt(w for w in _CURRENCIES if w[0].isalpha())})\b)",
+        # 25k / 12 000 / 1,200.50 / 1.5m / 20 тыс
+        r"(?P<num>(?<!\d)(?P<num_v>\d{1,3}(?:[ \u00a0,._']\d{3})+(?:[.,]\d{1,2})?|\d+(?:[.,]\d{1,2})?)(?!\d)"
+        rf"(?:\s?(?P<mult>{_alt(_MULTIPLIERS)})(?!\w))?)",
+    ]) + ")",
+    re.IGNORECASE,
+)
+# Questions are not entries ('how much did I spend?', 'сколько я потратил?', 'when is my meeting?').
+# A trailing '?' alone may still be a request ('can you remind me at 7?').
+_QUESTION_WORD = re.compile(
+    r"^\s*(?:how\s+much|how\s+many|what|when|where|why|did|сколько|что|когда|где|почему|"
+    r"qancha|nima|qachon|qayerda|nega)\b",
+    re.IGNORECASE,
+)
+_AT_TAIL = re.compile(r"\s+at\b.*$", re.IGNORECASE)
+_DECIMAL_TAIL = re.compile(r"^(.*?)[.,](\d{1,2})$")
+_GROUP_SEPARATORS = re.compile(r"[ \u00a0,._']")
+_REL_UNITS = (
+    ("h", "hours"), ("час", "hours"), ("soat", "hours"),
+    ("m", "minutes"), ("мин", "minutes"), ("daqiqa", "minutes"),
+    ("d", "days"), ("дн", "days"), ("день", "days"), ("kun", "days"),
+    ("w", "weeks"), ("недел", "weeks"),
+)
+
+@dataclass(slots=True)
+class ParseResult:
+    """Everything the regex fallbacks need from one message."""
+    intent: str = "unknown"           # add_expense | add_income | add_task | unknown
+    amount: float | None = None
+    currency: str | None = None       # ISO code when a currency word/symbol is present
+    when: datetime | None = None      # tz-aware, resolved against "now"
+    time_explicit: bool = False       # True when a clock time or relative offset was given
+    category_hint: str | None = None
+    category_known: bool = False      # hint is one of the built-in category nouns
+    title: str = ""
+    title_matched: bool = False       # title came from a pattern, not the fallback
+    numbers: int = 0                  # amounts seen (times excluded)
+    question: bool = False            # ends with '?' or starts with a question word
+
+def _to_amount(raw: str, mult: str | None) -> float:
+    # A final separator followed by 1-2 digits is a decimal point
+    m = _DECIMAL_TAIL.match(raw)
+    whole, frac = (m.group(1), m.group(2)) if m else (raw, "")
+    whole = _GROUP_SEPARATORS.sub("", whole)
+    value = float(f"{whole}.{frac}" if frac else whole)
+    if mult:
+        value *= _MULTIPLIERS[mult.lower().rstrip(".")]
+    return value
 
 def _apply_ampm(hh: int, ampm: str) -> int:
     ampm = (ampm or '').lower()
@@ -30,56 +155,160 @@ def _apply_ampm(hh: int, ampm: str) -> int:
         return 0
     return hh
 
+def _rel_delta(n: str | None, unit: str) -> timedelta:
+    n = (n or "1").lower().replace(",", ".")
+    qty = 0.5 if n.startswith("half") else 1.0 if n in ("a", "an", "one") else float(n)
+    unit = unit.lower()
+    for prefix, name in _REL_UNITS:
+        if unit.startswith(prefix):
+            return timedelta(**{name: qty})
+    return timedelta(hours=qty)
+
+def _localize(day, hh: int, mm: int) -> datetime:
+    return tz.localize(datetime(day.year, day.month, day.day, hh % 24, mm % 60))
+
+def parse(text: str, now: datetime | None = None) -> ParseResult:
+    """Scan ``text`` once and extract amount, currency, time, category, intent and title.
+
+    ``now`` defaults to the current time in TZ and is only looked up when the
+    message actually contains a time expression.
+    """
+    s = (text or "").strip()
+    res = ParseResult()
+    kinds = set()
+    day_offset = weekday = None
+    day_end = -1
+    clock = None
+    rel = None
+    title = None
+    title_rank = 9
+    amounts = []   # (start, value, mult)
+    for m in _LEXER.finditer(s):
+        g = m.lastgroup
+        if g == "num":
+            amounts.append((m.start(), m.group("num_v"), m.group("mult")))
+        elif g == "kw":
+            word = m.group("kw").lower()
+            kinds.add(_KEYWORDS[word])
+            if res.category_hint is None and word in _KNOWN_CATEGORIES:
+                res.category_hint = word.title()
+        elif g == "cur":
+            res.currency = res.currency or _CURRENCIES.get(m.group("cur").lower().replace("’", "'"))
+        elif g == "cat":
+            if 3 <= len(m.group("cat_v")) <= 30:
+                res.category_hint = m.group("cat_v").title()
+        elif g == "known":
+            if res.category_hint is None:
+                res.category_hint = m.group("known").title()
+        elif g == "day":
+            day_offset = _DAY_OFFSETS[m.group("day").lower()]
+            day_end = m.end()
+        elif g == "wd":
+            weekday = _WEEKDAYS[m.group("wd").lower()]
+            day_end = m.end()
+        elif g == "clock":
+            clock = (_apply_ampm(int(m.group("clock_h")), m.group("clock_ap")), int(m.group("clock_m")))
+        elif g == "at":
+            clock = clock or (_apply_ampm(int(m.group("at_h")), m.group("at_ap")), 0)
+        elif g == "ampm":
+            clock = clock or (_apply_ampm(int(m.group("ampm_h")), m.group("ampm_ap")), 0)
+        elif g == "rel":
+            rel = _rel_delta(m.group("rel_n"), m.group("rel_u"))
+        elif g == "relz":
+            rel = _rel_delta(m.group("relz_n"), m.group("relz_u"))
+        elif g == "meet":
+            kinds.add("task")
+            who = _AT_TAIL.sub("", m.group("meet_v").strip())
+            title, title_rank = f"Meeting with {who.title()}".strip(), 0
+        elif g == "call" and title_rank > 1:
+            who = _AT_TAIL.sub("", m.group("call_v").strip())
+            title, title_rank = f"Call {who.title()}", 1
+        elif g == "verb" and title_rank > 2:
+            title, title_rank = f"{m.group('verb_w').title()} {m.group('verb_v').title()}", 2
+
+    # 'tomorrow ... 10': a bare small number shortly after a day word is the hour
+    if clock is None and day_end >= 0 and (day_offset or 0) >= 0:
+        for i, (start, raw, mult) in enumerate(amounts):
+            if start >= day_end and start - day_end <= 20 and not mult and raw.isdigit() and int(raw) <= 23 \
+                    and not any(c.isdigit() for c in s[day_end:start]):
+                clock = (_apply_ampm(int(raw), ""), 0)
+                del amounts[i]
+                break
+
+    res.numbers = len(amounts)
+    if amounts:
+        _, raw, mult = amounts[0]
+        res.amount = _to_amount(raw, mult)
+
+    if rel is not None or day_offset is not None or weekday is not None or clock is not None:
+        now = now or now_tz()
+        if rel is not None:
+            res.when = (now + rel).replace(second=0, microsecond=0)
+            res.time_explicit = True
+        else:
+            day = now.date()
+            if day_offset is not None:
+                day += timedelta(days=day_offset)
+            elif weekday is not None:
+                ahead = (weekday - day.weekday()) % 7
+                if ahead == 0 and clock is not None and clock <= (now.hour, now.minute):
+                    ahead = 7
+                day += timedelta(days=ahead)
+            hh, mm = clock if clock is not None else (DEFAULT_TASK_HOUR, 0)
+            res.when = _localize(day, hh, mm)
+            res.time_explicit = clock is not None
+
+    if "expense" in kinds:
+        res.intent = "add_expense"
+    elif "income" in kinds:
+        res.intent = "add_income"
+    elif "task" in kinds:
+        res.intent = "add_task"
+    elif res.when is not None and title is not None:
+        # 'call mom at 7', 'pay rent tomorrow'
+        res.intent = "add_task"
+    elif res.amount is None and ((day_offset or 0) >= 1 or weekday is not None or rel is not None):
+        # 'tomorrow buy milk', 'friday gym', 'in 2 hours stretch'
+        res.intent = "add_task"
+
+    asks = bool(_QUESTION_WORD.search(s))
+    res.question = asks or s.endswith("?")
+    if asks or (res.question and res.intent in ("add_expense", "add_income")):
+        # Asks about spending, income or plans rather than recording them
+        res.intent = "unknown"
+
+    if res.category_hint:
+        res.category_known = res.category_hint.lower() in _KNOWN_CATEGORIES
+    if title is None:
+        title = s[0:60]
+        title = title[:1].upper() + title[1:]
+    else:
+        res.title_matched = True
+    res.title = title
+    return res
+
+# --- Compatibility helpers (thin wrappers over parse) ---
+def parse_money(text: str):
+    # returns amount as float or None
+    return parse(text).amount
+
 def parse_time_tomorrow(text: str):
-    """Legacy helper kept for compatibility: only matches explicit 'tomorrow ... at HH[:MM] am/pm?'."""
-    t = None
-    m = re.search(r'(?:tomorrow|завтра|эртага)[^\d]{0,20}(\d{1,2})(?::(\d{2}))?\s*(am|pm)?', text, re.IGNORECASE)
-    if m:
-        hh = _apply_ampm(int(m.group(1)), m.group(3) or '')
-        mm = int(m.group(2) or 0)
-        tomorrow = now_tz().date() + timedelta(days=1)
-        t = tz.localize(datetime(tomorrow.year, tomorrow.month, tomorrow.day, hh, mm))
-    return t
+    """Legacy helper kept for compatibility: same as parse_time_today_or_tomorrow."""
+    return parse_time_today_or_tomorrow(text)
 
 def parse_time_today_or_tomorrow(text: str):
     """Parse phrases like:
     - 'today at 9pm', 'today 21:00', 'сегодня в 9'
     - 'tomorrow at 9', 'завтра 21:00', 'эртага 9'
     - bare 'at 9pm' → today at 9pm
+    - 'in 2 hours', 'через 30 минут', 'friday at 10', 'next monday'
     Returns timezone-aware datetime or None.
     """
-    # 1) today/tomorrow explicit
-    m = re.search(r'\b(today|сегодня)\b[^\d]{0,20}(\d{1,2})(?::(\d{2}))?\s*(am|pm)?', text, re.IGNORECASE)
-    if m:
-        day = now_tz().date()
-        hh = _apply_ampm(int(m.group(2)), m.group(4) or '')
-        mm = int(m.group(3) or 0)
-        return tz.localize(datetime(day.year, day.month, day.day, hh, mm))
-    m = re.search(r'\b(tomorrow|завтра|эртага)\b[^\d]{0,20}(\d{1,2})(?::(\d{2}))?\s*(am|pm)?', text, re.IGNORECASE)
-    if m:
-        day = now_tz().date() + timedelta(days=1)
-        hh = _apply_ampm(int(m.group(2)), m.group(4) or '')
-        mm = int(m.group(3) or 0)
-        return tz.localize(datetime(day.year, day.month, day.day, hh, mm))
-
-    # 2) bare 'at 9pm/21:00' → default to today
-    m = re.search(r'\bat\s+(\d{1,2})(?::(\d{2}))?\s*(am|pm)?', text, re.IGNORECASE)
-    if m:
-        day = now_tz().date()
-        hh = _apply_ampm(int(m.group(1)), m.group(3) or '')
-        mm = int(m.group(2) or 0)
-        return tz.localize(datetime(day.year, day.month, day.day, hh, mm))
-
-    return None
+    return parse(text).when
 
 def normalize_category_hint(text: str):
-    # extract last word after 'on'/'for' etc. fallback None
-    m = re.search(r'(?:on|for|на|для)\s+([\w\- ]{3,30})$', text.strip(), re.IGNORECASE)
-    if m:
-        return m.group(1).strip().title()
-    # try simple nouns like 'food', 'transport', 'salary'
-    m2 = re.search(r'\b(food|grocer|transport|bus|taxi|dining|meal|salary|bonus)\w*', text, re.IGNORECASE)
-    return m2.group(1).title() if m2 else None
+    # trailing words after 'on'/'for' etc., else a known category noun, else None
+    return parse(text).category_hint
 
 def summarize_task_title(text: str) -> str:
     """Produce a short task title from a free-form request.
@@ -88,21 +317,4 @@ def summarize_task_title(text: str) -> str:
     - "Call mom at 7" -> "Call mom"
     Fallback: first 60 chars, capitalized.
     """
-    s = (text or '').strip()
-    # meeting with <name>
-    m = re.search(r'meeting\s+with\s+([\w\- ]{2,40})', s, re.IGNORECASE)
-    if m:
-        who = re.sub(r'\s+at\b.*$', '', m.group(1).strip(), flags=re.IGNORECASE)
-        return f"Meeting with {who.title()}".strip()
-    # call <someone>
-    m = re.search(r'\bcall\s+([\w\- ]{2,40})', s, re.IGNORECASE)
-    if m:
-        who = re.sub(r'\s+at\b.*$', '', m.group(1).strip(), flags=re.IGNORECASE)
-        return f"Call {who.title()}"
-    # pay / send / email
-    m = re.search(r'\b(email|pay|send)\s+([\w\- ]{2,40})', s, re.IGNORECASE)
-    if m:
-        return f"{m.group(1).title()} {m.group(2).title()}"
-    # Default
-    s = s[0:60]
-    return s[:1].upper() + s[1:]
+    return parse(text).title
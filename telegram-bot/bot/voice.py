@@ -0,0 +1,207 @@
+import os, asyncio, struct, tempfile, time, logging
+from dataclasses import dataclass
+from statistics import median
+from typing import BinaryIO
+from .openai_client import transcribe_audio
+from .tracing import traced
+
+# Telegram voice notes are Ogg/Opus. They are streamed to a spooled temp file
+# (in memory up to VOICE_SPOOL_BYTES, then on disk); long notes are cut at
+# pauses into standalone Ogg files that are transcribed concurrently.
+VOICE_SPOOL_BYTES = int(os.getenv("VOICE_SPOOL_BYTES", str(1 << 20)))
+# Notes shorter than this (s) are transcribed in one call
+VOICE_SPLIT_MIN_SECONDS = float(os.getenv("VOICE_SPLIT_MIN_SECONDS", "45"))
+# Chunks are cut at the first pause after VOICE_CHUNK_SECONDS, or at the quietest spot before VOICE_CHUNK_MAX_SECONDS
+VOICE_CHUNK_SECONDS = float(os.getenv("VOICE_CHUNK_SECONDS", "25"))
+VOICE_CHUNK_MAX_SECONDS = float(os.getenv("VOICE_CHUNK_MAX_SECONDS", "45"))
+VOICE_MAX_PARALLEL = int(os.getenv("VOICE_MAX_PARALLEL", "4"))
+# A page whose bitrate is below this fraction of the note's median counts as a pause
+VOICE_SILENCE_RATIO = float(os.getenv("VOICE_SILENCE_RATIO", "0.5"))
+
+_OPUS_RATE = 48000  # Ogg/Opus granule positions are always 48 kHz samples
+_CONTINUED, _BOS, _EOS = 0x01, 0x02, 0x04
+
+_stats = {"notes": 0, "split_notes": 0, "chunks": 0, "audio_seconds": 0.0, "bytes": 0, "seconds_total": 0.0}
+
+def voice_stats() -> dict:
+    return dict(_stats)
+
+def _crc_table() -> list[int]:
+    table = []
+    for i in range(256):
+        r = i << 24
+        for _ in range(8):
+            r = ((r << 1) ^ 0x04C11DB7) if r & 0x80000000 else (r << 1)
+        table.append(r & 0xFFFFFFFF)
+    return table
+
+_CRC_TABLE = _crc_table()
+
+def _ogg_crc(data: bytes | bytearray) -> int:
+    crc = 0
+    for b in data:
+        crc = ((crc << 8) & 0xFFFFFFFF) ^ _CRC_TABLE[((crc >> 24) ^ b) & 0xFF]
+    return crc
+
+@dataclass(slots=True)
+class _Page:
+    offset: int
+    size: int
+    flags: int
+    granule: int   # -1 when no packet ends on this page
+    packets: int   # packets that end on this page
+
+def _scan(f: BinaryIO) -> list[_Page]:
+    """Read page headers only (bodies are skipped); raises ValueError if this is not a single Ogg stream."""
+    pages: list[_Page] = []
+    serial = None
+    offset = 0
+    f.seek(0)
+    while True:
+        hdr = f.read(27)
+        if not hdr:
+            break
+        if len(hdr) < 27 or hdr[:4] != b"OggS":
+            raise ValueError("not an Ogg stream")
+        flags = hdr[5]
+        granule, page_serial = struct.unpack_from("<qI", hdr, 6)
+        if serial is None:
+            serial = page_serial
+        elif page_serial != serial:
+            raise ValueError("multiplexed Ogg stream")
+        lacing = f.read(hdr[26])
+        body = sum(lacing)
+        f.seek(body, os.SEEK_CUR)
+        size = 27 + len(lacing) + body
+        pages.append(_Page(offset, size, flags, granule, sum(1 for v in lacing if v < 255)))
+        offset += size
+    return pages
+
+def _first_audio_page(pages: list[_Page]) -> int:
+    # OpusHead and OpusTags are the first two packets; audio starts on a fresh page
+    seen = 0
+    for i, p in enumerate(pages):
+        seen += p.packets
+        if seen >= 2:
+            return i + 1
+    raise ValueError("missing Opus headers")
+
+def _plan_cuts(pages: list[_Page], first: int) -> list[tuple[int, int]]:
+    """Split audio pages [first, n) into ranges ending at pauses."""
+    n = len(pages)
+    ends = []       # end time (s) of each audio page
+    rates = []      # bytes per second of each audio page (None if it has no duration)
+    prev = 0
+    for p in pages[first:]:
+        g = p.granule if p.granule >= 0 else prev
+        dur = (g - prev) / _OPUS_RATE
+        rates.append(p.size / dur if dur > 0 else None)
+        ends.append(g / _OPUS_RATE)
+        prev = g
+    total = ends[-1] if ends else 0.0
+    known = [r for r in rates if r is not None]
+    if total < VOICE_SPLIT_MIN_SECONDS or not known:
+        return [(first, n)]
+    quiet = VOICE_SILENCE_RATIO * median(known)
+
+    cuts = []
+    start = first
+    while True:
+        t0 = ends[start - first - 1] if start > first else 0.0
+        best = cut = None
+        best_rate = float("inf")
+        for i in range(start, n):
+            k = i - first
+            elapsed = ends[k] - t0
+            # Only cut where a packet ends and the next page starts a new one
+            if elapsed < VOICE_CHUNK_SECONDS or rates[k] is None or i + 1 >= n or pages[i + 1].flags & _CONTINUED:
+                continue
+            if total - ends[k] < VOICE_CHUNK_SECONDS / 2:
+                break  # keep a short tail with this chunk
+            if rates[k] < best_rate:
+                best, best_rate = i, rates[k]
+            if rates[k] < quiet:
+                cut = i
+                break
+            if elapsed >= VOICE_CHUNK_MAX_SECONDS:
+                cut = best
+                break
+        if cut is None:
+            cuts.append((start, n))
+            return cuts
+        cuts.append((start, cut + 1))
+        start = cut + 1
+
+def _write_pages(src: BinaryIO, out: BinaryIO, pages: list[_Page], base_granule: int) -> None:
+    """Copy pages into ``out`` as one stream: renumbered, granules rebased, EOS on the last page."""
+    for seq, p in enumerate(pages):
+        src.seek(p.offset)
+        raw = bytearray(src.read(p.size))
+        flags = raw[5] & ~_EOS
+        if seq == len(pages) - 1:
+            flags |= _EOS
+        raw[5] = flags
+        if p.granule >= 0:
+            struct.pack_into("<q", raw, 6, max(0, p.granule - base_granule))
+        struct.pack_into("<II", raw, 18, seq, 0)
+        struct.pack_into("<I", raw, 22, _ogg_crc(raw))
+        out.write(raw)
+    out.seek(0)
+
+def split_ogg_opus(src: BinaryIO) -> list[BinaryIO] | None:
+    """Cut an Ogg/Opus file at pauses into standalone Ogg files.
+
+    Returns None when the note is short enough to send whole. Raises
+    ValueError when ``src`` is not a plain Ogg/Opus stream.
+    """
+    pages = _scan(src)
+    first = _first_audio_page(pages)
+    cuts = _plan_cuts(pages, first)
+    if len(cuts) < 2:
+        return None
+    headers = pages[:first]
+    chunks = []
+    for a, b in cuts:
+        base = next((p.granule for p in reversed(pages[first:a]) if p.granule >= 0), 0)
+        out = tempfile.SpooledTemporaryFile(max_size=VOICE_SPOOL_BYTES)
+        _write_pages(src, out, headers + pages[a:b], base)
+        chunks.append(out)
+    return chunks
+
+@traced
+async def transcribe_voice(bot, voice) -> str:
+    """Download a voice note without holding it in memory and transcribe it, in parallel chunks when long."""
+    t0 = time.monotonic()
+    file = await bot.get_file(voice.file_id)
+    with tempfile.SpooledTemporaryFile(max_size=VOICE_SPOOL_BYTES) as src:
+        await bot.download_file(file.file_path, destination=src)
+        size = src.seek(0, os.SEEK_END)
+        try:
+            chunks = await asyncio.to_thread(split_ogg_opus, src)
+        except ValueError as e:
+            logging.info("Voice note not split: %s", e)
+            chunks = None
+        if not chunks:
+            text = await transcribe_audio(src)
+            n = 1
+        else:
+            sem = asyncio.Semaphore(VOICE_MAX_PARALLEL)
+
+            async def _one(chunk: BinaryIO) -> str:
+                async with sem:
+                    return (await transcribe_audio(chunk)).strip()
+
+            try:
+                texts = await asyncio.gather(*(_one(c) for c in chunks))
+            finally:
+                for c in chunks:
+                    c.close()
+            text = " ".join(t for t in texts if t)
+            n = len(chunks)
+            _stats["split_notes"] += 1
+    _stats["notes"] += 1
+    _stats["chunks"] += n
+    _stats["bytes"] += size
+    _stats["audio_seconds"] += voice.duration or 0
+    _stats["seconds_total"] += time.monotonic() - t0
+    return text
@@ -0,0 +1,119 @@
+import asyncio, logging
+from collections import deque
+from typing import Any, Awaitable, Callable, Hashable
+
+class ChatWorkerPool:
+    """Bounded pool of asyncio workers that keeps items of one chat in order.
+
+    ``submit(key, item)`` queues an item behind the other items with the same
+    key (the chat id); different keys are handled concurrently by up to
+    ``workers`` tasks. At most ``max_pending`` items are queued or running at
+    once; beyond that ``submit`` returns False so the caller can push back.
+    """
+
+    def __init__(self, handle: Callable[[Any], Awaitable[None]], workers: int, max_pending: int, name: str = "updates"):
+        self.handle = handle
+        self.workers = workers
+        self.max_pending = max_pending
+        self.name = name
+        self.pending = 0
+        self.in_flight = 0
+        self.rejected = 0
+        self.processed = 0
+        self._lanes: dict[Hashable, deque] = {}
+        # Keys with queued items and no worker on them; each key appears at most once
+        self._ready: asyncio.Queue = asyncio.Queue()
+        self._tasks: list[asyncio.Task] = []
+        self._idle = asyncio.Event()
+        self._idle.set()
+        self._closing = False
+
+    def start(self) -> None:
+        if not self._tasks:
+            self._closing = False
+            self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+
+    def submit(self, key: Hashable, item: Any, force: bool = False) -> bool:
+        """Queue ``item`` behind earlier items with the same key.
+
+        ``force`` skips the max_pending check (used for replayed work that was
+        already accepted once).
+        """
+        if self._closing or (self.pending >= self.max_pending and not force):
+            self.rejected += 1
+            return False
+        self.pending += 1
+        self._idle.clear()
+        lane = self._lanes.get(key)
+        if lane is None:
+            self._lanes[key] = deque([item])
+            self._ready.put_nowait(key)
+        else:
+            lane.append(item)
+        return True
+
+    async def _worker(self) -> None:
+        while True:
+            key = await self._ready.get()
+            lane = self._lanes[key]
+            item = lane.popleft()
+            self.in_flight += 1
+            try:
+                await self.handle(item)
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logging.exception("%s worker: handler failed", self.name)
+            finally:
+                self.in_flight -= 1
+                self.pending -= 1
+                self.processed += 1
+                if lane:
+                    # Back of the line, so one busy chat cannot starve the others
+                    self._ready.put_nowait(key)
+                else:
+                    del self._lanes[key]
+                if self.pending == 0:
+                    self._idle.set()
+
+    async def drain(self, timeout: float) -> bool:
+        """Stop accepting work, wait up to ``timeout`` for queued items, then stop the workers.
+
+        Returns False if items were still pending when the timeout expired.
+        """
+        self._closing = True
+        try:
+            await asyncio.wait_for(self._idle.wait(), timeout)
+            drained = True
+        except asyncio.TimeoutError:
+            drained = False
+            logging.warning("%s pool: %d item(s) left after %.0fs drain", self.name, self.pending, timeout)
+        for t in self._tasks:
+            t.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        return drained
+
+    def stats(self) -> dict:
+        return {
+            "workers": self.workers,
+            "max_pending": self.max_pending,
+            "pending": self.pending,
+            "queued": self.pending - self.in_flight,
+            "in_flight": self.in_flight,
+            "chats": len(self._lanes),
+            "processed": self.processed,
+            "rejected": self.rejected,
+        }
+
+def update_chat_key(update) -> Hashable:
+    """Chat id an aiogram Update belongs to (user id, then update id, as fallbacks)."""
+    try:
+        event = update.event
+    except Exception:
+        return update.update_id
+    chat = getattr(event, "chat", None) or getattr(getattr(event, "message", None), "chat", None)
+    if chat is not None:
+        return chat.id
+    user = getattr(event, "from_user", None)
+    return user.id if user is not None else update.update_id
@@ -1,4 +1,5 @@
 -- See README for explanations
+-- 1) Telegram account ↔ app user links
 create table if not exists public.telegram_links (
   id uuid primary key default gen_random_uuid(),
   user_id uuid not null references auth.users(id) on delete cascade,
@@ -6,6 +7,7 @@ create table if not exists public.telegram_links (
   created_at timestamptz not null default now()
 );
 
+-- 2) One-time /link codes
 create table if not exists public.telegram_link_codes (
   code text primary key,
   telegram_user_id bigint not null,
@@ -13,3 +15,17 @@ create table if not exists public.telegram_link_codes (
   consumed_by uuid null references auth.users(id) on delete set null
 );
 create index if not exists idx_tlc_created_at on public.telegram_link_codes(created_at);
+
+-- 3) Weekly digests precomputed by the bot's scheduler (served by /week while fresh)
+create table if not exists public.telegram_weekly_digests (
+  user_id uuid not null references auth.users(id) on delete cascade,
+  period_start date not null,
+  timezone text not null,
+  text text not null,
+  summary jsonb,
+  created_at timestamptz not null default now(),
+  sent_at timestamptz,
+  primary key (user_id, period_start)
+);
+create index if not exists idx_twd_user_created_at on public.telegram_weekly_digests(user_id, created_at desc);
+create index if not exists idx_twd_period_start on public.telegram_weekly_digests(period_start);